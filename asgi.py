@@ -0,0 +1,6 @@
+from linkapp.gateway.asgi import AsyncGatewayService
+from linkapp.gateway.config import GatewayConfig
+
+config = GatewayConfig()
+
+app = AsyncGatewayService(config)
\ No newline at end of file
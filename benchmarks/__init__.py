@@ -0,0 +1,6 @@
+"""
+Benchmarks for the gateway, run each one as a module from the top of the
+repository, eg.
+
+    python -m benchmarks.templates
+"""
@@ -0,0 +1,237 @@
+"""
+Throughput and latency of GatewayService on each route of its module
+docstring, against the stub backends of benchmarks.stubs.
+
+    python -m benchmarks.load [--requests N] [--concurrency C] [--latency S]
+                              [--error-rate R] [--bulk] [--output FILE]
+
+Each route gets its own run of N requests from C threads, calling the WSGI
+app in-process. The gateway is configured from the LINKAPP_* environment
+variables as usual, except for the backend urls, so two configurations are
+compared by running this twice with different variables. The link cache is
+off unless --redis-url is given, the page cache is on as it is by default,
+LINKAPP_PAGE_CACHE_SIZE=0 measures the listings cold.
+
+Prints JSON: requests/s, p50/p95/p99 latency in milliseconds, response
+statuses and backend calls per request of every route, and the commit it
+ran on, so the output of two commits can be diffed.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import subprocess
+import argparse
+import base64
+import json
+import time
+import itertools
+
+from webob import Request
+
+from linkapp.gateway.config import GatewayConfig
+from linkapp.gateway.compress import CompressionMiddleware
+from linkapp.gateway.wsgi import GatewayService
+
+from . import stubs
+
+AUTHORIZATION = "Basic " + base64.b64encode(b"bench:password").decode('ascii')
+
+# name, method, path ({id} is filled with a link id), whether it needs a
+# logged in user
+ROUTES = [
+    ("listing", "GET", "/", False),
+    ("listing_page", "GET", "/page/2", False),
+    ("listing_by_tag", "GET", "/tag/python", False),
+    ("listing_by_tag_page", "GET", "/tag/python/page/2", False),
+    ("static", "GET", "/static/style.css", False),
+    ("new", "GET", "/new", True),
+    ("save", "POST", "/save/{id}", True),
+    ("edit", "GET", "/edit/{id}", True),
+    ("view", "GET", "/view/{id}", False),
+    ("reading_list", "GET", "/reading-list", True),
+    ("reading_list_add", "GET", "/reading-list/add/{id}", True),
+    ("reading_list_read", "GET", "/reading-list/read/{id}", True),
+    ("import", "POST", "/import", True),
+    ("metrics", "GET", "/metrics", False),
+]
+
+FORM = {
+    'page_title': "A link saved by the benchmark",
+    'desc_text': "Saved over and over again",
+    'url_address': "http://example.com/benchmark",
+    'tags': "python|performance"
+}
+
+# (content type, body) of the routes that take an upload rather than FORM
+UPLOADS = {
+    'import': ('application/x-ndjson', "".join(
+        json.dumps(dict(FORM, url_address="http://example.com/imported/{}".format(number),
+                        tags=["python", "imported"])) + "\n"
+        for number in range(10)
+    ).encode('utf-8'))
+}
+
+
+def percentile(ordered, fraction):
+    """
+    Nearest-rank percentile of the sorted list ordered.
+    """
+    if not ordered:
+        return None
+
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))]
+
+
+def commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def make_request(method, path, authorized, accept_encoding=None, upload=None):
+    kwargs = {'method': method}
+
+    if upload is not None:
+        kwargs['content_type'], kwargs['body'] = upload
+    elif method == "POST":
+        kwargs['POST'] = FORM
+
+    req = Request.blank(path, **kwargs)
+
+    if authorized:
+        req.authorization = AUTHORIZATION
+
+    if accept_encoding:
+        req.accept_encoding = accept_encoding
+
+    return req
+
+
+def run_route(app, backends, route, requests, concurrency, warmup, accept_encoding=None):
+    name, method, path, authorized = route
+
+    ids = itertools.cycle(backends.data.ids)
+
+    def call(link_id):
+        req = make_request(method, path.format(id=link_id), authorized, accept_encoding, UPLOADS.get(name))
+
+        start = time.perf_counter()
+        res = req.get_response(app)
+        # streamed responses (listings, import reports) are only produced
+        # as they're read
+        res.body
+        return time.perf_counter() - start, res.status_int
+
+    for _ in range(warmup):
+        call(next(ids))
+
+    backends.reset()
+
+    with ThreadPoolExecutor(concurrency) as executor:
+        start = time.perf_counter()
+        results = list(executor.map(call, [next(ids) for _ in range(requests)]))
+        elapsed = time.perf_counter() - start
+
+    calls = backends.reset()
+
+    latencies = sorted(latency for latency, status in results)
+
+    statuses = {}
+
+    for latency, status in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+
+    return {
+        'method': method,
+        'path': path,
+        'requests': requests,
+        'seconds': round(elapsed, 4),
+        'requests_per_second': round(requests / elapsed, 2),
+        'latency_ms': {
+            'p50': round(percentile(latencies, 0.50) * 1000, 3),
+            'p95': round(percentile(latencies, 0.95) * 1000, 3),
+            'p99': round(percentile(latencies, 0.99) * 1000, 3),
+            'max': round(latencies[-1] * 1000, 3)
+        },
+        'statuses': statuses,
+        'backend_calls_per_request': {backend: round(count / requests, 3) for backend, count in calls.items()},
+        'backend_calls': calls
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200, help="requests per route")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--warmup", type=int, default=10, help="requests per route before measuring")
+    parser.add_argument("--links", type=int, default=200, help="links in the stub link service")
+    parser.add_argument("--latency", type=float, default=0.005, help="seconds each backend call takes")
+    parser.add_argument("--jitter", type=float, default=0.5, help="fraction of latency it varies by")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of backend calls answered with a 503")
+    parser.add_argument("--bulk", action="store_true", help="stubs serve the bulk lookups, set LINKAPP_BULK_PATH=/bulk to use them")
+    parser.add_argument("--redis-url", default=None, help="turns on the link cache")
+    parser.add_argument("--compress", action="store_true", help="wrap the app in CompressionMiddleware, as wsgi.py does")
+    parser.add_argument("--route", action="append", dest="routes", help="only run this route (repeatable)")
+    parser.add_argument("--output", default=None, help="write the JSON here instead of stdout")
+    args = parser.parse_args()
+
+    backends = stubs.StubBackends(args.links, latency=args.latency, jitter=args.jitter,
+                                  error_rate=args.error_rate, bulk=args.bulk)
+    urls = backends.start()
+
+    options = {
+        'link_service_url': urls['link'],
+        'tag_service_url': urls['tag'],
+        'authorization_service_url': urls['authorization'],
+        'readinglist_service_url': urls['readinglist'],
+        'rabbit_url': "amqp://localhost/",
+    }
+
+    if args.redis_url is None:
+        options['redis_url'] = "redis://localhost:6379/0"
+        options['link_cache_ttl'] = 0
+    else:
+        options['redis_url'] = args.redis_url
+
+    config = GatewayConfig(**options)
+    service = GatewayService(config)
+
+    app = service
+    accept_encoding = None
+
+    if args.compress:
+        app = CompressionMiddleware(service,
+                                    min_size=config.compress_min_size,
+                                    level=config.compress_level,
+                                    cache_size=config.compress_cache_size,
+                                    registry=service.registry)
+        accept_encoding = "gzip"
+
+    routes = [route for route in ROUTES if not args.routes or route[0] in args.routes]
+
+    results = {}
+
+    for route in routes:
+        results[route[0]] = run_route(app, backends, route, args.requests, args.concurrency,
+                                      args.warmup, accept_encoding)
+
+    backends.stop()
+
+    report = {
+        'commit': commit(),
+        'time': time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        'options': vars(args),
+        'routes': results
+    }
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+
+    if args.output is None:
+        print(output)
+    else:
+        with open(args.output, "w") as output_file:
+            output_file.write(output + "\n")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""
+Cost of dispatching each of the gateway's routes, the old linear scan over
+a dict of regular expressions vs. the Router bucketed by first segment.
+
+    python -m benchmarks.routing [--number N]
+"""
+
+import argparse
+import re
+import timeit
+
+from linkapp.gateway.router import Router
+
+
+LINK_ID = "0123456789abcdef0123456789abcdef"
+
+PATHS = [
+    "/",
+    "/page/3",
+    "/tag/python",
+    "/tag/python/page/2",
+    "/static/js/jquery-ui.js",
+    "/new",
+    "/reading-list",
+    "/reading-list/add/" + LINK_ID,
+    "/reading-list/read/" + LINK_ID,
+    "/edit/" + LINK_ID,
+    "/save/" + LINK_ID,
+    "/view/" + LINK_ID,
+]
+
+PATTERNS = [
+    (("", "page"), r"^/(page/(?P<page>\d+))?$", "listing"),
+    ("tag", r"^/tag/(?P<tag>[^/]+)(/page/(?P<page>\d+))?$", "listing_by_tag"),
+    ("static", r"^/static/(?P<path>.*)$", "static"),
+    ("new", r"^/new$", "new"),
+    ("reading-list", r"^/reading-list$", "reading_list"),
+    ("reading-list", r"^/reading-list/add/?(?P<link_id>[^/]{32})?$", "reading_list_add"),
+    ("reading-list", r"^/reading-list/read/?(?P<link_id>[^/]{32})?$", "reading_list_read"),
+    ("edit", r"^/edit/?(?P<link_id>[^/]{32})?$", "edit"),
+    ("save", r"^/save/?(?P<link_id>[^/]{32})?$", "save"),
+    ("view", r"^/view/?(?P<link_id>[^/]{32})?$", "view"),
+]
+
+
+def linear_scan(path_map):
+    def dispatch(path):
+        for regexp, name in path_map.items():
+            match = re.match(regexp, path)
+            if match:
+                return name, match.groupdict()
+
+    return dispatch
+
+
+def routed(router):
+    def dispatch(path):
+        route, kwargs = router.match(path)
+        return route.name, kwargs
+
+    return dispatch
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--number", type=int, default=20000)
+    args = parser.parse_args()
+
+    path_map = {re.compile(pattern): name for segments, pattern, name in PATTERNS}
+
+    router = Router()
+    for segments, pattern, name in PATTERNS:
+        router.add(segments, pattern, None, name=name)
+
+    dispatchers = {'linear scan': linear_scan(path_map), 'Router': routed(router)}
+
+    for path in PATHS:
+        assert dispatchers['linear scan'](path) == dispatchers['Router'](path), path
+
+    print("{:<52} {:>12} {:>12}".format("path", *["{} ns".format(name) for name in dispatchers]))
+
+    totals = dict.fromkeys(dispatchers, 0.0)
+
+    for path in PATHS:
+        row = []
+
+        for name, dispatch in dispatchers.items():
+            seconds = timeit.timeit(lambda: dispatch(path), number=args.number)
+            totals[name] += seconds
+            row.append(seconds / args.number * 1e9)
+
+        print("{:<52} {:>12.0f} {:>12.0f}".format(path, *row))
+
+    print("{:<52} {:>12.0f} {:>12.0f}".format("mean", *[total / args.number / len(PATHS) * 1e9 for total in totals.values()]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,306 @@
+"""
+Stand-ins for the link, tag, authorization and reading list services, each
+an HTTP/1.1 server on a local port in a background thread, answering from
+made up data after a configurable delay and failing (503) at a configurable
+rate. Used by benchmarks.load, can be run on their own to point a gateway at:
+
+    python -m benchmarks.stubs [--latency S] [--error-rate R]
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib import parse
+import argparse
+import threading
+import random
+import json
+import time
+import re
+
+TAGS = ["python", "web", "performance", "databases", "design", "testing", "tools", "linux"]
+
+PER_PAGE = 10
+
+
+def link_id(number):
+    return "{:032x}".format(number)
+
+
+def paginate(ids, page, per_page=PER_PAGE):
+    last = max(1, (len(ids) + per_page - 1) // per_page)
+    page = min(max(1, page), last)
+
+    return {
+        'links': ids[(page - 1) * per_page:page * per_page],
+        'pagination': {
+            'count': len(ids),
+            'last': last,
+            'next': page + 1 if page < last else None,
+            'previous': page - 1 if page > 1 else None
+        }
+    }
+
+
+class Data:
+    """
+    The links, their tags and the reading lists the stubs answer from.
+    """
+
+    def __init__(self, links=200, seed=0):
+        rng = random.Random(seed)
+
+        self.lock = threading.Lock()
+        self.links = {}
+        self.tags = {}
+        self.reading_lists = {}
+
+        for number in range(links):
+            key = link_id(number)
+
+            self.links[key] = {
+                'page_title': "Link number {}".format(number),
+                'desc_text': "What link number {} is about, and why it's worth a read. ".format(number) * 3,
+                'url_address': "http://example.com/articles/{}".format(number),
+                'author': "user{}".format(number % 7),
+                'created': "2017-01-{:02d}T12:00:00Z".format(number % 28 + 1)
+            }
+            self.tags[key] = rng.sample(TAGS, 3)
+
+        self.ids = sorted(self.links)
+
+    def tagged(self, tag):
+        return [key for key in self.ids if tag in self.tags.get(key, ())]
+
+    def add(self, record):
+        with self.lock:
+            key = link_id(len(self.links) + 1000000)
+            self.links[key] = record
+            self.ids = sorted(self.links)
+
+        return key
+
+
+class StubService:
+    """
+    One backend. handle returns (status, body) for a request, answered
+    after latency seconds (give or take jitter of it), error_rate of the
+    time with a 503 instead.
+    """
+
+    def __init__(self, data, latency=0.005, jitter=0.5, error_rate=0.0, bulk=False):
+        self.data = data
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.bulk = bulk
+        self.lock = threading.Lock()
+        self.calls = 0
+
+    def count(self):
+        with self.lock:
+            self.calls += 1
+
+    def reset(self):
+        with self.lock:
+            calls, self.calls = self.calls, 0
+
+        return calls
+
+    def respond(self, method, path, query, body):
+        self.count()
+
+        if self.latency > 0:
+            time.sleep(self.latency * random.uniform(1 - self.jitter, 1 + self.jitter))
+
+        if self.error_rate and random.random() < self.error_rate:
+            return 503, {'error': 'unavailable'}
+
+        return self.handle(method, path, query, body)
+
+    def handle(self, method, path, query, body):
+        return 404, {}
+
+    def bulk_ids(self, query):
+        return [key for key in query.get('ids', [""])[0].split(",") if key]
+
+
+class LinkStub(StubService):
+
+    def handle(self, method, path, query, body):
+        if path == "/" and method == "GET":
+            return 200, paginate(self.data.ids, int(query.get('page', ["1"])[0]))
+
+        if path == "/" and method == "POST":
+            return 200, self.data.add(body)
+
+        if path == "/bulk" and self.bulk:
+            return 200, {key: self.data.links[key] for key in self.bulk_ids(query) if key in self.data.links}
+
+        key = path[1:]
+
+        if key not in self.data.links:
+            return 404, {}
+
+        if method == "PUT":
+            self.data.links[key] = body
+            return 200, True
+
+        return 200, self.data.links[key]
+
+
+class TagStub(StubService):
+
+    def handle(self, method, path, query, body):
+        if path == "/link/bulk" and self.bulk:
+            return 200, {key: self.data.tags.get(key, []) for key in self.bulk_ids(query)}
+
+        match = re.match(r"^/link/([^/]+)$", path)
+
+        if match:
+            key = match.group(1)
+
+            if method in ("POST", "PUT"):
+                self.data.tags[key] = body['tags']
+                return 200, True
+
+            return 200, self.data.tags.get(key, [])
+
+        match = re.match(r"^/tag/([^/]+)$", path)
+
+        if match:
+            return 200, paginate(self.data.tagged(match.group(1)), int(query.get('page', ["1"])[0]))
+
+        return 404, {}
+
+
+class AuthorizationStub(StubService):
+
+    def handle(self, method, path, query, body):
+        # every user's password is "password"
+        return 200, body == "password"
+
+
+class ReadingListStub(StubService):
+
+    def handle(self, method, path, query, body):
+        parts = path.strip("/").split("/")
+        user = parts[0]
+
+        with self.data.lock:
+            reading_list = self.data.reading_lists.setdefault(user, self.data.ids[:5])
+
+            if method == "POST":
+                if body not in reading_list:
+                    reading_list.append(body)
+
+                return 200, True
+
+            if method == "PUT":
+                if parts[1] in reading_list:
+                    reading_list.remove(parts[1])
+
+                return 200, True
+
+            return 200, list(reading_list)
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # headers and body go out in two writes, Nagle would hold the body back
+    # for the client's delayed ACK
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def answer(self):
+        length = int(self.headers.get('content-length') or 0)
+        raw = self.rfile.read(length) if length else b''
+        body = json.loads(raw.decode('utf-8')) if raw else None
+
+        parsed = parse.urlparse(self.path)
+        status, payload = self.server.stub.respond(self.command, parsed.path, parse.parse_qs(parsed.query), body)
+
+        content = json.dumps(payload).encode('utf-8')
+
+        try:
+            self.send_response(status)
+            self.send_header('content-type', 'application/json')
+            self.send_header('content-length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+        except (BrokenPipeError, ConnectionResetError):
+            # the gateway gave up on the call (timeout, deadline)
+            self.close_connection = True
+
+    do_GET = do_POST = do_PUT = answer
+
+
+class Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+
+class StubBackends:
+    """
+    The four stubs sharing one Data, served on local ports once started.
+    """
+
+    def __init__(self, links=200, latency=0.005, jitter=0.5, error_rate=0.0, bulk=False):
+        self.data = Data(links)
+
+        options = {'latency': latency, 'jitter': jitter, 'error_rate': error_rate, 'bulk': bulk}
+
+        self.stubs = {
+            'link': LinkStub(self.data, **options),
+            'tag': TagStub(self.data, **options),
+            'authorization': AuthorizationStub(self.data, **options),
+            'readinglist': ReadingListStub(self.data, **options),
+        }
+        self.servers = {}
+
+    def start(self):
+        for name, stub in self.stubs.items():
+            server = Server(('127.0.0.1', 0), Handler)
+            server.stub = stub
+
+            threading.Thread(target=server.serve_forever, name="stub-" + name, daemon=True).start()
+
+            self.servers[name] = server
+
+        return self.urls()
+
+    def urls(self):
+        return {name: "http://127.0.0.1:{}".format(server.server_port) for name, server in self.servers.items()}
+
+    def reset(self):
+        """
+        Calls made to each stub since the last reset.
+        """
+        return {name: stub.reset() for name, stub in self.stubs.items()}
+
+    def stop(self):
+        for server in self.servers.values():
+            server.shutdown()
+            server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--links", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.005)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--bulk", action="store_true")
+    args = parser.parse_args()
+
+    backends = StubBackends(args.links, latency=args.latency, error_rate=args.error_rate, bulk=args.bulk)
+
+    for name, url in backends.start().items():
+        print("LINKAPP_{}_SERVICE_URL={}".format(name.upper(), url))
+
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        backends.stop()
+
+
+if __name__ == '__main__':
+    main()
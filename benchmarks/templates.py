@@ -0,0 +1,87 @@
+"""
+Per-render cost of the listing page, pystache loading and parsing the
+template files on every render vs. the parsed copies kept by TemplateCache,
+and assembling the entries from the fragments kept by FragmentCache.
+
+    python -m benchmarks.templates [--number N]
+"""
+
+import argparse
+import timeit
+
+import pystache
+from pkg_resources import resource_filename
+
+from linkapp.gateway.rendering import TemplateCache, FragmentCache
+
+
+def listing_context(count=10):
+    links = []
+
+    for i in range(count):
+        links.append({
+            'key': "{:032x}".format(i),
+            'page_title': "Link number {}".format(i),
+            'desc_text': "A description of link number {} & why it matters".format(i),
+            'url_address': "http://example.com/{}".format(i),
+            'author': "someone",
+            'created': "2017-01-01T00:00:00Z",
+            'tags': [{'name': "tag{}".format(j)} for j in range(3)]
+        })
+
+    return {
+        'links': links,
+        'count': 100,
+        'last': 10,
+        'next': 2,
+        'prefix': "/",
+        'user': "someone"
+    }
+
+
+def render_page(renderer, fragments, context):
+    """
+    Render the listing page the way the gateway does, each link with the
+    entry template then the page around them.
+    """
+    entry_context = {'prefix': context['prefix'], 'user': True}
+
+    if fragments is None:
+        entries = "".join(renderer.render_name('entry', entry_context, link) for link in context['links'])
+    else:
+        entries = fragments.join('entry', context['links'], entry_context, variant=True)
+
+    return renderer.render_name('list', dict(context, entries=entries))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--number", type=int, default=2000)
+    args = parser.parse_args()
+
+    directory = resource_filename("linkapp.gateway", "templates")
+    context = listing_context()
+
+    templates = TemplateCache(directory)
+
+    renderers = {
+        'pystache.Renderer': (pystache.Renderer(search_dirs=directory, file_extension='html'), None),
+        'TemplateCache': (templates, None),
+        'TemplateCache(reload=True)': (TemplateCache(directory, reload=True), None),
+        'FragmentCache': (templates, FragmentCache(templates)),
+    }
+
+    baseline = None
+
+    for name, (renderer, fragments) in renderers.items():
+        seconds = timeit.timeit(lambda: render_page(renderer, fragments, context), number=args.number)
+        per_render = seconds / args.number * 1e6
+
+        if baseline is None:
+            baseline = per_render
+
+        print("{:<28} {:>9.1f} us/render {:>6.2f}x".format(name, per_render, baseline / per_render))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,19 @@
 from . import wsgi
 from . import queue
 from . import config
-from . import wrapper
\ No newline at end of file
+from . import wrapper
+from . import hydrate
+from . import cache
+from . import rendering
+from . import router
+from . import assets
+from . import session
+from . import deadline
+from . import timing
+from . import retry
+from . import coalesce
+from . import compress
+from . import prefetch
+from . import metrics
+from . import log
+from . import asgi
\ No newline at end of file
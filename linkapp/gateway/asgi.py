@@ -0,0 +1,625 @@
+"""
+ASGI flavour of the gateway. Same routes, templates and errors as the WSGI
+GatewayService, but backend calls are made through AsyncServiceWrapper so a
+single process can wait on many of them at once.
+
+Needs the asgi extra (httpx), serve it with any ASGI server, eg.
+
+    uvicorn asgi:app
+"""
+
+import io
+import json
+import time
+import queue
+import asyncio
+import inspect
+
+import pika
+
+from webob import Request, Response
+
+from . import wrapper
+from . import hydrate
+from . import cache
+from . import prefetch
+from . import importer
+from . import deadline
+from . import timing
+from . import log
+from .wsgi import (GatewayService, BadRequest, NotFound, BackEndTrouble,
+                   TooManyRetries, Redirect, Unauthorized, Overloaded,
+                   ENTRIES_MARKER, STREAM_TROUBLE, streamed)
+
+logger = log.get_logger(__name__)
+
+
+def build_environ(scope, body):
+    """
+    A WSGI environ for an ASGI http scope, so requests can be handled with
+    webob like the WSGI app does.
+    """
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/{}'.format(scope.get('http_version', '1.1')),
+        'REMOTE_ADDR': client[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': io.StringIO(),
+        'wsgi.multithread': False,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+        elif name == 'CONTENT_LENGTH':
+            environ['CONTENT_LENGTH'] = value
+        else:
+            key = 'HTTP_' + name
+
+            if key in environ:
+                value = environ[key] + ',' + value
+
+            environ[key] = value
+
+    return environ
+
+
+async def read_body(receive):
+    body = []
+
+    while True:
+        message = await receive()
+        body.append(message.get('body', b''))
+
+        if not message.get('more_body'):
+            break
+
+    return b''.join(body)
+
+
+class ReceiveStream(io.RawIOBase):
+    """
+    The body of an ASGI request as a file, read (blocking) in a worker 
+    thread while feed passes it on from receive, at most size chunks ahead
+    of the reader. For uploads too big to be read whole before handling 
+    them.
+    """
+
+    def __init__(self, size=16):
+        self.chunks = queue.Queue(size)
+        self.buffer = b''
+        self.ended = False
+        self.stopped = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self.buffer and not self.ended:
+            chunk = self.chunks.get()
+
+            if chunk is None:
+                self.ended = True
+            else:
+                self.buffer = chunk
+
+        size = min(len(b), len(self.buffer))
+        b[:size] = self.buffer[:size]
+        self.buffer = self.buffer[size:]
+
+        return size
+
+    def put(self, chunk):
+        # gives up once the reader has stopped, nothing will make room
+        while not self.stopped:
+            try:
+                self.chunks.put(chunk, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    async def feed(self, receive):
+        try:
+            while True:
+                message = await receive()
+
+                if message['type'] != 'http.request':
+                    break
+
+                if message.get('body'):
+                    await asyncio.to_thread(self.put, message['body'])
+
+                if not message.get('more_body'):
+                    break
+        finally:
+            # a reader waiting on a disconnected client sees the body end
+            await asyncio.to_thread(self.put, None)
+
+    def stop(self):
+        self.stopped = True
+
+        # wake up a reader still waiting for a chunk
+        while True:
+            try:
+                self.chunks.get_nowait()
+            except queue.Empty:
+                break
+
+        self.chunks.put_nowait(None)
+
+
+class AsyncGatewayService(GatewayService):
+    """
+    The gateway as an ASGI application.
+
+    Handlers that talk to backends are coroutines here, the rest (static,
+    metrics) are the WSGI ones as is. Responses are still webob Responses,
+    or the gateway's error classes, and are sent through ASGI.
+    """
+
+    wrapper_class = wrapper.AsyncServiceWrapper
+
+    # routes handed the request body as it comes (a ReceiveStream), the 
+    # others get it read whole
+    streamed_uploads = frozenset(['import_links'])
+
+    def make_hydrator(self):
+        return hydrate.AsyncHydrator(self.link_service,
+                                     self.tag_service,
+                                     concurrency=self.config.hydration_concurrency)
+
+    def make_page_cache(self):
+        return cache.AsyncPageCache(soft_ttl=self.config.page_cache_soft_ttl,
+                                    hard_ttl=self.config.page_cache_hard_ttl,
+                                    size=self.config.page_cache_size,
+                                    errors=(wrapper.TooManyRetries, wrapper.BadRequest, wrapper.Overloaded),
+                                    registry=self.registry)
+
+    def make_prefetcher(self):
+        return prefetch.AsyncPrefetcher(self.page_cache,
+                                        rate=self.config.prefetch_rate,
+                                        queue_size=self.config.prefetch_queue_size,
+                                        registry=self.registry)
+
+    def make_importer(self):
+        return importer.AsyncLinkImporter(self.link_service,
+                                          self.tag_service,
+                                          concurrency=self.config.import_concurrency,
+                                          batch_size=self.config.import_batch_size,
+                                          registry=self.registry)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+
+        if scope['type'] != 'http':
+            return
+
+        started = time.monotonic()
+        timings = timing.Timings()
+
+        with timing.recording(timings), timing.phase('route'):
+            route, kwargs = self.router.match(scope['path'])
+
+        if route is None or route.name not in self.streamed_uploads:
+            req = Request(build_environ(scope, await read_body(receive)), charset="utf8")
+
+            return await self.respond(req, route, kwargs, timings, started, send)
+
+        upload = ReceiveStream()
+        feeding = asyncio.ensure_future(upload.feed(receive))
+
+        environ = build_environ(scope, b'')
+        environ['wsgi.input'] = upload
+        # the body ends with the client's, content-length or not
+        environ['wsgi.input_terminated'] = True
+
+        try:
+            await self.respond(Request(environ, charset="utf8"), route, kwargs, timings, started, send)
+        finally:
+            upload.stop()
+            feeding.cancel()
+
+    async def respond(self, req, route, kwargs, timings, started, send):
+        route_name = 'not_found'
+
+        try:
+            try:
+                with timing.recording(timings):
+                    if route is None:
+                        raise NotFound()
+
+                    route_name = route.name
+
+                    if req.method not in route.methods:
+                        raise BadRequest("Bad Request, Method not supported")
+
+                    # the profile also sees whatever else runs on the loop meanwhile
+                    with deadline.within(self.config.route_deadline(route_name)), self.profiler.request(req, route_name):
+                        res = route.handler(req, **kwargs)
+
+                        if inspect.isawaitable(res):
+                            res = await res
+
+            except BadRequest as e:
+                res = e
+            except wrapper.Overloaded:
+                res = Overloaded(retry_after=self.config.overload_retry_after)
+
+            # run the Response (or error) as a WSGI app, that takes care of
+            # conditional responses and the like
+            res = req.get_response(res)
+
+            if self.config.server_timing and not streamed(res.headerlist):
+                res.headers['Server-Timing'] = timings.header()
+        except Exception:
+            self.route_requests.inc(route=route_name, status='500')
+            logger.exception("%s %s failed", req.method, req.path)
+
+            await send({'type': 'http.response.start', 'status': 500, 'headers': []})
+            await send({'type': 'http.response.body', 'body': b''})
+
+            return
+
+        self.route_requests.inc(route=route_name, status=str(res.status_code))
+        self.route_latency.observe(time.monotonic() - started, route=route_name)
+
+        await send({
+            'type': 'http.response.start',
+            'status': res.status_code,
+            'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in res.headerlist]
+        })
+
+        app_iter = res.app_iter
+
+        try:
+            if hasattr(app_iter, '__aiter__'):
+                # streamed listings
+                async for chunk in app_iter:
+                    if chunk:
+                        await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            else:
+                for chunk in app_iter:
+                    if chunk:
+                        await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        finally:
+            if hasattr(app_iter, 'aclose'):
+                await app_iter.aclose()
+            elif hasattr(app_iter, 'close'):
+                app_iter.close()
+
+        await send({'type': 'http.response.body', 'body': b''})
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def close(self):
+        for backend in self.backends.values():
+            await backend.close()
+
+    async def authorize(self, req):
+        with timing.phase('auth'):
+            username, expires, credentials = self._session_or_credentials(req)
+
+            if username is None:
+                if credentials not in self.credential_cache:
+                    try:
+                        if not await self.authentication_service.post("/{}".format(credentials[0]), credentials[1], idempotent=True):
+                            raise Unauthorized()
+                    except wrapper.Unauthorized:
+                        raise Unauthorized()
+                    except wrapper.TooManyRetries:
+                        raise TooManyRetries()
+
+                    self.credential_cache.add(*credentials)
+
+                username = credentials[0]
+
+            return self._authorized(req, username, expires)
+
+    async def _getlink(self, link_id, process_tags=True):
+        link_id, link, error = (await self._lookup_links([link_id]))[0]
+
+        if error is not None:
+            raise error
+
+        return link
+
+    async def _getlinks(self, link_ids):
+        return self._present(await self._lookup_links(link_ids))
+
+    async def _lookup_links(self, link_ids):
+        dead = self.missing_links.known(link_ids)
+        # the cache talks to redis synchronously, keep it off the event loop
+        cached = await asyncio.to_thread(self.link_cache.get_many, [link_id for link_id in link_ids if link_id not in dead])
+        missing = [link_id for link_id in link_ids if link_id not in cached and link_id not in dead]
+        hydrated = {}
+
+        if missing:
+            hydrated = {entry[0]: entry for entry in await self.hydrator.hydrate_partial(missing)}
+
+            await asyncio.to_thread(self.link_cache.set_many, self._hydrated(hydrated.values()))
+
+        entries = []
+
+        for link_id in link_ids:
+            if link_id in dead:
+                entries.append((link_id, None, wrapper.NotFound()))
+            elif link_id in cached:
+                entries.append((link_id, cached[link_id], None))
+            else:
+                entries.append(hydrated[link_id])
+
+        return entries
+
+    async def _iter_links(self, link_ids):
+        dead = self.missing_links.known(link_ids)
+        cached = await asyncio.to_thread(self.link_cache.get_many, [link_id for link_id in link_ids if link_id not in dead])
+        missing = [link_id for link_id in link_ids if link_id not in cached and link_id not in dead]
+
+        hydrated = self.hydrator.iter_hydrate_partial(missing)
+        entries = []
+
+        try:
+            for link_id in link_ids:
+                if link_id in dead:
+                    continue
+
+                if link_id in cached:
+                    entries.append((link_id, cached[link_id], None))
+                else:
+                    entries.append(await hydrated.__anext__())
+
+                if entries[-1][1] is not None:
+                    yield entries[-1][1]
+
+            links, error = self._present(entries)
+
+            if error is not None:
+                raise cache.Incomplete(None, error)
+        finally:
+            await hydrated.aclose()
+            await asyncio.to_thread(self.link_cache.set_many, self._hydrated([entry for entry in entries if entry[0] not in cached]))
+
+    async def view(self, req, link_id):
+        try:
+            link = await self._getlink(link_id)
+        except wrapper.TooManyRetries:
+            raise TooManyRetries()
+        except wrapper.NotFound:
+            raise NotFound()
+        except wrapper.BadRequest:
+            raise BackEndTrouble()
+
+        return self._view_page(req, link, link_id)
+
+    async def new(self, req):
+        res = await self.authorize(req)
+
+        return self._new_page(res)
+
+    async def edit(self, req, link_id):
+        res = await self.authorize(req)
+
+        try:
+            link = await self._getlink(link_id)
+        except wrapper.TooManyRetries:
+            raise TooManyRetries()
+        except wrapper.NotFound:
+            raise NotFound()
+        except wrapper.BadRequest:
+            raise BackEndTrouble()
+
+        return self._edit_page(res, link, link_id)
+
+    async def save(self, req, link_id=None):
+        res = await self.authorize(req)
+
+        data, process_tags, errors = self._read_form(req)
+
+        if not errors:
+            try:
+                try:
+                    if self.writes is not None:
+                        await asyncio.to_thread(self.writes.submit, data, process_tags, link_id)
+                    elif link_id:
+                        await self.link_service.put("/{}".format(link_id), data)
+                        await self.tag_service.put("/link/{}".format(link_id), {'tags':process_tags})
+                    else:
+                        link_id = await self.link_service.post("/", data)
+                        await self.tag_service.post("/link/{}".format(link_id), {'tags':process_tags})
+                finally:
+                    if link_id:
+                        await asyncio.to_thread(self._forget_link, link_id)
+
+            except wrapper.BadRequest as e:
+                errors.append({"message":str(e)})
+            except (wrapper.TooManyRetries, wrapper.Overloaded, pika.exceptions.AMQPError) as e:
+                errors.append({"message":"Trouble with the back-end. Please try again later"})
+
+        return self._saved_page(res, errors, data, link_id)
+
+    async def import_links(self, req):
+        # the upload is a ReceiveStream, see __call__
+        res = await self.authorize(req)
+        format, encoding = self._import_format(req)
+
+        res.content_type = 'application/x-ndjson'
+        res.charset = None
+        res.app_iter = self._import_stream(req.body_file, format, encoding, req.remote_user)
+        res.headers['x-accel-buffering'] = 'no'
+
+        return res
+
+    async def _import_stream(self, body, format, encoding, author):
+        stream = io.TextIOWrapper(io.BufferedReader(body), encoding=encoding, errors='replace', newline='')
+
+        try:
+            async for line in self.importer.run(stream, format, author):
+                yield (json.dumps(line) + "\n").encode('utf-8')
+        finally:
+            self.page_cache.clear()
+
+    async def _page_data(self, key, fetch, *args):
+        try:
+            return await self.page_cache.get(key, fetch, *args)
+        except wrapper.TooManyRetries:
+            raise TooManyRetries()
+        except wrapper.BadRequest:
+            raise BackEndTrouble()
+
+    async def listing(self, req, page=None):
+        page = self._page_number(page)
+
+        if self.config.stream_listings:
+            return await self._stream_listing(req, page, ('listing', page), self._fetch_listing, self._listing_data, page)
+
+        (data, links), stale = await self._page_data(('listing', page), self._fetch_listing, page)
+
+        if not stale:
+            self._prefetch_next(('listing', page), self._fetch_listing, (page,), data)
+
+        return self._listing_page(req, page, data, links, stale=stale)
+
+    async def _listing_data(self, page):
+        return await self.link_service.get("/?page={}".format(page))
+
+    async def _fetch_listing(self, page):
+        data = await self._listing_data(page)
+
+        return self._page_links(data, *await self._getlinks(data['links']))
+
+    async def listing_by_tag(self, req, tag, page=None):
+        page = self._page_number(page)
+
+        if self.config.stream_listings:
+            return await self._stream_listing(req, page, ('tag', tag, page), self._fetch_listing_by_tag,
+                                              self._listing_by_tag_data, tag, page, tag=tag)
+
+        (data, links), stale = await self._page_data(('tag', tag, page), self._fetch_listing_by_tag, tag, page)
+
+        if not stale:
+            self._prefetch_next(('tag', tag, page), self._fetch_listing_by_tag, (tag, page), data)
+
+        return self._listing_page(req, page, data, links, tag=tag, stale=stale)
+
+    async def _listing_by_tag_data(self, tag, page):
+        return await self.tag_service.get("/tag/{}?page={}".format(tag, page))
+
+    async def _fetch_listing_by_tag(self, tag, page):
+        data = await self._listing_by_tag_data(tag, page)
+
+        return self._page_links(data, *await self._getlinks(data['links']))
+
+    async def _stream_listing(self, req, page, key, fetch, fetch_data, *args, tag=None):
+        entry, state = self.page_cache.lookup(key)
+
+        if state != 'miss':
+            (data, links), stale = await self._page_data(key, fetch, *args)
+
+            return self._listing_page(req, page, data, links, tag=tag, stale=stale)
+
+        self.page_cache.lookups.inc(result='miss')
+
+        try:
+            data = await fetch_data(*args)
+        except (wrapper.TooManyRetries, wrapper.BadRequest, wrapper.Overloaded) as e:
+            (data, links), stale = self._stale_page(key, entry, e)
+
+            return self._listing_page(req, page, data, links, tag=tag, stale=stale)
+
+        self._prefetch_next(key, fetch, args, data)
+
+        user = self.session_user(req)
+        context, entry_context = self._listing_context(page, data, tag, False, user)
+
+        res = Response()
+        res.app_iter = self._listing_stream(key, data, context, entry_context, user, deadline.at())
+        res.headers['x-accel-buffering'] = 'no'
+
+        return self.cacheable(res, None, user)
+
+    async def _listing_stream(self, key, data, context, entry_context, user, until=None):
+        head, foot = self.renderer.render_name('list', context, entries=ENTRIES_MARKER).split(ENTRIES_MARKER)
+
+        yield head.encode('utf-8')
+
+        links = []
+
+        try:
+            async for link in deadline.aiterate(self._iter_links(data['links']), until):
+                links.append(link)
+
+                yield self.fragments.render('entry', link, entry_context, variant=user is not None).encode('utf-8')
+        except (wrapper.TooManyRetries, wrapper.BadRequest, wrapper.NotFound, wrapper.Overloaded, cache.Incomplete) as e:
+            logger.warning("Streaming %s stopped short: %s", key, e)
+
+            yield STREAM_TROUBLE.encode('utf-8')
+        else:
+            self.page_cache.store(key, (data, links))
+
+        yield foot.encode('utf-8')
+
+    async def reading_list(self, req):
+        res = await self.authorize(req)
+
+        user = req.remote_user
+
+        try:
+            data = await self.readinglist_service.get("/{}".format(user))
+
+            links, error = await self._getlinks(data)
+
+        except wrapper.TooManyRetries:
+            raise TooManyRetries()
+        except wrapper.BadRequest:
+            raise BackEndTrouble()
+
+        return self._reading_list_page(res, user, links, incomplete=error is not None)
+
+    async def reading_list_add(self, req, link_id):
+        res = await self.authorize(req)
+
+        try:
+            await self.readinglist_service.post("/{}".format(req.remote_user), link_id)
+        except wrapper.TooManyRetries:
+            raise TooManyRetries()
+        except wrapper.BadRequest:
+            raise BackEndTrouble()
+
+        return Redirect(path=self.config.path_prefix+"reading-list")
+
+    async def reading_list_read(self, req, link_id):
+        res = await self.authorize(req)
+
+        try:
+            await self.readinglist_service.put("/{}/{}/read".format(req.remote_user, link_id))
+        except wrapper.TooManyRetries:
+            raise TooManyRetries()
+        except wrapper.BadRequest:
+            raise BackEndTrouble()
+
+        return Redirect(path=self.config.path_prefix+"reading-list")
@@ -0,0 +1,131 @@
+import os
+import gzip
+import hashlib
+import mimetypes
+
+from webob import Response
+from webob.static import FileIter
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json', 'image/svg+xml')
+
+
+class Asset:
+    """
+    A file under the static directory with its validators and, for text
+    files, gzip and brotli copies compressed at start up.
+    """
+
+    def __init__(self, path, memory_limit):
+        self.path = path
+
+        with open(path, 'rb') as asset_file:
+            content = asset_file.read()
+
+        stat = os.stat(path)
+
+        self.size = stat.st_size
+        self.last_modified = stat.st_mtime
+        self.etag = hashlib.sha1(content).hexdigest()[:20]
+
+        self.content_type, self.encoding = mimetypes.guess_type(path)
+
+        if self.content_type is None:
+            self.content_type = 'application/octet-stream'
+
+        # encoding: (etag, body), body is None when it's read from disk
+        self.variants = {}
+
+        if self.size <= memory_limit:
+            self.variants['identity'] = (self.etag, content)
+        else:
+            self.variants['identity'] = (self.etag, None)
+
+        if self.encoding is None and self.content_type.startswith(COMPRESSIBLE_TYPES):
+            self.add_variant('gzip', gzip.compress(content, 9, mtime=0))
+
+            if brotli is not None:
+                self.add_variant('br', brotli.compress(content))
+
+    def add_variant(self, encoding, body):
+        # not worth a Content-Encoding if it barely saves anything
+        if len(body) < self.size * 0.9:
+            self.variants[encoding] = ("{}-{}".format(self.etag, encoding), body)
+
+
+class StaticAssets:
+    """
+    Index of every file under directory, built once at start up, serving
+    them with ETag, Last-Modified and Cache-Control headers, 304s for
+    conditional GETs and precompressed variants where the client takes them.
+
+    Files no larger than memory_limit bytes are kept in memory, others are
+    streamed from disk. Only files found by the scan are ever served.
+    """
+
+    def __init__(self, directory, max_age=604800, memory_limit=262144):
+        self.directory = directory
+        self.max_age = max_age
+        self.memory_limit = memory_limit
+        self.assets = {}
+
+        for root, dirs, files in os.walk(directory):
+            for filename in files:
+                path = os.path.join(root, filename)
+                name = os.path.relpath(path, directory).replace(os.sep, "/")
+
+                self.assets[name] = Asset(path, memory_limit)
+
+    def get(self, name):
+        return self.assets.get(name)
+
+    def choose_encoding(self, req, asset):
+        offers = [encoding for encoding in ('br', 'gzip') if encoding in asset.variants]
+
+        # no header technically means anything goes, in practice it's clients
+        # that don't decompress
+        if not offers or 'Accept-Encoding' not in req.headers:
+            return 'identity'
+
+        acceptable = req.accept_encoding.acceptable_offers(offers)
+
+        if acceptable:
+            return acceptable[0][0]
+
+        return 'identity'
+
+    def response(self, req, name):
+        """
+        Return a Response for the asset called name, None if there's no such
+        asset.
+        """
+        asset = self.assets.get(name)
+
+        if asset is None:
+            return None
+
+        encoding = self.choose_encoding(req, asset)
+        etag, body = asset.variants[encoding]
+
+        res = Response(content_type=asset.content_type, conditional_response=True)
+
+        if body is None:
+            res.app_iter = FileIter(open(asset.path, 'rb'))
+            res.content_length = asset.size
+        else:
+            res.body = body
+
+        if encoding != 'identity':
+            res.content_encoding = encoding
+
+        res.etag = etag
+        res.last_modified = asset.last_modified
+        res.cache_control = 'public, max-age={}'.format(self.max_age)
+        res.vary = ('Accept-Encoding',)
+
+        return res
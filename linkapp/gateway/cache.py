@@ -0,0 +1,458 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import asyncio
+import json
+import time
+
+from redis.exceptions import RedisError
+
+from . import deadline
+from . import metrics
+from . import log
+
+logger = log.get_logger(__name__)
+
+
+class LocalLRU:
+    """
+    Small bounded, thread safe, in-process cache with a TTL per entry.
+    """
+
+    def __init__(self, size=256):
+        self.size = size
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+
+            if entry is None:
+                return None
+
+            expires, value = entry
+
+            if expires < time.monotonic():
+                del self.entries[key]
+                return None
+
+            self.entries.move_to_end(key)
+
+            return value
+
+    def set(self, key, value, ttl):
+        if self.size <= 0 or ttl <= 0:
+            return
+
+        with self.lock:
+            self.entries[key] = (time.monotonic() + ttl, value)
+            self.entries.move_to_end(key)
+
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class LinkCache:
+    """
+    Read-through cache of hydrated links (the link record with its tags).
+
+    Entries live in Redis for ttl seconds and in a small in-process LRU for
+    local_ttl seconds in front of it. The local tier isn't told when another
+    worker invalidates a link, so keep local_ttl short.
+
+    Invalidating a link leaves a tombstone in its place for tombstone_ttl
+    seconds, and links are only cached where there's nothing, so a reader
+    that fetched a link before it was changed can't put the old copy back.
+    tombstone_ttl should be longer than fetching a page can take.
+
+    client is anything with the redis-py get/mget/set/pipeline
+    interface, fakeredis works. If Redis is unreachable the cache behaves as
+    a miss and leaves Redis alone for retry_after seconds.
+    """
+
+    # what an invalidated link is cached as
+    TOMBSTONE = "-"
+
+    def __init__(self, client, ttl=300, local_size=256, local_ttl=5, prefix="linkapp:link:", retry_after=5,
+                 tombstone_ttl=30):
+        self.client = client
+        self.ttl = ttl
+        self.tombstone_ttl = tombstone_ttl
+        self.local = LocalLRU(local_size)
+        self.local_ttl = min(local_ttl, ttl)
+        self.prefix = prefix
+        self.retry_after = retry_after
+        self.down_until = 0
+
+    @property
+    def enabled(self):
+        return self.ttl > 0
+
+    def key(self, link_id):
+        return "{}{}".format(self.prefix, link_id)
+
+    def _redis_ok(self):
+        return self.down_until < time.monotonic()
+
+    def _redis_failed(self):
+        self.down_until = time.monotonic() + self.retry_after
+
+    def get_many(self, link_ids):
+        """
+        Return a dict of link_id: link for the link_ids that are cached, the
+        links are fresh copies that callers are free to change.
+        """
+        if not self.enabled:
+            return {}
+
+        found = {}
+        remote = []
+
+        for link_id in link_ids:
+            raw = self.local.get(link_id)
+
+            if raw is None:
+                remote.append(link_id)
+            elif raw != self.TOMBSTONE:
+                found[link_id] = raw
+
+        if remote and self._redis_ok():
+            try:
+                values = self.client.mget([self.key(link_id) for link_id in remote])
+            except RedisError:
+                self._redis_failed()
+                values = []
+
+            for link_id, raw in zip(remote, values):
+                if raw is not None:
+                    if isinstance(raw, bytes):
+                        raw = raw.decode('utf-8')
+
+                    self.local.set(link_id, raw, self.local_ttl)
+
+                    if raw != self.TOMBSTONE:
+                        found[link_id] = raw
+
+        return {link_id: json.loads(raw) for link_id, raw in found.items()}
+
+    def set_many(self, links, ttl=None):
+        """
+        Cache each link_id: link in links for ttl seconds (defaults to
+        self.ttl), unless it's been invalidated since.
+        """
+        if not self.enabled or not links:
+            return
+
+        if ttl is None:
+            ttl = self.ttl
+
+        serialized = {link_id: json.dumps(link) for link_id, link in links.items()
+                      if self.local.get(link_id) != self.TOMBSTONE}
+
+        if serialized and self._redis_ok():
+            try:
+                pipe = self.client.pipeline(transaction=False)
+
+                for link_id, raw in serialized.items():
+                    pipe.set(self.key(link_id), raw, ex=int(max(1, ttl)), nx=True)
+
+                written = pipe.execute()
+            except RedisError:
+                self._redis_failed()
+            else:
+                # the others are tombstones, or cached by someone else already
+                serialized = {link_id: raw for (link_id, raw), ok in zip(serialized.items(), written) if ok}
+
+        for link_id, raw in serialized.items():
+            self.local.set(link_id, raw, min(self.local_ttl, ttl))
+
+    def set(self, link_id, link, ttl=None):
+        self.set_many({link_id: link}, ttl)
+
+    def invalidate(self, link_id):
+        if not self.enabled:
+            self.local.delete(link_id)
+            return
+
+        self.local.set(link_id, self.TOMBSTONE, min(self.local_ttl, self.tombstone_ttl))
+
+        try:
+            self.client.set(self.key(link_id), self.TOMBSTONE, ex=int(max(1, self.tombstone_ttl)))
+        except RedisError:
+            self._redis_failed()
+
+
+class MissingLinks:
+    """
+    Link ids the link service said don't exist, remembered for ttl seconds
+    so dead references (a deleted link still on a reading list or in a tag's
+    listing) aren't looked up again on every page. The size most recent
+    are kept, in process.
+    """
+
+    def __init__(self, ttl=60, size=4096, registry=None):
+        self.ttl = ttl
+        self.ids = LocalLRU(size)
+
+        if registry is None:
+            registry = metrics.Registry()
+
+        self.lookups = registry.counter('gateway_missing_links_total',
+                                        'Dead link ids skipped without a lookup (hit) or found dead by one (stored)',
+                                        ('result',))
+
+    @property
+    def enabled(self):
+        return self.ttl > 0 and self.ids.size > 0
+
+    def known(self, link_ids):
+        """
+        The ones of link_ids known not to exist.
+        """
+        if not self.enabled:
+            return set()
+
+        known = set(link_id for link_id in link_ids if self.ids.get(link_id))
+
+        if known:
+            self.lookups.inc(len(known), result='hit')
+
+        return known
+
+    def add(self, link_ids):
+        for link_id in link_ids:
+            self.ids.set(link_id, True, self.ttl)
+
+        if link_ids and self.enabled:
+            self.lookups.inc(len(link_ids), result='stored')
+
+    def discard(self, link_id):
+        self.ids.delete(link_id)
+
+
+class Incomplete(Exception):
+    """
+    Raised by a PageCache fetch that made a value, value, but not all of it:
+    error is what went wrong with the rest. The value is served, marked
+    stale, when there's no copy to fall back on, it's never stored.
+    """
+
+    def __init__(self, value, error):
+        Exception.__init__(self, str(error))
+        self.value = value
+        self.error = error
+
+
+class PageCache:
+    """
+    In-process cache of listing page data, stale-while-revalidate style.
+
+    An entry younger than soft_ttl is served as is. Between soft_ttl and
+    hard_ttl it's served and refetched in the background, once per key at a
+    time. Older than that it's fetched again before answering, and if that
+    fails with one of errors the last good copy is served anyway, marked
+    stale, as it is when the fetch is Incomplete. At most size entries are
+    kept, none with size 0.
+    """
+
+    def __init__(self, soft_ttl=5, hard_ttl=60, size=256, errors=(Exception,), workers=2, registry=None):
+        self.soft_ttl = soft_ttl
+        self.hard_ttl = max(soft_ttl, hard_ttl)
+        self.size = size
+        self.errors = errors
+        self.workers = workers
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.refreshing = set()
+        self.executor = None
+
+        if registry is None:
+            registry = metrics.Registry()
+
+        self.lookups = registry.counter('gateway_page_cache_total',
+                                        'Listing page lookups by outcome (hit, revalidate, miss, stale, incomplete)',
+                                        ('result',))
+
+    @property
+    def enabled(self):
+        return self.size > 0
+
+    def lookup(self, key):
+        """
+        (entry, state), entry is the cached (stored_at, value) if there's
+        one and state what to do with it: hit, revalidate or miss.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+
+            if entry is not None:
+                self.entries.move_to_end(key)
+
+        if entry is None:
+            return None, 'miss'
+
+        age = time.monotonic() - entry[0]
+
+        if age < self.soft_ttl:
+            return entry, 'hit'
+
+        if age < self.hard_ttl:
+            return entry, 'revalidate'
+
+        return entry, 'miss'
+
+    def store(self, key, value):
+        if not self.enabled:
+            return
+
+        with self.lock:
+            self.entries[key] = (time.monotonic(), value)
+            self.entries.move_to_end(key)
+
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def _claim(self, key):
+        with self.lock:
+            if key in self.refreshing:
+                return False
+
+            self.refreshing.add(key)
+
+            return True
+
+    def _release(self, key):
+        with self.lock:
+            self.refreshing.discard(key)
+
+    def stale(self, key, entry, error):
+        """
+        (value, True) of entry, for when fetching a fresh one failed with
+        error, which is raised again if there's no entry.
+        """
+        if entry is None:
+            raise error
+
+        logger.warning("Serving a stale copy of %s: %s", key, error)
+        self.lookups.inc(result='stale')
+
+        return entry[1], True
+
+    def incomplete(self, key, entry, error):
+        """
+        (value, True) for a fetch that raised Incomplete error: the last 
+        good copy if there's one, what the fetch did make otherwise.
+        """
+        if entry is not None:
+            return self.stale(key, entry, error.error)
+
+        logger.warning("Serving an incomplete %s: %s", key, error.error)
+        self.lookups.inc(result='incomplete')
+
+        return error.value, True
+
+    def get(self, key, fetch, *args):
+        """
+        Return (value, stale) for key, fetch(*args) makes a fresh value.
+        """
+        entry, state = self.lookup(key)
+        self.lookups.inc(result=state)
+
+        if state == 'revalidate':
+            self.refresh(key, fetch, *args)
+
+        if state != 'miss':
+            return entry[1], False
+
+        try:
+            value = fetch(*args)
+        except Incomplete as e:
+            return self.incomplete(key, entry, e)
+        except self.errors as e:
+            return self.stale(key, entry, e)
+
+        self.store(key, value)
+
+        return value, False
+
+    def refresh(self, key, fetch, *args):
+        if not self._claim(key):
+            return
+
+        def run():
+            try:
+                self.store(key, fetch(*args))
+            except Exception:
+                logger.info("Refreshing %s failed", key, exc_info=True)
+            finally:
+                self._release(key)
+
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="linkapp-refresh")
+
+        self.executor.submit(run)
+
+
+class AsyncPageCache(PageCache):
+    """
+    PageCache for coroutines, fetch is a coroutine function and refreshes
+    run as tasks on the event loop.
+    """
+
+    def __init__(self, *args, **kwargs):
+        PageCache.__init__(self, *args, **kwargs)
+        self.tasks = set()
+
+    async def get(self, key, fetch, *args):
+        entry, state = self.lookup(key)
+        self.lookups.inc(result=state)
+
+        if state == 'revalidate':
+            self.refresh(key, fetch, *args)
+
+        if state != 'miss':
+            return entry[1], False
+
+        try:
+            value = await fetch(*args)
+        except Incomplete as e:
+            return self.incomplete(key, entry, e)
+        except self.errors as e:
+            return self.stale(key, entry, e)
+
+        self.store(key, value)
+
+        return value, False
+
+    def refresh(self, key, fetch, *args):
+        if not self._claim(key):
+            return
+
+        async def run():
+            try:
+                # not bound by the deadline of the request that started it
+                with deadline.until(None):
+                    self.store(key, await fetch(*args))
+            except Exception:
+                logger.info("Refreshing %s failed", key, exc_info=True)
+            finally:
+                self._release(key)
+
+        # the loop only keeps weak references to tasks
+        task = asyncio.ensure_future(run())
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
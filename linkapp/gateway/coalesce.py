@@ -0,0 +1,99 @@
+"""
+Single-flight: concurrent callers asking for the same key share one call.
+
+The first caller for a key makes the call, the ones arriving while it's in
+flight wait for it and get its result, or its exception. Once it's done the
+next caller starts a new one, nothing is cached. A waiting caller can ask
+to make a call of its own instead of taking some errors of the shared one,
+with rejoin.
+"""
+
+import threading
+import asyncio
+
+
+class Flight:
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Thread safe single-flight.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flights = {}
+
+    def do(self, key, func, *args, rejoin=None, **kwargs):
+        """
+        Return (result of func(*args, **kwargs), shared), shared is True if
+        the result came from a call another thread made. When that call 
+        raised an exception rejoin(exception) is true for, the caller starts
+        over rather than raising it.
+        """
+        while True:
+            with self.lock:
+                flight = self.flights.get(key)
+                leader = flight is None
+
+                if leader:
+                    flight = self.flights[key] = Flight()
+
+            if leader:
+                break
+
+            flight.done.wait()
+
+            if flight.error is not None:
+                if rejoin is not None and rejoin(flight.error):
+                    continue
+
+                raise flight.error
+
+            return flight.result, True
+
+        try:
+            flight.result = func(*args, **kwargs)
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+
+            flight.done.set()
+
+        return flight.result, False
+
+
+class AsyncSingleFlight:
+    """
+    Single-flight for coroutines of one event loop. The call runs as a task
+    of its own, a caller being cancelled doesn't cancel it for the others.
+    """
+
+    def __init__(self):
+        self.flights = {}
+
+    async def do(self, key, func, *args, rejoin=None, **kwargs):
+        while True:
+            task = self.flights.get(key)
+            # one that just failed may not be popped yet
+            shared = task is not None and not task.done()
+
+            if not shared:
+                task = self.flights[key] = asyncio.ensure_future(func(*args, **kwargs))
+                task.add_done_callback(lambda t: self.flights.pop(key, None) if self.flights.get(key) is t else None)
+
+            try:
+                return await asyncio.shield(task), shared
+            except Exception as e:
+                if shared and rejoin is not None and rejoin(e):
+                    continue
+
+                raise
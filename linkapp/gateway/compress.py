@@ -0,0 +1,239 @@
+"""
+gzip/deflate compression of the gateway's responses, as WSGI middleware,
+see wsgi.py at the root of the project.
+"""
+
+import itertools
+import gzip
+import zlib
+
+from webob.acceptparse import create_accept_encoding_header
+
+from . import assets
+from . import cache
+from . import metrics
+
+# zlib wbits of each encoding, gzip wraps the deflate stream in a gzip
+# header, HTTP's "deflate" is the zlib format
+WBITS = {
+    'gzip': 16 + zlib.MAX_WBITS,
+    'deflate': zlib.MAX_WBITS
+}
+
+
+def header(headers, name):
+    name = name.lower()
+
+    for key, value in headers:
+        if key.lower() == name:
+            return value
+
+    return None
+
+
+def without(headers, *names):
+    names = [name.lower() for name in names]
+
+    return [(key, value) for key, value in headers if key.lower() not in names]
+
+
+def add_vary(headers, field):
+    vary = header(headers, 'vary')
+
+    if vary is None:
+        return headers + [('Vary', field)]
+
+    if field.lower() in [value.strip().lower() for value in vary.split(',')]:
+        return headers
+
+    return without(headers, 'vary') + [('Vary', "{}, {}".format(vary, field))]
+
+
+class CompressionMiddleware:
+    """
+    Compresses the text responses of app for the clients that accept gzip
+    or deflate.
+
+    Responses shorter than min_size bytes, already encoded or with a strong
+    ETag (static assets, which come with their own compressed copies) are
+    left alone. Responses without a Content-Length (streamed listings) are
+    compressed chunk by chunk, flushing after each one so they still stream.
+
+    The compressed bytes of a response with a weak ETag are kept for the
+    cache_size most recent ones, so a page served again from a cache isn't
+    compressed again.
+    """
+
+    def __init__(self, app, min_size=1024, level=6, cache_size=256, registry=None):
+        self.app = app
+        self.min_size = min_size
+        self.level = level
+        self.compressed = cache.LocalLRU(cache_size)
+
+        if registry is None:
+            registry = metrics.Registry()
+
+        self.responses = registry.counter('gateway_compression_total',
+                                          'Responses by what the compression middleware did with them',
+                                          ('result',))
+        self.bytes = registry.counter('gateway_compression_bytes_total',
+                                      'Bytes going into and coming out of the compression middleware',
+                                      ('stage',))
+
+    def choose_encoding(self, environ):
+        accept = environ.get('HTTP_ACCEPT_ENCODING')
+
+        # no header technically means anything goes, in practice it's clients
+        # that don't decompress
+        if not accept:
+            return None
+
+        acceptable = create_accept_encoding_header(accept).acceptable_offers(['gzip', 'deflate'])
+
+        if acceptable:
+            return acceptable[0][0]
+
+        return None
+
+    def should_compress(self, environ, status, headers):
+        if environ.get('REQUEST_METHOD') == 'HEAD' or not status.startswith('200'):
+            return False
+
+        if header(headers, 'content-encoding') is not None:
+            return False
+
+        if 'no-transform' in (header(headers, 'cache-control') or ''):
+            return False
+
+        etag = header(headers, 'etag')
+
+        if etag is not None and not etag.startswith('W/'):
+            return False
+
+        length = header(headers, 'content-length')
+
+        if length is not None and int(length) < self.min_size:
+            return False
+
+        return True
+
+    def __call__(self, environ, start_response):
+        captured = {}
+        written = []
+
+        def capture(status, headers, exc_info=None):
+            captured['status'] = status
+            captured['headers'] = headers
+            captured['exc_info'] = exc_info
+
+            return written.append
+
+        app_iter = self.app(environ, capture)
+
+        if 'status' not in captured:
+            # the app only calls start_response with its first chunk
+            chunks = iter(app_iter)
+            first = next(chunks, b'')
+            app_iter = ClosingIterator(itertools.chain([first], chunks), app_iter)
+
+        status, headers, exc_info = captured['status'], captured['headers'], captured['exc_info']
+
+        if written:
+            app_iter = ClosingIterator(itertools.chain(written, app_iter), app_iter)
+
+        content_type = header(headers, 'content-type') or ''
+
+        if not content_type.startswith(assets.COMPRESSIBLE_TYPES):
+            start_response(status, headers, exc_info)
+
+            return app_iter
+
+        headers = add_vary(headers, 'Accept-Encoding')
+        encoding = self.choose_encoding(environ)
+
+        if encoding is None or not self.should_compress(environ, status, headers):
+            self.responses.inc(result='skipped')
+            start_response(status, headers, exc_info)
+
+            return app_iter
+
+        if header(headers, 'content-length') is None:
+            self.responses.inc(result='streamed')
+            start_response(status, without(headers, 'content-length') + [('Content-Encoding', encoding)], exc_info)
+
+            return ClosingIterator(self.stream(app_iter, encoding), app_iter)
+
+        try:
+            body = b''.join(app_iter)
+        finally:
+            if hasattr(app_iter, 'close'):
+                app_iter.close()
+
+        etag = header(headers, 'etag')
+        key = (etag, encoding)
+        compressed = self.compressed.get(key) if etag is not None else None
+
+        if compressed is None:
+            compressed = self.compress(body, encoding)
+            self.responses.inc(result='compressed')
+
+            if etag is not None:
+                # the ETag changes with the content, no need to expire them
+                self.compressed.set(key, compressed, float('inf'))
+        else:
+            self.responses.inc(result='cached')
+
+        self.bytes.inc(len(body), stage='in')
+        self.bytes.inc(len(compressed), stage='out')
+
+        headers = without(headers, 'content-length')
+        headers.append(('Content-Encoding', encoding))
+        headers.append(('Content-Length', str(len(compressed))))
+
+        start_response(status, headers, exc_info)
+
+        return [compressed]
+
+    def compress(self, body, encoding):
+        if encoding == 'gzip':
+            return gzip.compress(body, self.level, mtime=0)
+
+        return zlib.compress(body, self.level)
+
+    def stream(self, chunks, encoding):
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, WBITS[encoding])
+
+        for chunk in chunks:
+            if chunk:
+                self.bytes.inc(len(chunk), stage='in')
+
+                out = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+                self.bytes.inc(len(out), stage='out')
+
+                yield out
+
+        out = compressor.flush()
+        self.bytes.inc(len(out), stage='out')
+
+        yield out
+
+
+class ClosingIterator:
+    """
+    Iterates over iterable, closing original (the app's iterable) when the
+    server closes it, as WSGI requires.
+    """
+
+    def __init__(self, iterable, original):
+        self.iterable = iterable
+        self.original = original
+
+    def __iter__(self):
+        return iter(self.iterable)
+
+    def close(self):
+        if hasattr(self.iterable, 'close'):
+            self.iterable.close()
+
+        if hasattr(self.original, 'close'):
+            self.original.close()
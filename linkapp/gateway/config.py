@@ -1,4 +1,11 @@
 import os
+import binascii
+
+def as_bool(value):
+    """
+    Read a flag from the environment, 1, true, yes and on turn it on.
+    """
+    return str(value).strip().lower() in ("1", "true", "yes", "on")
 
 class MissingConfig(Exception):
     """
@@ -11,6 +18,29 @@ class GatewayConfig:
     Where all the information will be extracted for the environment.
     """
     
+    # ServiceWrapper option: (GatewayConfig attribute, type), they can be set 
+    # for all services at once or overridden for one of them (see 
+    # service_options)
+    service_option_types = {
+        'timeout': ('service_timeout', float),
+        'retries': ('service_retries', int),
+        'sleep': ('service_retry_sleep', float),
+        'max_sleep': ('service_retry_max_sleep', float),
+        'budget': ('service_retry_budget', float),
+        'breaker_threshold': ('breaker_threshold', int),
+        'breaker_reset': ('breaker_reset', float),
+        'pool_size': ('pool_size', int),
+        'pool_max_idle': ('pool_max_idle', int),
+        'pool_idle_timeout': ('pool_idle_timeout', float),
+        'bulk_path': ('bulk_path', str),
+        'batch_size': ('batch_size', int),
+        'bulk_retry': ('bulk_retry', float),
+        'coalesce': ('coalesce', as_bool),
+        'admission_limit': ('admission_limit', int),
+        'admission_queue': ('admission_queue', int),
+        'admission_wait': ('admission_wait', float),
+    }
+    
     def __init__(self, redis_url=None, 
                        rabbit_url=None, 
                        rabbit_retries=None, 
@@ -20,7 +50,66 @@ class GatewayConfig:
                        authorization_service_url=None,
                        tag_service_url=None,
                        readinglist_service_url=None,
-                       path_prefix=None):
+                       path_prefix=None,
+                       hydration_workers=None,
+                       hydration_concurrency=None,
+                       pool_size=None,
+                       pool_max_idle=None,
+                       pool_idle_timeout=None,
+                       service_overrides=None,
+                       link_cache_ttl=None,
+                       link_cache_local_size=None,
+                       link_cache_local_ttl=None,
+                       template_reload=None,
+                       static_max_age=None,
+                       static_memory_limit=None,
+                       session_secret=None,
+                       session_ttl=None,
+                       credential_cache_ttl=None,
+                       service_timeout=None,
+                       service_retries=None,
+                       service_retry_sleep=None,
+                       service_retry_max_sleep=None,
+                       service_retry_budget=None,
+                       breaker_threshold=None,
+                       breaker_reset=None,
+                       queued_writes=None,
+                       write_retries=None,
+                       log_level=None,
+                       log_sample_rate=None,
+                       bulk_path=None,
+                       batch_size=None,
+                       coalesce=None,
+                       page_cache_soft_ttl=None,
+                       page_cache_hard_ttl=None,
+                       page_cache_size=None,
+                       fragment_cache_size=None,
+                       anonymous_cache_control=None,
+                       user_cache_control=None,
+                       stream_listings=None,
+                       compress_min_size=None,
+                       compress_level=None,
+                       compress_cache_size=None,
+                       prefetch=None,
+                       prefetch_rate=None,
+                       prefetch_queue_size=None,
+                       admission_limit=None,
+                       admission_queue=None,
+                       admission_wait=None,
+                       overload_retry_after=None,
+                       request_deadline=None,
+                       route_deadlines=None,
+                       server_timing=None,
+                       profile_dir=None,
+                       profile_secret=None,
+                       profile_sample_rate=None,
+                       missing_link_ttl=None,
+                       missing_link_cache_size=None,
+                       import_workers=None,
+                       import_concurrency=None,
+                       import_batch_size=None,
+                       bulk_retry=None,
+                       link_cache_tombstone_ttl=None):
         
         if redis_url is None:
             from_environ = os.environ.get('LINKAPP_REDIS_URL', False)
@@ -97,4 +186,350 @@ class GatewayConfig:
             self.path_prefix = os.environ.get('LINKAPP_PATH_PREFIX', "/")
         else:
             self.path_prefix = path_prefix
-
+            
+        if hydration_workers is None:
+            self.hydration_workers = int(os.environ.get('LINKAPP_HYDRATION_WORKERS', "32"))
+        else:
+            self.hydration_workers = hydration_workers
+            
+        if hydration_concurrency is None:
+            self.hydration_concurrency = int(os.environ.get('LINKAPP_HYDRATION_CONCURRENCY', "10"))
+        else:
+            self.hydration_concurrency = hydration_concurrency
+            
+        if pool_size is None:
+            self.pool_size = int(os.environ.get('LINKAPP_POOL_SIZE', "10"))
+        else:
+            self.pool_size = pool_size
+            
+        if pool_max_idle is None:
+            self.pool_max_idle = int(os.environ.get('LINKAPP_POOL_MAX_IDLE', "10"))
+        else:
+            self.pool_max_idle = pool_max_idle
+            
+        if pool_idle_timeout is None:
+            self.pool_idle_timeout = float(os.environ.get('LINKAPP_POOL_IDLE_TIMEOUT', "30"))
+        else:
+            self.pool_idle_timeout = pool_idle_timeout
+            
+        if service_overrides is None:
+            self.service_overrides = {}
+        else:
+            self.service_overrides = service_overrides
+            
+        if link_cache_ttl is None:
+            self.link_cache_ttl = float(os.environ.get('LINKAPP_LINK_CACHE_TTL', "300"))
+        else:
+            self.link_cache_ttl = link_cache_ttl
+            
+        if link_cache_local_size is None:
+            self.link_cache_local_size = int(os.environ.get('LINKAPP_LINK_CACHE_LOCAL_SIZE', "256"))
+        else:
+            self.link_cache_local_size = link_cache_local_size
+            
+        if link_cache_local_ttl is None:
+            self.link_cache_local_ttl = float(os.environ.get('LINKAPP_LINK_CACHE_LOCAL_TTL', "5"))
+        else:
+            self.link_cache_local_ttl = link_cache_local_ttl
+            
+        if template_reload is None:
+            self.template_reload = as_bool(os.environ.get('LINKAPP_TEMPLATE_RELOAD', "0"))
+        else:
+            self.template_reload = template_reload
+            
+        if static_max_age is None:
+            self.static_max_age = int(os.environ.get('LINKAPP_STATIC_MAX_AGE', "604800"))
+        else:
+            self.static_max_age = static_max_age
+            
+        if static_memory_limit is None:
+            self.static_memory_limit = int(os.environ.get('LINKAPP_STATIC_MEMORY_LIMIT', "262144"))
+        else:
+            self.static_memory_limit = static_memory_limit
+            
+        if session_secret is None:
+            # without a shared secret tokens are only good in the worker that 
+            # issued them, the others fall back to checking credentials
+            self.session_secret = os.environ.get('LINKAPP_SESSION_SECRET', None)
+            
+            if self.session_secret is None:
+                self.session_secret = binascii.hexlify(os.urandom(32)).decode('ascii')
+        else:
+            self.session_secret = session_secret
+            
+        if session_ttl is None:
+            self.session_ttl = int(os.environ.get('LINKAPP_SESSION_TTL', "3600"))
+        else:
+            self.session_ttl = session_ttl
+            
+        if credential_cache_ttl is None:
+            self.credential_cache_ttl = float(os.environ.get('LINKAPP_CREDENTIAL_CACHE_TTL', "60"))
+        else:
+            self.credential_cache_ttl = credential_cache_ttl
+            
+        if service_timeout is None:
+            self.service_timeout = float(os.environ.get('LINKAPP_SERVICE_TIMEOUT', "2"))
+        else:
+            self.service_timeout = service_timeout
+            
+        if service_retries is None:
+            self.service_retries = int(os.environ.get('LINKAPP_SERVICE_RETRIES', "10"))
+        else:
+            self.service_retries = service_retries
+            
+        if service_retry_sleep is None:
+            self.service_retry_sleep = float(os.environ.get('LINKAPP_SERVICE_RETRY_SLEEP', "0.1"))
+        else:
+            self.service_retry_sleep = service_retry_sleep
+            
+        if service_retry_max_sleep is None:
+            self.service_retry_max_sleep = float(os.environ.get('LINKAPP_SERVICE_RETRY_MAX_SLEEP', "1"))
+        else:
+            self.service_retry_max_sleep = service_retry_max_sleep
+            
+        if service_retry_budget is None:
+            self.service_retry_budget = float(os.environ.get('LINKAPP_SERVICE_RETRY_BUDGET', "5"))
+        else:
+            self.service_retry_budget = service_retry_budget
+            
+        if breaker_threshold is None:
+            self.breaker_threshold = int(os.environ.get('LINKAPP_BREAKER_THRESHOLD', "5"))
+        else:
+            self.breaker_threshold = breaker_threshold
+            
+        if breaker_reset is None:
+            self.breaker_reset = float(os.environ.get('LINKAPP_BREAKER_RESET', "10"))
+        else:
+            self.breaker_reset = breaker_reset
+            
+        if queued_writes is None:
+            self.queued_writes = as_bool(os.environ.get('LINKAPP_QUEUED_WRITES', "0"))
+        else:
+            self.queued_writes = queued_writes
+            
+        if write_retries is None:
+            self.write_retries = int(os.environ.get('LINKAPP_WRITE_RETRIES', "5"))
+        else:
+            self.write_retries = write_retries
+            
+        if log_level is None:
+            self.log_level = os.environ.get('LINKAPP_LOG_LEVEL', "WARNING")
+        else:
+            self.log_level = log_level
+            
+        if log_sample_rate is None:
+            self.log_sample_rate = float(os.environ.get('LINKAPP_LOG_SAMPLE_RATE', "1"))
+        else:
+            self.log_sample_rate = log_sample_rate
+            
+        if bulk_path is None:
+            # no bulk endpoint unless a service says otherwise, eg. 
+            # LINKAPP_LINK_BULK_PATH=/bulk
+            self.bulk_path = os.environ.get('LINKAPP_BULK_PATH', None)
+        else:
+            self.bulk_path = bulk_path
+            
+        if batch_size is None:
+            self.batch_size = int(os.environ.get('LINKAPP_BATCH_SIZE', "50"))
+        else:
+            self.batch_size = batch_size
+            
+        if coalesce is None:
+            self.coalesce = as_bool(os.environ.get('LINKAPP_COALESCE', "1"))
+        else:
+            self.coalesce = coalesce
+            
+        if page_cache_soft_ttl is None:
+            self.page_cache_soft_ttl = float(os.environ.get('LINKAPP_PAGE_CACHE_SOFT_TTL', "5"))
+        else:
+            self.page_cache_soft_ttl = page_cache_soft_ttl
+            
+        if page_cache_hard_ttl is None:
+            self.page_cache_hard_ttl = float(os.environ.get('LINKAPP_PAGE_CACHE_HARD_TTL', "60"))
+        else:
+            self.page_cache_hard_ttl = page_cache_hard_ttl
+            
+        if page_cache_size is None:
+            self.page_cache_size = int(os.environ.get('LINKAPP_PAGE_CACHE_SIZE', "256"))
+        else:
+            self.page_cache_size = page_cache_size
+            
+        if fragment_cache_size is None:
+            self.fragment_cache_size = int(os.environ.get('LINKAPP_FRAGMENT_CACHE_SIZE', "1024"))
+        else:
+            self.fragment_cache_size = fragment_cache_size
+            
+        if anonymous_cache_control is None:
+            self.anonymous_cache_control = os.environ.get('LINKAPP_ANONYMOUS_CACHE_CONTROL', "public, max-age=5")
+        else:
+            self.anonymous_cache_control = anonymous_cache_control
+            
+        if user_cache_control is None:
+            self.user_cache_control = os.environ.get('LINKAPP_USER_CACHE_CONTROL', "private, no-cache")
+        else:
+            self.user_cache_control = user_cache_control
+            
+        if stream_listings is None:
+            self.stream_listings = as_bool(os.environ.get('LINKAPP_STREAM_LISTINGS', "0"))
+        else:
+            self.stream_listings = stream_listings
+            
+        if compress_min_size is None:
+            self.compress_min_size = int(os.environ.get('LINKAPP_COMPRESS_MIN_SIZE', "1024"))
+        else:
+            self.compress_min_size = compress_min_size
+            
+        if compress_level is None:
+            self.compress_level = int(os.environ.get('LINKAPP_COMPRESS_LEVEL', "6"))
+        else:
+            self.compress_level = compress_level
+            
+        if compress_cache_size is None:
+            self.compress_cache_size = int(os.environ.get('LINKAPP_COMPRESS_CACHE_SIZE', "256"))
+        else:
+            self.compress_cache_size = compress_cache_size
+            
+        if prefetch is None:
+            self.prefetch = as_bool(os.environ.get('LINKAPP_PREFETCH', "0"))
+        else:
+            self.prefetch = prefetch
+            
+        if prefetch_rate is None:
+            self.prefetch_rate = float(os.environ.get('LINKAPP_PREFETCH_RATE', "2"))
+        else:
+            self.prefetch_rate = prefetch_rate
+            
+        if prefetch_queue_size is None:
+            self.prefetch_queue_size = int(os.environ.get('LINKAPP_PREFETCH_QUEUE_SIZE', "32"))
+        else:
+            self.prefetch_queue_size = prefetch_queue_size
+            
+        if admission_limit is None:
+            self.admission_limit = int(os.environ.get('LINKAPP_ADMISSION_LIMIT', "20"))
+        else:
+            self.admission_limit = admission_limit
+            
+        if admission_queue is None:
+            self.admission_queue = int(os.environ.get('LINKAPP_ADMISSION_QUEUE', "50"))
+        else:
+            self.admission_queue = admission_queue
+            
+        if admission_wait is None:
+            self.admission_wait = float(os.environ.get('LINKAPP_ADMISSION_WAIT', "1"))
+        else:
+            self.admission_wait = admission_wait
+            
+        if overload_retry_after is None:
+            self.overload_retry_after = int(os.environ.get('LINKAPP_OVERLOAD_RETRY_AFTER', "1"))
+        else:
+            self.overload_retry_after = overload_retry_after
+            
+        if request_deadline is None:
+            self.request_deadline = float(os.environ.get('LINKAPP_REQUEST_DEADLINE', "5"))
+        else:
+            self.request_deadline = request_deadline
+            
+        if route_deadlines is None:
+            self.route_deadlines = {}
+        else:
+            self.route_deadlines = route_deadlines
+            
+        if server_timing is None:
+            self.server_timing = as_bool(os.environ.get('LINKAPP_SERVER_TIMING', "1"))
+        else:
+            self.server_timing = server_timing
+            
+        if profile_dir is None:
+            self.profile_dir = os.environ.get('LINKAPP_PROFILE_DIR', None)
+        else:
+            self.profile_dir = profile_dir
+            
+        if profile_secret is None:
+            self.profile_secret = os.environ.get('LINKAPP_PROFILE_SECRET', None)
+        else:
+            self.profile_secret = profile_secret
+            
+        if profile_sample_rate is None:
+            self.profile_sample_rate = float(os.environ.get('LINKAPP_PROFILE_SAMPLE_RATE', "0"))
+        else:
+            self.profile_sample_rate = profile_sample_rate
+            
+        if missing_link_ttl is None:
+            self.missing_link_ttl = float(os.environ.get('LINKAPP_MISSING_LINK_TTL', "60"))
+        else:
+            self.missing_link_ttl = missing_link_ttl
+            
+        if missing_link_cache_size is None:
+            self.missing_link_cache_size = int(os.environ.get('LINKAPP_MISSING_LINK_CACHE_SIZE', "4096"))
+        else:
+            self.missing_link_cache_size = missing_link_cache_size
+            
+        if import_workers is None:
+            self.import_workers = int(os.environ.get('LINKAPP_IMPORT_WORKERS', "16"))
+        else:
+            self.import_workers = import_workers
+            
+        if import_concurrency is None:
+            self.import_concurrency = int(os.environ.get('LINKAPP_IMPORT_CONCURRENCY', "8"))
+        else:
+            self.import_concurrency = import_concurrency
+            
+        if import_batch_size is None:
+            self.import_batch_size = int(os.environ.get('LINKAPP_IMPORT_BATCH_SIZE', "100"))
+        else:
+            self.import_batch_size = import_batch_size
+            
+        if bulk_retry is None:
+            self.bulk_retry = float(os.environ.get('LINKAPP_BULK_RETRY', "300"))
+        else:
+            self.bulk_retry = bulk_retry
+            
+        if link_cache_tombstone_ttl is None:
+            self.link_cache_tombstone_ttl = float(os.environ.get('LINKAPP_LINK_CACHE_TOMBSTONE_TTL', "30"))
+        else:
+            self.link_cache_tombstone_ttl = link_cache_tombstone_ttl
+            
+    def route_deadline(self, route):
+        """
+        Seconds a request to route (listing, view...) has to be answered in, 
+        0 for no deadline.
+        
+        request_deadline unless it's overridden in route_deadlines[route] or 
+        by a LINKAPP_<ROUTE>_DEADLINE environment variable, eg. 
+        LINKAPP_LISTING_BY_TAG_DEADLINE.
+        """
+        env_name = 'LINKAPP_{}_DEADLINE'.format(route).upper()
+        
+        if route in self.route_deadlines:
+            return self.route_deadlines[route]
+        
+        if env_name in os.environ:
+            return float(os.environ[env_name])
+        
+        return self.request_deadline
+        
+    def service_options(self, service):
+        """
+        Keyword arguments for the ServiceWrapper of service (link, tag, 
+        authorization or readinglist).
+        
+        The gateway wide value of an option is used unless it's overridden 
+        in service_overrides[service] or by a LINKAPP_<SERVICE>_<OPTION> 
+        environment variable, eg. LINKAPP_TAG_POOL_SIZE.
+        """
+        overrides = self.service_overrides.get(service, {})
+        options = {}
+        
+        for name, (attribute, cast) in self.service_option_types.items():
+            env_name = 'LINKAPP_{}_{}'.format(service, name).upper()
+            
+            if name in overrides:
+                options[name] = overrides[name]
+            elif env_name in os.environ:
+                options[name] = cast(os.environ[env_name])
+            else:
+                options[name] = getattr(self, attribute)
+                
+        options['name'] = service
+                
+        return options
@@ -0,0 +1,121 @@
+"""
+The deadline of the request being handled, kept in a context variable so
+every backend call made for it, in whichever thread or task, can see how
+much time is left and size its timeout to fit.
+"""
+
+from contextlib import contextmanager
+import contextvars
+import time
+
+# forwarded to the backends on every call, milliseconds left of the deadline
+HEADER = 'X-Linkapp-Deadline'
+
+current = contextvars.ContextVar('linkapp_deadline', default=None)
+
+
+def at():
+    """
+    time.monotonic() of the current deadline, None if there isn't one.
+    """
+    return current.get()
+
+
+def remaining():
+    """
+    Seconds left until the current deadline, None if there isn't one.
+    """
+    deadline = current.get()
+
+    if deadline is None:
+        return None
+
+    return deadline - time.monotonic()
+
+
+def cap(timeout):
+    """
+    timeout, or what's left of the deadline if that's less.
+    """
+    left = remaining()
+
+    if left is None:
+        return timeout
+
+    return max(0, min(timeout, left))
+
+
+def headers(headers=None):
+    """
+    A copy of headers with the deadline header added, if there's a deadline.
+    """
+    headers = dict(headers or {})
+    left = remaining()
+
+    if left is not None:
+        headers[HEADER] = str(max(0, int(left * 1000)))
+
+    return headers
+
+
+@contextmanager
+def until(deadline):
+    """
+    Make deadline (a time.monotonic() value, or None for no deadline) the
+    current one for the duration of the block.
+    """
+    token = current.set(deadline)
+
+    try:
+        yield
+    finally:
+        current.reset(token)
+
+
+def within(seconds):
+    """
+    A deadline seconds from now for the duration of the block, no deadline
+    if seconds is 0 or None.
+    """
+    return until(time.monotonic() + seconds if seconds else None)
+
+
+def iterate(iterable, deadline):
+    """
+    Iterate over iterable with deadline in force while each item is made,
+    for response bodies that are iterated over after the handler returned.
+    """
+    iterator = iter(iterable)
+
+    try:
+        while True:
+            with until(deadline):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+
+            yield item
+    finally:
+        if hasattr(iterator, 'close'):
+            iterator.close()
+
+
+async def aiterate(iterable, deadline):
+    """
+    iterate for async iterables.
+    """
+    iterator = iterable.__aiter__()
+
+    try:
+        while True:
+            with until(deadline):
+                try:
+                    item = await iterator.__anext__()
+                except StopAsyncIteration:
+                    return
+
+            yield item
+    finally:
+        if hasattr(iterator, 'aclose'):
+            await iterator.aclose()
@@ -0,0 +1,388 @@
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+import contextvars
+import itertools
+import hashlib
+import asyncio
+import threading
+import json
+
+from . import wrapper
+
+# lookup errors that only leave the links concerned out of a partial
+# hydration, see Hydrator.hydrate_partial
+ERRORS = (wrapper.TooManyRetries, wrapper.BadRequest, wrapper.Overloaded)
+
+
+def version(link):
+    """
+    A short hash of what's in a hydrated link, it changes whenever the link
+    or its tags do.
+    """
+    content = {name: value for name, value in link.items() if name != 'version'}
+    digest = hashlib.sha1(json.dumps(content, sort_keys=True).encode('utf-8'))
+
+    return digest.hexdigest()[:16]
+
+
+def lookups(link_service, tag_service, link_ids):
+    """
+    The (func, args) calls fetching the link records and the tags of 
+    link_ids, see ServiceWrapper.get_many_calls, and how many of them are 
+    for the link records (they come first).
+    """
+    link_calls = link_service.get_many_calls(link_ids, "/{}")
+    tag_calls = tag_service.get_many_calls(link_ids, "/link/{}")
+
+    return link_calls + tag_calls, len(link_calls)
+
+
+def complete(link, link_id, tags):
+    link['tags'] = [{"name": x} for x in tags]
+    link['key'] = link_id
+    link['version'] = version(link)
+
+    return link
+
+
+def malformed(record, tags):
+    """
+    The error for a link whose record isn't an object, or whose tags
+    aren't a list, None if they're fine.
+    """
+    if not isinstance(record, dict) or not isinstance(tags, list):
+        return wrapper.ServerError("Malformed record or tags of a link")
+
+    return None
+
+
+def assemble(link_ids, results, split):
+    """
+    Put the results of lookups back together as link records, with their
+    'tags', 'key' and 'version'. A link the link service doesn't know raises NotFound,
+    one the tag service doesn't know has no tags.
+    """
+    records = wrapper.merge(results[:split])
+    tags = wrapper.merge(results[split:])
+    links = []
+
+    for link_id in link_ids:
+        if link_id not in records:
+            raise wrapper.NotFound()
+
+        error = malformed(records[link_id], tags.get(link_id, []))
+
+        if error is not None:
+            raise error
+
+        links.append(complete(records[link_id], link_id, tags.get(link_id, [])))
+
+    return links
+
+
+class Failed:
+    """
+    What a guarded lookup returns instead of raising one of ERRORS, or on a
+    response that isn't JSON, ids are the ones it was looking up.
+    """
+
+    def __init__(self, ids, error):
+        self.ids = ids
+        self.error = error
+
+
+def lookup_ids(args):
+    # a lookup's first argument is its id or its list of ids, see
+    # ServiceWrapper.get_many_calls
+    ids = args[0]
+
+    return list(ids) if isinstance(ids, (list, tuple)) else [ids]
+
+
+def attempt(func, args):
+    try:
+        return func(*args)
+    except ERRORS as e:
+        return Failed(lookup_ids(args), e)
+    except json.JSONDecodeError as e:
+        return Failed(lookup_ids(args), wrapper.ServerError("Malformed response: {}".format(e)))
+
+
+async def attempt_async(func, args):
+    try:
+        return await func(*args)
+    except ERRORS as e:
+        return Failed(lookup_ids(args), e)
+    except json.JSONDecodeError as e:
+        return Failed(lookup_ids(args), wrapper.ServerError("Malformed response: {}".format(e)))
+
+
+def guarded(calls, attempt=attempt):
+    """
+    calls made to return a Failed rather than raise one of ERRORS.
+    """
+    return [(attempt, (func, args)) for func, args in calls]
+
+
+def assemble_partial(link_ids, results, split):
+    """
+    Put the results of guarded lookups back together as a (link_id, link,
+    error) for each of link_ids, in order. error is None when the link was
+    found, NotFound when the link service doesn't know it and what went
+    wrong when its link or tags lookup failed or made no sense, link is 
+    None unless found.
+    """
+    failed = {}
+
+    for result in results:
+        if isinstance(result, Failed):
+            for link_id in result.ids:
+                failed.setdefault(link_id, result.error)
+
+    records = wrapper.merge(result for result in results[:split] if not isinstance(result, Failed))
+    tags = wrapper.merge(result for result in results[split:] if not isinstance(result, Failed))
+    entries = []
+
+    for link_id in link_ids:
+        if link_id in records and link_id not in failed:
+            error = malformed(records[link_id], tags.get(link_id, []))
+
+            if error is not None:
+                failed[link_id] = error
+
+        if link_id in failed:
+            entries.append((link_id, None, failed[link_id]))
+        elif link_id not in records:
+            entries.append((link_id, None, wrapper.NotFound()))
+        else:
+            entries.append((link_id, complete(records[link_id], link_id, tags.get(link_id, [])), None))
+
+    return entries
+
+
+def groups(link_service, tag_service, link_ids):
+    """
+    Split link_ids into groups fetched together, a batch when a service has
+    a bulk endpoint, one link otherwise, each with its lookups. For
+    streaming links in order as they're fetched.
+    """
+    size = max(service.batch_size if service.bulk_enabled() else 1 for service in (link_service, tag_service))
+    plan = []
+
+    for i in range(0, len(link_ids), size):
+        group = link_ids[i:i+size]
+        calls, split = lookups(link_service, tag_service, group)
+        plan.append((group, calls, split))
+
+    return plan
+
+
+class Hydrator:
+    """
+    Fetches the link and tag records for a page of link ids concurrently,
+    in batches when the services have a bulk endpoint.
+
+    The worker pool is shared by every request the gateway handles, the
+    concurrency limit applies to each call to hydrate so that one large page
+    can't take over the whole pool.
+    """
+
+    def __init__(self, link_service, tag_service, workers=32, concurrency=10):
+        self.link_service = link_service
+        self.tag_service = tag_service
+        self.concurrency = max(1, concurrency)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="linkapp-hydrate")
+
+    def submit(self, func, args):
+        """
+        Run func(*args) on the pool in a copy of the caller's context, so 
+        the request's deadline goes with it.
+        """
+        return self.executor.submit(contextvars.copy_context().run, func, *args)
+
+    def map(self, calls):
+        """
+        Run each (func, args) pair in calls on the pool, with no more than
+        self.concurrency of them in flight, and return the results in order.
+
+        The first exception raised by a call is re-raised here, calls that
+        haven't started yet are cancelled.
+        """
+        slots = threading.BoundedSemaphore(self.concurrency)
+        futures = []
+
+        def release(future):
+            slots.release()
+
+        try:
+            for func, args in calls:
+                slots.acquire()
+                future = self.submit(func, args)
+                future.add_done_callback(release)
+                futures.append(future)
+
+            return [future.result() for future in futures]
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+
+    def iter_map(self, calls):
+        """
+        Like map but yields each result as soon as it and the ones before it
+        are in, keeping self.concurrency calls in flight. Closing the
+        generator cancels the calls that haven't started.
+        """
+        calls = iter(calls)
+        pending = deque()
+
+        def submit():
+            for func, args in itertools.islice(calls, 1):
+                pending.append(self.submit(func, args))
+
+        for i in range(self.concurrency):
+            submit()
+
+        try:
+            while pending:
+                result = pending.popleft().result()
+                submit()
+
+                yield result
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def hydrate(self, link_ids):
+        """
+        Return the link records for link_ids, in the same order, each with
+        its 'tags', 'key' and 'version' filled in.
+        """
+        calls, split = lookups(self.link_service, self.tag_service, link_ids)
+
+        return assemble(link_ids, self.map(calls), split)
+
+    def hydrate_partial(self, link_ids):
+        """
+        A (link_id, link, error) for each of link_ids, in order, see 
+        assemble_partial. Links that don't exist or can't be fetched don't
+        fail the others.
+        """
+        calls, split = lookups(self.link_service, self.tag_service, link_ids)
+
+        return assemble_partial(link_ids, self.map(guarded(calls)), split)
+
+    def iter_hydrate(self, link_ids):
+        """
+        Yield the link records of hydrate one at a time, in order, as they
+        are fetched.
+        """
+        plan = groups(self.link_service, self.tag_service, link_ids)
+        results = self.iter_map(call for group, calls, split in plan for call in calls)
+
+        try:
+            for group, calls, split in plan:
+                yield from assemble(group, [next(results) for call in calls], split)
+        finally:
+            results.close()
+
+    def iter_hydrate_partial(self, link_ids):
+        """
+        The entries of hydrate_partial one at a time, as they are fetched.
+        """
+        plan = groups(self.link_service, self.tag_service, link_ids)
+        results = self.iter_map(call for group, calls, split in plan for call in guarded(calls))
+
+        try:
+            for group, calls, split in plan:
+                yield from assemble_partial(group, [next(results) for call in calls], split)
+        finally:
+            results.close()
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
+
+
+class AsyncHydrator:
+    """
+    Hydrator for AsyncServiceWrapper backends, the lookups of a page run as
+    tasks on the event loop, at most concurrency of them at a time.
+    """
+
+    def __init__(self, link_service, tag_service, concurrency=10):
+        self.link_service = link_service
+        self.tag_service = tag_service
+        self.concurrency = max(1, concurrency)
+
+    async def map(self, calls):
+        slots = asyncio.Semaphore(self.concurrency)
+
+        async def run(func, args):
+            async with slots:
+                return await func(*args)
+
+        tasks = [asyncio.ensure_future(run(func, args)) for func, args in calls]
+
+        try:
+            return await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+
+    async def hydrate(self, link_ids):
+        calls, split = lookups(self.link_service, self.tag_service, link_ids)
+
+        return assemble(link_ids, await self.map(calls), split)
+
+    async def hydrate_partial(self, link_ids):
+        calls, split = lookups(self.link_service, self.tag_service, link_ids)
+
+        return assemble_partial(link_ids, await self.map(guarded(calls, attempt_async)), split)
+
+    async def iter_map(self, calls):
+        calls = iter(calls)
+        pending = deque()
+
+        def submit():
+            for func, args in itertools.islice(calls, 1):
+                pending.append(asyncio.ensure_future(func(*args)))
+
+        for i in range(self.concurrency):
+            submit()
+
+        try:
+            while pending:
+                result = await pending.popleft()
+                submit()
+
+                yield result
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def iter_hydrate(self, link_ids):
+        plan = groups(self.link_service, self.tag_service, link_ids)
+        results = self.iter_map(call for group, calls, split in plan for call in calls)
+
+        try:
+            for group, calls, split in plan:
+                group_results = [await results.__anext__() for call in calls]
+
+                for link in assemble(group, group_results, split):
+                    yield link
+        finally:
+            await results.aclose()
+
+    async def iter_hydrate_partial(self, link_ids):
+        plan = groups(self.link_service, self.tag_service, link_ids)
+        results = self.iter_map(call for group, calls, split in plan for call in guarded(calls, attempt_async))
+
+        try:
+            for group, calls, split in plan:
+                group_results = [await results.__anext__() for call in calls]
+
+                for entry in assemble_partial(group, group_results, split):
+                    yield entry
+        finally:
+            await results.aclose()
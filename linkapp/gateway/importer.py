@@ -0,0 +1,366 @@
+"""
+Bulk import of links, for /import.
+
+The upload is read a line at a time, JSON Lines (an object per line) or CSV
+(with a header row), each record validated against schema.link_import_schema
+and written to the link then the tag service. Up to concurrency records of
+an import are written at a time, reading of the upload waiting while that
+many are in flight, and progress is reported every batch_size records, so
+neither the upload nor the results are ever held in memory whole.
+
+A link POST isn't retried once it may have reached the link service (see
+ServiceWrapper._check_replay), a record that fails that way is reported,
+not written twice.
+
+The import reports as it goes, a JSON object per line:
+
+    {"line": 12, "error": "'url_address' is a required property"}
+    {"line": 40, "error": "...", "link_id": "..."}   (tags couldn't be written)
+    {"progress": {"read": 100, "imported": 99, "failed": 1}}
+    {"done": {"read": 230, "imported": 228, "failed": 2}}
+"""
+
+from concurrent.futures import ThreadPoolExecutor, Future
+from collections import deque
+import threading
+import asyncio
+import json
+import csv
+
+from jsonschema import Draft4Validator
+from jsonschema.exceptions import best_match
+
+from . import wrapper
+from . import schema
+from . import metrics
+from . import log
+
+logger = log.get_logger(__name__)
+
+# link_add_schema's "required" is draft 4, Draft3Validator would ignore it
+VALIDATOR = Draft4Validator(schema.link_import_schema)
+
+FIELDS = tuple(schema.link_schema["properties"])
+
+FORMATS = {
+    'text/csv': 'csv',
+    'application/x-ndjson': 'jsonl',
+    'application/jsonl': 'jsonl',
+    'application/json-lines': 'jsonl',
+    'application/json': 'jsonl',
+}
+
+ERRORS = (wrapper.TooManyRetries, wrapper.BadRequest, wrapper.NotFound, wrapper.Overloaded)
+
+
+def read_jsonl(stream):
+    """
+    (line number, record or None if it isn't a JSON object) for each non
+    blank line of stream.
+    """
+    for number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+
+        try:
+            record = json.loads(line)
+        except ValueError:
+            record = None
+
+        yield number, record if isinstance(record, dict) else None
+
+
+def read_csv(stream):
+    reader = csv.DictReader(stream)
+
+    for row in reader:
+        yield reader.line_num, row
+
+
+READERS = {
+    'jsonl': read_jsonl,
+    'csv': read_csv
+}
+
+
+def tag_list(tags):
+    """
+    The tags of a record, a list or "|" separated like the form's, cleaned
+    up the way save does.
+    """
+    if isinstance(tags, str):
+        tags = tags.split('|')
+
+    if not isinstance(tags, list):
+        return tags
+
+    return sorted(set(tag.strip() for tag in tags if isinstance(tag, str) and tag.strip()))
+
+
+def prepare(record, author):
+    """
+    (link, tags, None) for a valid record, (None, None, message) otherwise.
+    The author is always the importing user.
+    """
+    if record is None:
+        return None, None, "Not a JSON object"
+
+    link = {field: record[field] for field in FIELDS if record.get(field) not in (None, '')}
+    link['author'] = author
+
+    tags = tag_list(record.get('tags'))
+
+    error = best_match(VALIDATOR.iter_errors(dict(link, tags=tags)))
+
+    if error is not None:
+        return None, None, error.message
+
+    return link, tags, None
+
+
+def failure(number, error, link_id=None):
+    """
+    The report line of a record that couldn't be imported.
+    """
+    if not isinstance(error, str):
+        error = str(error) or type(error).__name__
+
+    line = {'line': number, 'error': error}
+
+    if link_id is not None:
+        line['link_id'] = link_id
+
+    return line
+
+
+class LinkImporter:
+    """
+    Writes the records of an upload to the link and tag services, see the
+    module docstring. The worker pool is shared by every import, the
+    concurrency limit applies to each.
+    """
+
+    # batches written or being written that haven't been reported yet, 
+    # beyond these reading waits for the oldest to be done
+    backlog = 2
+
+    def __init__(self, link_service, tag_service, workers=16, concurrency=8, batch_size=100, registry=None):
+        self.link_service = link_service
+        self.tag_service = tag_service
+        self.concurrency = max(1, concurrency)
+        self.batch_size = max(1, batch_size)
+
+        if workers:
+            self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="linkapp-import")
+        else:
+            self.executor = None
+
+        if registry is None:
+            registry = metrics.Registry()
+
+        self.records = registry.counter('gateway_import_records_total',
+                                        'Imported records by outcome, imported, invalid or failed',
+                                        ('result',))
+
+    def batches(self, stream, format, author):
+        """
+        Lists of (line number, link, tags, error) of at most batch_size.
+        """
+        batch = []
+
+        for number, record in READERS[format](stream):
+            batch.append((number,) + prepare(record, author))
+
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+
+        if batch:
+            yield batch
+
+    def write(self, number, link, tags):
+        """
+        Write a valid record, returning its report line if it failed, however
+        it failed, None if it didn't.
+        """
+        try:
+            link_id = self.link_service.post("/", link)
+        except ERRORS as e:
+            return failure(number, e)
+        except Exception as e:
+            # a record shouldn't take the rest of the import down with it
+            logger.exception("Importing line %d failed", number)
+            return failure(number, e)
+
+        try:
+            # setting a link's tags again is harmless, so it can be retried
+            self.tag_service.post("/link/{}".format(link_id), {'tags': tags}, idempotent=True)
+        except ERRORS as e:
+            return failure(number, e, link_id)
+        except Exception as e:
+            logger.exception("Importing line %d failed", number)
+            return failure(number, e, link_id)
+
+        return None
+
+    def report(self, batch, outcomes, totals):
+        """
+        The report lines of a batch, given the outcome of each of its 
+        records, a report line or None.
+        """
+        failures = [outcome for outcome in outcomes if outcome is not None]
+        invalid = sum(1 for entry in batch if entry[3] is not None)
+        failed = len(failures) - invalid
+
+        totals['read'] += len(batch)
+        totals['failed'] += len(failures)
+        totals['imported'] += len(batch) - len(failures)
+
+        if invalid:
+            self.records.inc(invalid, result='invalid')
+
+        if failed:
+            self.records.inc(failed, result='failed')
+
+        if len(batch) > len(failures):
+            self.records.inc(len(batch) - len(failures), result='imported')
+
+        yield from failures
+
+        yield {'progress': dict(totals)}
+
+    def reportable(self, pending):
+        """
+        True if the oldest of the pending batches should be reported now: it's
+        done, or there are too many waiting.
+        """
+        return pending and (len(pending) > self.backlog or all(outcome.done() for outcome in pending[0][1]))
+
+    def run(self, stream, format, author):
+        """
+        Import the records of stream, a text file, yielding the report
+        lines as batches are written.
+        """
+        totals = {'read': 0, 'imported': 0, 'failed': 0}
+        slots = threading.BoundedSemaphore(self.concurrency)
+        pending = deque()
+
+        def release(future):
+            slots.release()
+
+        try:
+            for batch in self.batches(stream, format, author):
+                outcomes = []
+
+                for number, link, tags, error in batch:
+                    if error is not None:
+                        outcome = Future()
+                        outcome.set_result(failure(number, error))
+                    else:
+                        slots.acquire()
+                        outcome = self.executor.submit(self.write, number, link, tags)
+                        outcome.add_done_callback(release)
+
+                    outcomes.append(outcome)
+
+                pending.append((batch, outcomes))
+
+                while self.reportable(pending):
+                    done, outcomes = pending.popleft()
+                    yield from self.report(done, [outcome.result() for outcome in outcomes], totals)
+
+            while pending:
+                done, outcomes = pending.popleft()
+                yield from self.report(done, [outcome.result() for outcome in outcomes], totals)
+        finally:
+            for batch, outcomes in pending:
+                for outcome in outcomes:
+                    outcome.cancel()
+
+        yield {'done': totals}
+
+
+class AsyncLinkImporter(LinkImporter):
+    """
+    LinkImporter for the AsyncServiceWrapper, writes are tasks on the event
+    loop instead of jobs on a pool. The upload is read in a thread, it may
+    be waiting on the client (see asgi.ReceiveStream).
+    """
+
+    def __init__(self, link_service, tag_service, concurrency=8, batch_size=100, registry=None):
+        super().__init__(link_service, tag_service, workers=0, concurrency=concurrency,
+                         batch_size=batch_size, registry=registry)
+
+    async def write(self, number, link, tags):
+        try:
+            link_id = await self.link_service.post("/", link)
+        except ERRORS as e:
+            return failure(number, e)
+        except Exception as e:
+            logger.exception("Importing line %d failed", number)
+            return failure(number, e)
+
+        try:
+            await self.tag_service.post("/link/{}".format(link_id), {'tags': tags}, idempotent=True)
+        except ERRORS as e:
+            return failure(number, e, link_id)
+        except Exception as e:
+            logger.exception("Importing line %d failed", number)
+            return failure(number, e, link_id)
+
+        return None
+
+    async def run(self, stream, format, author):
+        totals = {'read': 0, 'imported': 0, 'failed': 0}
+        slots = asyncio.Semaphore(self.concurrency)
+        pending = deque()
+        batches = self.batches(stream, format, author)
+
+        def release(task):
+            slots.release()
+
+        try:
+            while True:
+                batch = await asyncio.to_thread(next, batches, None)
+
+                if batch is None:
+                    break
+
+                outcomes = []
+
+                for number, link, tags, error in batch:
+                    if error is not None:
+                        outcome = asyncio.get_running_loop().create_future()
+                        outcome.set_result(failure(number, error))
+                    else:
+                        await slots.acquire()
+                        outcome = asyncio.ensure_future(self.write(number, link, tags))
+                        outcome.add_done_callback(release)
+
+                    outcomes.append(outcome)
+
+                pending.append((batch, outcomes))
+
+                while self.reportable(pending):
+                    done, outcomes = pending.popleft()
+
+                    for line in self.report(done, await asyncio.gather(*outcomes), totals):
+                        yield line
+
+            while pending:
+                done, outcomes = pending.popleft()
+
+                for line in self.report(done, await asyncio.gather(*outcomes), totals):
+                    yield line
+        finally:
+            try:
+                batches.close()
+            except ValueError:
+                # still being read by a cancelled to_thread
+                pass
+
+            for batch, outcomes in pending:
+                for outcome in outcomes:
+                    outcome.cancel()
+
+        yield {'done': totals}
@@ -0,0 +1,54 @@
+import logging
+import random
+
+LOGGER_NAME = 'linkapp.gateway'
+
+
+class SampleFilter(logging.Filter):
+    """
+    Lets through a rate fraction of the records below WARNING, warnings and
+    errors always get through.
+    """
+
+    def __init__(self, rate=1.0):
+        logging.Filter.__init__(self)
+        self.rate = rate
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or self.rate >= 1:
+            return True
+
+        return random.random() < self.rate
+
+
+# shared by every logger handed out by get_logger, logger filters don't
+# apply to records coming up from child loggers
+sampler = SampleFilter()
+
+
+def get_logger(name):
+    logger = logging.getLogger(name)
+
+    if sampler not in logger.filters:
+        logger.addFilter(sampler)
+
+    return logger
+
+
+def configure(level="WARNING", sample_rate=1.0):
+    """
+    Set the level of the gateway's loggers and the fraction of records below
+    WARNING they keep. A stderr handler is added if nothing handles the
+    records yet.
+    """
+    logger = logging.getLogger(LOGGER_NAME)
+    logger.setLevel(level.upper() if isinstance(level, str) else level)
+
+    sampler.rate = sample_rate
+
+    if not logger.hasHandlers():
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s %(message)s"))
+        logger.addHandler(handler)
+
+    return logger
@@ -0,0 +1,167 @@
+"""
+Counters and histograms kept in process and rendered in the Prometheus text
+exposition format, served by the gateway on /metrics.
+"""
+
+import threading
+import bisect
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+
+    return "{" + ",".join('{}="{}"'.format(name, escape(value)) for name, value in labels) + "}"
+
+
+def format_value(value):
+    if value == float('inf'):
+        return "+Inf"
+
+    if float(value).is_integer():
+        return str(int(value))
+
+    return repr(float(value))
+
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def key(self, labels):
+        # label values are strings, status=200 and status='error' side by side
+        # have to sort
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def header(self):
+        return ["# HELP {} {}".format(self.name, self.help),
+                "# TYPE {} {}".format(self.name, self.kind)]
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self.lock:
+            return self.values.get(self.key(labels), 0)
+
+    def render(self):
+        lines = self.header()
+
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                labels = format_labels(zip(self.labelnames, key))
+                lines.append("{}{} {}".format(self.name, labels, format_value(value)))
+
+        return lines
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        Metric.__init__(self, name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+
+        with self.lock:
+            counts = self.values.get(key)
+
+            if counts is None:
+                # per bucket counts, the last one being +Inf, then the sum
+                counts = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+
+            counts[index] += 1
+            counts[-1] += value
+
+    def render(self):
+        lines = self.header()
+
+        with self.lock:
+            for key, counts in sorted(self.values.items()):
+                labels = list(zip(self.labelnames, key))
+                cumulative = 0
+
+                for bound, count in zip(self.buckets + (float('inf'),), counts):
+                    cumulative += count
+                    bucket_labels = format_labels(labels + [('le', format_value(bound))])
+                    lines.append("{}_bucket{} {}".format(self.name, bucket_labels, cumulative))
+
+                lines.append("{}_sum{} {}".format(self.name, format_labels(labels), format_value(counts[-1])))
+                lines.append("{}_count{} {}".format(self.name, format_labels(labels), cumulative))
+
+        return lines
+
+
+class Registry:
+    """
+    The metrics of one gateway. Values that are already counted elsewhere
+    (connection pools, circuit breakers...) are read at scrape time by
+    collectors, functions returning (name, kind, help, samples) tuples where
+    samples is a list of (labels dict, value).
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+        self.collectors = []
+
+    def _get_or_create(self, cls, name, *args, **kwargs):
+        with self.lock:
+            metric = self.metrics.get(name)
+
+            if metric is None:
+                metric = self.metrics[name] = cls(name, *args, **kwargs)
+
+            return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self._get_or_create(Counter, name, help, labelnames)
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._get_or_create(Histogram, name, help, labelnames, buckets=buckets)
+
+    def add_collector(self, collector):
+        with self.lock:
+            self.collectors.append(collector)
+
+    def render(self):
+        lines = []
+
+        with self.lock:
+            metrics = list(self.metrics.values())
+            collectors = list(self.collectors)
+
+        for metric in metrics:
+            lines.extend(metric.render())
+
+        for collector in collectors:
+            for name, kind, help, samples in collector():
+                lines.append("# HELP {} {}".format(name, help))
+                lines.append("# TYPE {} {}".format(name, kind))
+
+                for labels, value in samples:
+                    lines.append("{}{} {}".format(name, format_labels(sorted(labels.items())), format_value(value)))
+
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,179 @@
+"""
+Background prefetch of the page after the one a user is looking at, into
+the page cache, so following "next" doesn't start cold.
+"""
+
+from collections import deque
+import threading
+import asyncio
+import time
+
+from . import deadline
+from . import metrics
+from . import log
+
+logger = log.get_logger(__name__)
+
+
+class RateLimiter:
+    """
+    Spaces out callers so there's no more than rate of them a second,
+    across every thread.
+    """
+
+    def __init__(self, rate=2.0):
+        self.interval = 1.0 / rate if rate > 0 else 0
+        self.lock = threading.Lock()
+        self.next_at = 0
+
+    def delay(self):
+        """
+        Reserve the next slot and return how many seconds to wait for it.
+        """
+        with self.lock:
+            now = time.monotonic()
+            at = max(now, self.next_at)
+            self.next_at = at + self.interval
+
+        return at - now
+
+    def wait(self):
+        time.sleep(self.delay())
+
+
+class Prefetcher:
+    """
+    Fetches pages into page_cache on a single background thread, at most
+    rate pages a second so it stays out of the way of the requests being
+    served.
+
+    At most queue_size pages wait their turn, more are dropped. A page
+    that's already queued or fresh in the cache isn't queued again.
+    """
+
+    def __init__(self, page_cache, rate=2.0, queue_size=32, registry=None):
+        self.page_cache = page_cache
+        self.limiter = RateLimiter(rate)
+        self.queue_size = queue_size
+        self.condition = threading.Condition()
+        self.pending = deque()
+        self.keys = set()
+        self.thread = None
+
+        if registry is None:
+            registry = metrics.Registry()
+
+        self.prefetches = registry.counter('gateway_prefetch_total',
+                                           'Pages submitted for prefetching by outcome',
+                                           ('result',))
+
+    def submit(self, key, fetch, *args):
+        """
+        Queue fetch(*args) to be stored in the page cache under key, True if
+        it was.
+        """
+        entry, state = self.page_cache.lookup(key)
+
+        if state == 'hit':
+            self.prefetches.inc(result='fresh')
+            return False
+
+        with self.condition:
+            if key in self.keys:
+                self.prefetches.inc(result='duplicate')
+                return False
+
+            if len(self.pending) >= self.queue_size:
+                self.prefetches.inc(result='dropped')
+                return False
+
+            self.keys.add(key)
+            self.pending.append((key, fetch, args))
+            self.condition.notify()
+
+        self.prefetches.inc(result='queued')
+        self.start()
+
+        return True
+
+    def start(self):
+        with self.condition:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="linkapp-prefetch", daemon=True)
+                self.thread.start()
+
+    def next(self):
+        with self.condition:
+            self.condition.wait_for(lambda: self.pending)
+
+            return self.pending.popleft()
+
+    def done(self, key, error=None):
+        with self.condition:
+            self.keys.discard(key)
+
+        if error is None:
+            self.prefetches.inc(result='fetched')
+        else:
+            logger.info("Prefetching %s failed: %s", key, error)
+            self.prefetches.inc(result='failed')
+
+    def run(self):
+        while True:
+            key, fetch, args = self.next()
+
+            try:
+                self.limiter.wait()
+
+                # fetched by a request while it waited
+                if self.page_cache.lookup(key)[1] != 'hit':
+                    self.page_cache.store(key, fetch(*args))
+            except Exception as e:
+                self.done(key, e)
+            else:
+                self.done(key)
+
+
+class AsyncPrefetcher(Prefetcher):
+    """
+    Prefetcher for coroutine fetch functions, run by a task on the event
+    loop instead of a thread.
+    """
+
+    def __init__(self, *args, **kwargs):
+        Prefetcher.__init__(self, *args, **kwargs)
+        self.wakeup = None
+        self.task = None
+
+    def start(self):
+        if self.wakeup is None:
+            self.wakeup = asyncio.Event()
+
+        self.wakeup.set()
+
+        if self.task is None or self.task.done():
+            self.task = asyncio.ensure_future(self.run())
+
+    async def run(self):
+        while True:
+            with self.condition:
+                item = self.pending.popleft() if self.pending else None
+
+            if item is None:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+
+            key, fetch, args = item
+
+            try:
+                await asyncio.sleep(self.limiter.delay())
+
+                # the task inherited the context of the request that started it
+                with deadline.until(None):
+                    if self.page_cache.lookup(key)[1] != 'hit':
+                        self.page_cache.store(key, await fetch(*args))
+            except Exception as e:
+                self.done(key, e)
+            else:
+                self.done(key)
@@ -0,0 +1,275 @@
+"""
+Queued writes for the save path.
+
+With queued_writes on, GatewayService.save publishes the link and its tags
+to WRITE_QUEUE and redirects straight away. The writer (the
+linkapp-gateway-writer command, see main) consumes the queue and applies
+the link and tag writes, retrying failed messages and moving the ones that
+can't be applied to DEAD_LETTER_QUEUE.
+"""
+
+from collections import deque
+import threading
+import json
+import time
+
+import pika
+import redis
+
+from . import wrapper
+from .config import GatewayConfig
+from .cache import LinkCache
+from . import log
+
+WRITE_QUEUE = 'linkapp.gateway.writes'
+DEAD_LETTER_QUEUE = 'linkapp.gateway.writes.dead'
+
+logger = log.get_logger(__name__)
+
+
+class Transport:
+    """
+    What the write pipeline needs from a message broker.
+    """
+
+    def publish(self, queue, message):
+        """
+        Durably queue message, a JSON serializable dict.
+        """
+        raise NotImplementedError()
+
+    def consume(self, queue, callback, timeout=None):
+        """
+        Call callback with each message of queue, acknowledging it once
+        callback returns. Gives up after timeout seconds without a message,
+        None waits forever.
+        """
+        raise NotImplementedError()
+
+    def close(self):
+        pass
+
+
+class MemoryTransport(Transport):
+    """
+    In-process transport, for running the pipeline without a broker.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.queues = {}
+
+    def publish(self, queue, message):
+        with self.condition:
+            self.queues.setdefault(queue, deque()).append(json.dumps(message))
+            self.condition.notify_all()
+
+    def messages(self, queue):
+        with self.condition:
+            return [json.loads(body) for body in self.queues.get(queue, ())]
+
+    def consume(self, queue, callback, timeout=None):
+        while True:
+            with self.condition:
+                pending = self.queues.setdefault(queue, deque())
+
+                if not pending and not self.condition.wait_for(lambda: pending, timeout):
+                    return
+
+                body = pending.popleft()
+
+            callback(json.loads(body))
+
+
+class PikaTransport(Transport):
+    """
+    RabbitMQ transport, messages are persistent and queues durable.
+
+    The connection is made on first use, retrying up to retries times,
+    and is shared by the threads of a worker behind a lock.
+    """
+
+    def __init__(self, url, retries=10, retry_sleep=0.1):
+        self.url = url
+        self.retries = retries
+        self.retry_sleep = retry_sleep
+        self.lock = threading.Lock()
+        self.connection = None
+        self.channel = None
+        self.declared = set()
+
+    def connect(self):
+        attempt = 0
+
+        while True:
+            try:
+                self.connection = pika.BlockingConnection(pika.URLParameters(self.url))
+                self.channel = self.connection.channel()
+                self.declared = set()
+
+                return self.channel
+            except pika.exceptions.AMQPConnectionError:
+                attempt += 1
+
+                if attempt >= self.retries:
+                    raise
+
+                time.sleep(self.retry_sleep * attempt)
+
+    def declare(self, queue):
+        if self.channel is None or self.channel.is_closed:
+            self.connect()
+
+        if queue not in self.declared:
+            self.channel.queue_declare(queue=queue, durable=True)
+            self.declared.add(queue)
+
+        return self.channel
+
+    def publish(self, queue, message):
+        body = json.dumps(message)
+        properties = pika.BasicProperties(delivery_mode=2, content_type='application/json')
+
+        with self.lock:
+            try:
+                self.declare(queue).basic_publish(exchange='', routing_key=queue, body=body, properties=properties)
+            except pika.exceptions.AMQPError:
+                # stale connection, one more go on a fresh one
+                self.channel = None
+                self.declare(queue).basic_publish(exchange='', routing_key=queue, body=body, properties=properties)
+
+    def consume(self, queue, callback, timeout=None):
+        with self.lock:
+            channel = self.declare(queue)
+            channel.basic_qos(prefetch_count=1)
+
+        for method, properties, body in channel.consume(queue, inactivity_timeout=timeout):
+            if method is None:
+                channel.cancel()
+                return
+
+            callback(json.loads(body))
+            channel.basic_ack(method.delivery_tag)
+
+    def close(self):
+        with self.lock:
+            if self.connection is not None and self.connection.is_open:
+                self.connection.close()
+
+            self.connection = None
+            self.channel = None
+
+
+class WritePipeline:
+    """
+    Publishes link saves and applies them to the link and tag services.
+
+    A message is retried up to retries times, sleeping retry_sleep seconds
+    times the attempt number before putting it back on the queue. Messages
+    the backends reject, or that ran out of attempts, go to the dead letter
+    queue, as do new links whose POST may or may not have reached the link
+    service (wrapper.NotRetried) and messages that failed unexpectedly. on_applied is called with the link id
+    after each successful write, the gateway uses it to invalidate cached
+    copies.
+    """
+
+    def __init__(self, transport, link_service=None, tag_service=None, retries=5, retry_sleep=0.1, on_applied=None):
+        self.transport = transport
+        self.link_service = link_service
+        self.tag_service = tag_service
+        self.retries = retries
+        self.retry_sleep = retry_sleep
+        self.on_applied = on_applied
+
+    def submit(self, link, tags, link_id=None):
+        self.transport.publish(WRITE_QUEUE, {
+            'link_id': link_id,
+            'new': link_id is None,
+            'link': link,
+            'tags': tags,
+            'link_written': False,
+            'attempts': 0
+        })
+
+    def apply(self, message):
+        """
+        Write the link then its tags. Once the link is written the message
+        remembers it (and the id of a new link) so a retry only redoes the
+        tags.
+        """
+        if not message['link_written']:
+            if message['new']:
+                message['link_id'] = self.link_service.post("/", message['link'])
+            else:
+                self.link_service.put("/{}".format(message['link_id']), message['link'])
+
+            message['link_written'] = True
+
+        tags = {'tags': message['tags']}
+
+        if message['new']:
+            # setting a link's tags again is harmless, so it can be retried
+            self.tag_service.post("/link/{}".format(message['link_id']), tags, idempotent=True)
+        else:
+            self.tag_service.put("/link/{}".format(message['link_id']), tags)
+
+        return message['link_id']
+
+    def dead_letter(self, message, error):
+        message['error'] = "{}: {}".format(type(error).__name__, error)
+        self.transport.publish(DEAD_LETTER_QUEUE, message)
+
+    def handle(self, message):
+        try:
+            link_id = self.apply(message)
+        except (wrapper.BadRequest, wrapper.NotFound, wrapper.Unauthorized, wrapper.NotRetried) as e:
+            # a NotRetried link POST may have been applied, trying it again
+            # could write the link twice
+            self.dead_letter(message, e)
+        except (wrapper.TooManyRetries, wrapper.Overloaded) as e:
+            message['attempts'] += 1
+
+            if message['attempts'] >= self.retries:
+                self.dead_letter(message, e)
+            else:
+                time.sleep(self.retry_sleep * message['attempts'])
+                self.transport.publish(WRITE_QUEUE, message)
+        except Exception as e:
+            # an answer the pipeline can't make sense of, the message is 
+            # kept rather than lost, or redelivered to crash the writer again
+            logger.exception("Applying a queued write failed")
+            self.dead_letter(message, e)
+        else:
+            if self.on_applied is not None:
+                self.on_applied(link_id)
+
+    def run(self, timeout=None):
+        self.transport.consume(WRITE_QUEUE, self.handle, timeout=timeout)
+
+
+def main():
+    """
+    Entry point of the linkapp-gateway-writer command, applies queued writes
+    until interrupted. Configured with the same environment variables as the
+    gateway.
+    """
+    config = GatewayConfig()
+
+    link_cache = LinkCache(redis.Redis.from_url(config.redis_url),
+                           ttl=config.link_cache_ttl,
+                           local_size=0,
+                           tombstone_ttl=config.link_cache_tombstone_ttl)
+
+    pipeline = WritePipeline(PikaTransport(config.rabbit_url, config.rabbit_retries, config.rabbit_retry_sleep),
+                             wrapper.ServiceWrapper(config.link_service_url, **config.service_options('link')),
+                             wrapper.ServiceWrapper(config.tag_service_url, **config.service_options('tag')),
+                             retries=config.write_retries,
+                             retry_sleep=config.rabbit_retry_sleep,
+                             on_applied=link_cache.invalidate)
+
+    try:
+        pipeline.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        pipeline.transport.close()
@@ -0,0 +1,164 @@
+from collections import OrderedDict
+import os
+import hashlib
+import threading
+
+import pystache
+
+from . import hydrate
+from . import metrics
+from . import timing
+
+
+class TemplateCache:
+    """
+    Parses every template in directory once and renders from the parsed
+    copies, with the same render_name interface as pystache.Renderer.
+
+    With reload=True the file's mtime is checked on each render and the
+    template is parsed again when it changed, for working on the templates
+    without restarting the gateway.
+    """
+
+    def __init__(self, directory, file_extension='html', reload=False):
+        self.directory = directory
+        self.file_extension = file_extension
+        self.reload = reload
+        self.lock = threading.Lock()
+        self.templates = {}
+
+        self.renderer = pystache.Renderer(search_dirs=directory, file_extension=file_extension)
+
+        suffix = "." + file_extension
+
+        for filename in os.listdir(directory):
+            if filename.endswith(suffix):
+                self.load(filename[:-len(suffix)])
+
+    def path(self, name):
+        return os.path.join(self.directory, "{}.{}".format(name, self.file_extension))
+
+    def load(self, name):
+        path = self.path(name)
+
+        mtime = os.path.getmtime(path)
+
+        with open(path, encoding='utf-8') as template_file:
+            parsed = pystache.parse(template_file.read())
+
+        with self.lock:
+            self.templates[name] = (mtime, parsed)
+
+        return parsed
+
+    def get(self, name):
+        """
+        Return the parsed template called name.
+        """
+        entry = self.templates.get(name)
+
+        if entry is None:
+            return self.load(name)
+
+        mtime, parsed = entry
+
+        if self.reload and os.path.getmtime(self.path(name)) != mtime:
+            return self.load(name)
+
+        return parsed
+
+    def version(self):
+        """
+        Changes whenever a template is (re)loaded from a changed file.
+        """
+        with self.lock:
+            loaded = sorted((name, mtime) for name, (mtime, parsed) in self.templates.items())
+
+        return hashlib.sha1(repr(loaded).encode('utf-8')).hexdigest()[:12]
+
+    def render_name(self, name, *context, **kwargs):
+        with timing.phase('render'):
+            return self.renderer.render(self.get(name), *context, **kwargs)
+
+
+class FragmentCache:
+    """
+    Rendered HTML of the per-link templates (a listing entry...), so a page
+    is assembled by joining strings instead of rendering each link again.
+
+    A fragment is keyed by template, link id, the link's version (see
+    hydrate.version) and variant, what else the output depends on, eg.
+    whether there's a logged in user. The size most recently used fragments
+    are kept, none while the templates are being reloaded.
+    """
+
+    def __init__(self, templates, size=1024, registry=None):
+        self.templates = templates
+        self.size = size
+        self.lock = threading.Lock()
+        self.fragments = OrderedDict()
+
+        if registry is None:
+            registry = metrics.Registry()
+
+        self.lookups = registry.counter('gateway_fragment_cache_total',
+                                        'Per-link fragments rendered (miss) or reused (hit)',
+                                        ('result',))
+
+    @property
+    def enabled(self):
+        return self.size > 0 and not self.templates.reload
+
+    def render(self, name, link, context, variant=None):
+        """
+        The HTML of template name for link, with context (the values that
+        are the same for every link of the page) behind it.
+        """
+        return self.join(name, [link], context, variant)
+
+    def join(self, name, links, context, variant=None):
+        """
+        The concatenated HTML of template name for each of links.
+        """
+        keys = [(name, link['key'], link.get('version') or hydrate.version(link), variant) for link in links]
+        enabled = self.enabled
+
+        with self.lock:
+            html = [self.fragments.get(key) if enabled else None for key in keys]
+
+            for key, fragment in zip(keys, html):
+                if fragment is not None:
+                    self.fragments.move_to_end(key)
+
+        missing = [i for i, fragment in enumerate(html) if fragment is None]
+
+        for i in missing:
+            html[i] = self.templates.render_name(name, context, links[i])
+
+        if missing and enabled:
+            with self.lock:
+                for i in missing:
+                    self.fragments[keys[i]] = html[i]
+
+                while len(self.fragments) > self.size:
+                    self.fragments.popitem(last=False)
+
+        if len(missing) < len(html):
+            self.lookups.inc(len(html) - len(missing), result='hit')
+
+        if missing:
+            self.lookups.inc(len(missing), result='miss')
+
+        return "".join(html)
+
+    def invalidate(self, link_id):
+        """
+        Drop every fragment of link_id.
+        """
+        with self.lock:
+            for key in [key for key in self.fragments if key[1] == link_id]:
+                del self.fragments[key]
+
+    def clear(self):
+        with self.lock:
+            self.fragments.clear()
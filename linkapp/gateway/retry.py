@@ -0,0 +1,240 @@
+import time
+import random
+import asyncio
+import threading
+import collections
+
+
+class RetryPolicy:
+    """
+    How a single backend call is retried: at most retries attempts, sleeping
+    an exponentially growing, jittered, amount between them and never going
+    past budget seconds from the first attempt.
+    """
+
+    def __init__(self, retries=10, sleep=0.1, max_sleep=1.0, budget=5.0):
+        self.retries = retries
+        self.sleep = sleep
+        self.max_sleep = max_sleep
+        self.budget = budget
+
+    def backoff(self, attempt):
+        """
+        Seconds to wait before retry number attempt (starting at 1), "full
+        jitter" so callers that failed together don't retry together.
+        """
+        return random.uniform(0, min(self.max_sleep, self.sleep * (2 ** attempt)))
+
+
+class CircuitBreaker:
+    """
+    Stops calls to a backend after threshold consecutive failures.
+
+    While open every call fails fast, after reset_timeout seconds a single
+    call is let through (half open) to probe the backend, its success closes
+    the breaker and its failure opens it again.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, threshold=5, reset_timeout=10.0):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.lock = threading.Lock()
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0
+        self.trips = 0
+        self.probing = False
+
+    def allow(self):
+        with self.lock:
+            if self.state == self.CLOSED:
+                return True
+
+            if self.state == self.OPEN:
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    return False
+
+                self.state = self.HALF_OPEN
+                self.probing = False
+
+            if self.probing:
+                return False
+
+            self.probing = True
+
+            return True
+
+    def record_success(self):
+        with self.lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self.probing = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+
+            if self.state == self.HALF_OPEN or self.failures >= self.threshold:
+                if self.state != self.OPEN:
+                    self.trips += 1
+
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                self.probing = False
+
+    def release_probe(self):
+        """
+        For a call let through that ended without an outcome (it was 
+        cancelled): while half open, the next call gets to probe instead.
+        """
+        with self.lock:
+            if self.state == self.HALF_OPEN:
+                self.probing = False
+
+    def snapshot(self):
+        with self.lock:
+            return {'state': self.state,
+                    'failures': self.failures,
+                    'trips': self.trips}
+
+
+class AdmissionLimiter:
+    """
+    Caps the calls in flight to a backend at limit. Past it up to
+    queue_size callers wait, each for at most wait seconds, for a call to
+    finish, the rest are turned away at once. A limit of 0 lets everything
+    through.
+
+    acquire returns ADMITTED, or why the caller was turned away, an
+    admitted caller must release when its call is done. It waits for wait
+    seconds unless told otherwise.
+    """
+
+    ADMITTED = 'admitted'
+    QUEUE_FULL = 'queue_full'
+    TIMED_OUT = 'timed_out'
+
+    def __init__(self, limit=0, queue_size=0, wait=1.0):
+        self.limit = limit
+        self.queue_size = queue_size
+        self.wait = wait
+        self.condition = threading.Condition()
+        self.in_flight = 0
+        self.waiting = 0
+
+    @property
+    def enabled(self):
+        return self.limit > 0
+
+    def acquire(self, wait=None):
+        if not self.enabled:
+            return self.ADMITTED
+
+        if wait is None:
+            wait = self.wait
+
+        with self.condition:
+            if self.in_flight < self.limit:
+                self.in_flight += 1
+                return self.ADMITTED
+
+            if self.waiting >= self.queue_size:
+                return self.QUEUE_FULL
+
+            self.waiting += 1
+
+            try:
+                admitted = self.condition.wait_for(lambda: self.in_flight < self.limit, wait)
+            finally:
+                self.waiting -= 1
+
+            if not admitted:
+                return self.TIMED_OUT
+
+            self.in_flight += 1
+
+            return self.ADMITTED
+
+    def release(self):
+        if not self.enabled:
+            return
+
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify()
+
+    def snapshot(self):
+        with self.condition:
+            return {'in_flight': self.in_flight,
+                    'waiting': self.waiting}
+
+
+class AsyncAdmissionLimiter(AdmissionLimiter):
+    """
+    AdmissionLimiter for callers on one event loop, acquire is a coroutine
+    and a released slot is handed straight to the longest waiting caller.
+    """
+
+    def __init__(self, *args, **kwargs):
+        AdmissionLimiter.__init__(self, *args, **kwargs)
+        self.waiters = collections.deque()
+
+    async def acquire(self, wait=None):
+        if not self.enabled:
+            return self.ADMITTED
+
+        if wait is None:
+            wait = self.wait
+
+        if self.in_flight < self.limit and not self.waiters:
+            self.in_flight += 1
+            return self.ADMITTED
+
+        if len(self.waiters) >= self.queue_size:
+            return self.QUEUE_FULL
+
+        waiter = asyncio.get_event_loop().create_future()
+        self.waiters.append(waiter)
+        self.waiting = len(self.waiters)
+
+        try:
+            await asyncio.wait_for(waiter, wait)
+        except asyncio.TimeoutError:
+            # the slot may have been handed over just as the wait ran out
+            if not waiter.done() or waiter.cancelled():
+                return self.TIMED_OUT
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+
+            raise
+        finally:
+            if waiter in self.waiters:
+                self.waiters.remove(waiter)
+
+            self.waiting = len(self.waiters)
+
+        return self.ADMITTED
+
+    def release(self):
+        if not self.enabled:
+            return
+
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            self.waiting = len(self.waiters)
+
+            if not waiter.done():
+                # the slot goes to the waiter, in_flight stays the same
+                waiter.set_result(None)
+                return
+
+        self.in_flight -= 1
+
+    def snapshot(self):
+        return {'in_flight': self.in_flight,
+                'waiting': self.waiting}
@@ -0,0 +1,57 @@
+import re
+
+
+class Route:
+    """
+    A path pattern, the handler it dispatches to and the HTTP methods the
+    handler accepts.
+    """
+
+    def __init__(self, name, pattern, handler, methods):
+        self.name = name
+        self.regexp = re.compile(pattern)
+        self.handler = handler
+        self.methods = frozenset(methods)
+
+
+class Router:
+    """
+    Routes are bucketed by the first segment of their path so a request is
+    only matched against the patterns that can possibly apply to it, usually
+    exactly one.
+    """
+
+    def __init__(self):
+        self.routes = {}
+
+    def add(self, segments, pattern, handler, methods=("GET",), name=None):
+        """
+        Register handler for pattern. segments is the first path segment (or
+        a tuple of them) pattern can match, "" being the root.
+        """
+        if isinstance(segments, str):
+            segments = (segments,)
+
+        if name is None:
+            name = handler.__name__
+
+        route = Route(name, pattern, handler, methods)
+
+        for segment in segments:
+            self.routes.setdefault(segment, []).append(route)
+
+        return route
+
+    def match(self, path):
+        """
+        Return (route, kwargs) for path, or (None, None) if no route matches.
+        """
+        segment = path[1:].split("/", 1)[0]
+
+        for route in self.routes.get(segment, ()):
+            match = route.regexp.match(path)
+
+            if match:
+                return route, match.groupdict()
+
+        return None, None
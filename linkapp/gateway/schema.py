@@ -9,4 +9,10 @@ link_schema = {
 }
 
 link_add_schema = link_schema.copy()
-link_add_schema["required"] = ["page_title", "desc_text", "url_address", "author"]
\ No newline at end of file
+link_add_schema["required"] = ["page_title", "desc_text", "url_address", "author"]
+
+# a record of an /import upload, a link and its tags
+link_import_schema = link_add_schema.copy()
+link_import_schema["properties"] = dict(link_add_schema["properties"],
+                                        tags={ "type": "array", "minItems":1, "items": { "type": "string", "minLength":1 } })
+link_import_schema["required"] = link_add_schema["required"] + ["tags"]
@@ -0,0 +1,88 @@
+import os
+import hmac
+import time
+import base64
+import hashlib
+
+from .cache import LocalLRU
+
+
+class SessionSigner:
+    """
+    Issues and checks HMAC signed session tokens that carry a username and
+    an expiry time, so a verified user doesn't have to be checked against
+    the authorization service again until the token runs out.
+
+    Every worker has to share the secret for tokens to be accepted across
+    workers.
+    """
+
+    def __init__(self, secret, ttl=3600):
+        if isinstance(secret, str):
+            secret = secret.encode('utf-8')
+
+        self.secret = secret
+        self.ttl = ttl
+
+    def sign(self, payload):
+        return hmac.new(self.secret, payload.encode('utf-8'), hashlib.sha256).hexdigest()
+
+    def issue(self, username):
+        encoded = base64.urlsafe_b64encode(username.encode('utf-8')).decode('ascii').rstrip("=")
+        payload = "{}.{}".format(encoded, int(time.time() + self.ttl))
+
+        return "{}.{}".format(payload, self.sign(payload))
+
+    def verify(self, token):
+        """
+        Return (username, expires) if token is genuine and current, (None, 0)
+        otherwise.
+        """
+        try:
+            encoded, expires, signature = token.split(".")
+            expires = int(expires)
+        except (AttributeError, ValueError):
+            return None, 0
+
+        try:
+            genuine = hmac.compare_digest(signature, self.sign("{}.{}".format(encoded, expires)))
+        except TypeError:
+            genuine = False
+
+        if not genuine:
+            return None, 0
+
+        if expires < time.time():
+            return None, 0
+
+        try:
+            padded = encoded + "=" * (-len(encoded) % 4)
+            username = base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8')
+        except ValueError:
+            return None, 0
+
+        return username, expires
+
+
+class CredentialCache:
+    """
+    Remembers recently verified username/password pairs for ttl seconds.
+
+    Only a salted HMAC of the pair is kept, the salt is random per process.
+    """
+
+    def __init__(self, ttl=60, size=1024):
+        self.ttl = ttl
+        self.salt = os.urandom(16)
+        self.entries = LocalLRU(size)
+
+    def key(self, username, password):
+        credentials = "{}\0{}".format(username, password).encode('utf-8')
+
+        return hmac.new(self.salt, credentials, hashlib.sha256).digest()
+
+    def __contains__(self, credentials):
+        return self.entries.get(self.key(*credentials)) is not None
+
+    def add(self, username, password):
+        self.entries.set(self.key(username, password), True, self.ttl)
@@ -0,0 +1,178 @@
+"""
+Where the time of a request goes: phases (routing, authorization, backend
+calls, rendering) timed into the Timings of the request, sent back in a
+Server-Timing header for the browser's devtools, and an opt-in cProfile of
+single requests written to disk to find the hot spots.
+"""
+
+from contextlib import contextmanager, nullcontext
+import contextvars
+import threading
+import cProfile
+import random
+import hmac
+import time
+import os
+
+from . import metrics
+from . import log
+
+logger = log.get_logger(__name__)
+
+current = contextvars.ContextVar('linkapp_timings', default=None)
+
+
+class Timings:
+    """
+    Seconds spent in each phase of a request and how many times it was
+    entered. Backend calls made concurrently each add their own time, so
+    phases can add up to more than the total.
+    """
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.lock = threading.Lock()
+        self.phases = {}
+
+    def add(self, name, seconds):
+        with self.lock:
+            total, count = self.phases.get(name, (0, 0))
+            self.phases[name] = (total + seconds, count + 1)
+
+    def header(self):
+        """
+        The Server-Timing header value, durations in milliseconds.
+        """
+        with self.lock:
+            phases = sorted(self.phases.items())
+
+        entries = ['{};dur={:.1f};desc="{} ({})"'.format(name, total * 1000, name, count)
+                   for name, (total, count) in phases]
+        entries.append('total;dur={:.1f}'.format((time.monotonic() - self.started) * 1000))
+
+        return ", ".join(entries)
+
+
+def add(name, seconds):
+    """
+    Add seconds to phase name of the current request, if it's being timed.
+    """
+    timings = current.get()
+
+    if timings is not None:
+        timings.add(name, seconds)
+
+
+@contextmanager
+def phase(name):
+    """
+    Time the block into phase name of the current request.
+    """
+    started = time.monotonic()
+
+    try:
+        yield
+    finally:
+        add(name, time.monotonic() - started)
+
+
+@contextmanager
+def recording(timings):
+    """
+    Make timings the current request's for the duration of the block.
+    """
+    token = current.set(timings)
+
+    try:
+        yield timings
+    finally:
+        current.reset(token)
+
+
+class RequestProfiler:
+    """
+    Profiles the handling of a request with cProfile and writes the stats to
+    directory, to be read with pstats or snakeviz. A request is profiled
+    when it has a header matching secret, or for a sample_rate fraction of
+    them. Nothing is profiled without a directory.
+
+    cProfile only sees the thread it's started in, backend calls made by the
+    hydration threads show as waits on their futures. A single request is
+    profiled at a time, others wanting it meanwhile are skipped.
+    """
+
+    def __init__(self, directory=None, secret=None, sample_rate=0.0, header='X-Linkapp-Profile', registry=None):
+        self.directory = directory or None
+        self.secret = secret or None
+        self.sample_rate = sample_rate
+        self.header = header
+        self.busy = threading.Lock()
+        self.count = 0
+
+        if registry is None:
+            registry = metrics.Registry()
+
+        self.profiles = registry.counter('gateway_profiles_total',
+                                         'Requests picked for profiling by outcome',
+                                         ('result',))
+
+    @property
+    def enabled(self):
+        return self.directory is not None
+
+    def wanted(self, req):
+        if not self.enabled:
+            return False
+
+        if self.secret is not None:
+            given = req.headers.get(self.header)
+
+            if given and hmac.compare_digest(given.encode('utf-8'), self.secret.encode('utf-8')):
+                return True
+
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def request(self, req, name):
+        """
+        A context manager profiling the block if req is picked, doing
+        nothing otherwise.
+        """
+        if not self.wanted(req):
+            return nullcontext()
+
+        return self.profile(name)
+
+    @contextmanager
+    def profile(self, name):
+        if not self.busy.acquire(blocking=False):
+            self.profiles.inc(result='busy')
+            yield
+            return
+
+        try:
+            profiler = cProfile.Profile()
+            profiler.enable()
+
+            try:
+                yield
+            finally:
+                profiler.disable()
+                self.write(profiler, name)
+        finally:
+            self.busy.release()
+
+    def write(self, profiler, name):
+        self.count += 1
+
+        filename = "{}-{}-{}-{}.prof".format(time.strftime("%Y%m%dT%H%M%S"), name, os.getpid(), self.count)
+        path = os.path.join(self.directory, filename)
+
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            profiler.dump_stats(path)
+        except OSError as e:
+            logger.warning("Couldn't write profile %s: %s", path, e)
+            self.profiles.inc(result='failed')
+        else:
+            logger.info("Profile of %s written to %s", name, path)
+            self.profiles.inc(result='written')
@@ -1,7 +1,29 @@
 import requests
+import contextvars
 import time
+import asyncio
+import threading
+from http import cookiejar
 from urllib import parse
+from concurrent.futures import ThreadPoolExecutor
 from requests.auth import HTTPBasicAuth
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import EmptyPoolError, NewConnectionError, ConnectTimeoutError
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+from . import retry
+from . import coalesce
+from . import deadline
+from . import timing
+from . import metrics
+from . import log
+
+logger = log.get_logger(__name__)
 
 class TooManyRetries(Exception):
     """
@@ -22,16 +44,239 @@ class Unauthorized(Exception):
     """
     Raised when a call to the service returns a 401 unauthorized status code.
     """
+    
+class CircuitOpen(TooManyRetries):
+    """
+    Raised without calling the service while its circuit breaker is open.
+    """
+    
+class DeadlineExceeded(TooManyRetries):
+    """
+    Raised instead of calling the service when the request it's for has run
+    out of time (see deadline).
+    """
+    
+class NotRetried(TooManyRetries):
+    """
+    Raised when a call that isn't safe to repeat (a POST) failed after it may
+    have reached the service.
+    """
+    
+class ServerError(TooManyRetries):
+    """
+    Raised when the service answers with a 5xx status there's no point
+    retrying (501), or that a call couldn't be retried after.
+    """
+    
+    def __init__(self, message=None, status_code=None):
+        TooManyRetries.__init__(self, message or "Service error {}".format(status_code))
+        self.status_code = status_code
+    
+class Overloaded(Exception):
+    """
+    Raised without calling the service when it already has as many calls in
+    flight, and waiting, as its admission limiter allows.
+    """
+    
+# connection trouble and 5xx statuses are failures of the backend, they
+# count against its breaker and are worth another attempt, but for 501: 
+# the backend is fine, it just doesn't do that
+FINAL_SERVER_STATUSES = frozenset([501])
+RETRY_EXCEPTIONS = (requests.exceptions.RequestException, EmptyPoolError)
+
+# the rest are only retried when they failed before anything was sent, a
+# POST whose response was lost may well have created what it was posting
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'])
+
+def unsent(error):
+    """
+    True if error is a failure to connect, or to get a connection from the
+    pool, so the request never left.
+    """
+    if isinstance(error, (requests.exceptions.ConnectTimeout, EmptyPoolError)):
+        return True
+    
+    if isinstance(error, requests.exceptions.ConnectionError):
+        reason = getattr(error.args[0], 'reason', None) if error.args else None
+        
+        return isinstance(reason, (NewConnectionError, ConnectTimeoutError))
+    
+    if httpx is not None:
+        return isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout))
+    
+    return False
+
+def check_status(status_code, text):
+    """
+    Turn the error statuses the gateway cares about into exceptions.
+    """
+    if status_code == 404:
+        raise NotFound()
+    if status_code == 400:
+        raise BadRequest(text)
+    if status_code == 401:
+        raise Unauthorized(text)
+    if status_code >= 500:
+        raise ServerError(text, status_code)
+
+def failed_status(status_code):
+    """
+    True if a response with status_code is a failure of the backend, to 
+    retry.
+    """
+    return status_code >= 500 and status_code not in FINAL_SERVER_STATUSES
+
+def chunked(items, size):
+    return [items[i:i+size] for i in range(0, len(items), max(1, size))]
+    
+def merge(results):
+    merged = {}
+    
+    for result in results:
+        merged.update(result)
+        
+    return merged
 
 def remove_creds(parsed):
     parts = list(parsed)
     parts[1] = parts[1].split("@")[-1]
     
     return parse.urlunparse(parts)
+    
+class PoolStats:
+    """
+    Thread safe counters of what the connection pool of a ServiceWrapper 
+    did with each request.
+    """
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.opened = 0
+        self.reused = 0
+        self.expired = 0
+        
+    def count(self, name):
+        with self.lock:
+            setattr(self, name, getattr(self, name) + 1)
+            
+    def as_dict(self):
+        with self.lock:
+            return {'opened': self.opened, 
+                    'reused': self.reused, 
+                    'expired': self.expired}
+    
+class KeepAlivePoolMixin:
+    """
+    Keeps at most max_idle connections open between requests and closes
+    the ones that sat idle longer than idle_timeout, before the backend 
+    does it for us.
+    """
+    
+    max_idle = None
+    idle_timeout = None
+    pool_timeout = None
+    stats = None
+    
+    def _idle_count(self):
+        return sum(1 for conn in list(self.pool.queue) if conn is not None and conn.sock is not None)
+    
+    def _get_conn(self, timeout=None):
+        if timeout is None:
+            timeout = self.pool_timeout
+            
+        conn = super()._get_conn(timeout=timeout)
+        
+        idle_since = getattr(conn, 'idle_since', None)
+        
+        if conn.sock is not None and idle_since is not None:
+            if time.monotonic() - idle_since > self.idle_timeout:
+                conn.close()
+                self.stats.count('expired')
+        
+        if conn.sock is None:
+            self.stats.count('opened')
+        else:
+            self.stats.count('reused')
+            
+        return conn
+        
+    def _put_conn(self, conn):
+        if conn is not None and conn.sock is not None:
+            if self._idle_count() >= self.max_idle:
+                conn.close()
+            else:
+                conn.idle_since = time.monotonic()
+                
+        super()._put_conn(conn)
+        
+class KeepAliveHTTPConnectionPool(KeepAlivePoolMixin, HTTPConnectionPool):
+    pass
+    
+class KeepAliveHTTPSConnectionPool(KeepAlivePoolMixin, HTTPSConnectionPool):
+    pass
+    
+class PooledAdapter(HTTPAdapter):
+    """
+    Transport adapter holding at most pool_size connections to a backend, 
+    callers wait up to pool_timeout for one to free up.
+    """
+    
+    def __init__(self, pool_size, max_idle, idle_timeout, pool_timeout, stats):
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self.pool_timeout = pool_timeout
+        self.stats = stats
+        
+        HTTPAdapter.__init__(self, pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+        
+    def _pool_factory(self, pool_class):
+        def make_pool(host, port=None, **kwargs):
+            pool = pool_class(host, port, **kwargs)
+            pool.max_idle = self.max_idle
+            pool.idle_timeout = self.idle_timeout
+            pool.pool_timeout = self.pool_timeout
+            pool.stats = self.stats
+            
+            return pool
+        
+        return make_pool
+        
+    def init_poolmanager(self, *args, **kwargs):
+        HTTPAdapter.init_poolmanager(self, *args, **kwargs)
+        
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': self._pool_factory(KeepAliveHTTPConnectionPool),
+            'https': self._pool_factory(KeepAliveHTTPSConnectionPool)
+        }
 
 class ServiceWrapper:
+    """
+    Client of one backend service.
+    
+    bulk_path is the backend's bulk lookup endpoint, if it has one: 
+    GET <bulk_path>?ids=<id>,<id>... answering a JSON object of the records 
+    found, keyed by id. get_many uses it for up to batch_size ids at a time.
+    If it turns out missing, ids are looked up one by one for bulk_retry 
+    seconds before it's tried again.
+    
+    With coalesce on, concurrent GETs of the same URL share one request 
+    (see coalesce.SingleFlight).
+    
+    At most admission_limit calls are in flight at once, admission_queue 
+    more wait up to admission_wait seconds for their turn, the others fail 
+    with Overloaded right away (see retry.AdmissionLimiter). 0 is no limit.
+    """
     
-    def __init__(self, base_url, timeout=2, retries=10, sleep=0.1):
+    flight_class = coalesce.SingleFlight
+    limiter_class = retry.AdmissionLimiter
+    
+    def __init__(self, base_url, timeout=2, retries=10, sleep=0.1, 
+                       max_sleep=1.0, budget=5.0,
+                       breaker_threshold=5, breaker_reset=10.0,
+                       pool_size=10, pool_max_idle=10, pool_idle_timeout=30.0,
+                       bulk_path=None, batch_size=50, bulk_retry=300.0, coalesce=True,
+                       admission_limit=0, admission_queue=0, admission_wait=1.0,
+                       name=None, registry=None):
         parsed = parse.urlparse(base_url) 
         
         if parsed.username:
@@ -41,42 +286,232 @@ class ServiceWrapper:
             self.credentials = None
         
         self.base_url = base_url
-        self.max_retries = retries
-        self.retries = 1
-        self.sleep = sleep
+        self.name = name or parse.urlparse(base_url).netloc
         self.timeout = timeout
+        self.bulk_path = bulk_path or None
+        self.batch_size = max(1, batch_size)
+        self.bulk_retry = bulk_retry
+        self.bulk_off_until = None
+        self.pool_size = pool_size
+        self.flights = self.flight_class() if coalesce else None
+        self.policy = retry.RetryPolicy(retries=retries, 
+                                        sleep=sleep, 
+                                        max_sleep=max_sleep, 
+                                        budget=budget)
+        self.breaker = retry.CircuitBreaker(threshold=breaker_threshold, 
+                                            reset_timeout=breaker_reset)
+        self.admission = self.limiter_class(limit=admission_limit, 
+                                            queue_size=admission_queue, 
+                                            wait=admission_wait)
+        
+        self.stats = PoolStats()
+        self.session = self._make_session(pool_size, pool_max_idle, pool_idle_timeout)
+        
+        if registry is None:
+            registry = metrics.Registry()
+        
+        self.requests = registry.counter('gateway_backend_requests_total', 
+                                         'Requests made to each backend by method and response status',
+                                         ('backend', 'method', 'status'))
+        self.latency = registry.histogram('gateway_backend_request_duration_seconds',
+                                          'Duration of each request made to a backend',
+                                          ('backend', 'method'))
+        self.retries = registry.counter('gateway_backend_retries_total',
+                                        'Backend requests retried',
+                                        ('backend',))
+        self.errors = registry.counter('gateway_backend_errors_total',
+                                       'Backend calls given up on, by reason',
+                                       ('backend', 'reason'))
+        self.coalesced = registry.counter('gateway_backend_coalesced_total',
+                                          'GETs that shared the response of an identical one in flight',
+                                          ('backend',))
+        self.shed = registry.counter('gateway_backend_shed_total',
+                                     'Backend calls turned away by the admission limiter, by reason',
+                                     ('backend', 'reason'))
+        
+    def _make_session(self, pool_size, pool_max_idle, pool_idle_timeout):
+        adapter = PooledAdapter(pool_size, pool_max_idle, pool_idle_timeout, self.timeout, self.stats)
+        
+        session = requests.Session()
+        # backend cookies have no business being replayed across users
+        session.cookies.set_policy(cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
         
-    def wait(self):
-        return self.sleep*(self.retries**2)
+        return session
         
-    def _call(self, func, *args, **kwargs):
+    def pool_stats(self):
+        """
+        Connections opened vs reused (and closed for idling) since start up.
+        """
+        return self.stats.as_dict()
+        
+    def _call(self, method, url, **kwargs):
+        """
+        Make the request, retrying connection errors and 5xx responses 
+        (but 501) per self.policy, each attempt's timeout capped to what's 
+        left of the budget and of the request's deadline. Each attempt goes 
+        through the admission limiter. Only idempotent requests are retried
+        once they may have been sent, see _check_replay.
+        """
         if self.credentials:
             kwargs['auth']=self.credentials
         
-        print("ARGS:", args)
-        print("KWARGS:", kwargs)
+        timeout = kwargs.pop('timeout', self.timeout)
+        budget_end = time.monotonic() + self.policy.budget
+        attempt = 0
         
-        if self.retries >= self.max_retries:
-            raise TooManyRetries("Maximum retries of {} exceeded".format(self.retries))
+        while True:
+            self._admit(method, url, self.admission.acquire(deadline.cap(self.admission.wait)))
+            
+            try:
+                self._check_deadline(method, url)
+                r = self._attempt(method, url, attempt, self._timeout(timeout, budget_end), **kwargs)
+            finally:
+                self.admission.release()
+            
+            if r is not None:
+                return r
             
+            attempt += 1
+            
+            time.sleep(self._pause(method, url, attempt, budget_end))
+            
+    def _attempt(self, method, url, attempt, timeout, idempotent=None, **kwargs):
+        """
+        One try at the request, the response if it's final, None if it 
+        should be retried.
+        """
+        self._allow(method, url, attempt)
+        
+        kwargs['headers'] = deadline.headers(kwargs.get('headers'))
+        started = time.monotonic()
+        
         try:
-            r = func(*args, **kwargs)
+            r = self.session.request(method, url, timeout=timeout, **kwargs)
+        except RETRY_EXCEPTIONS as e:
+            self._failed(method, url, started, e)
+            self._check_replay(method, url, idempotent, e)
+        except Exception:
+            self._failed(method, url, started)
+            raise
+        except BaseException:
+            # cancelled, which says nothing about the backend
+            self.breaker.release_probe()
+            raise
+        else:
+            if self._completed(method, url, started, r.status_code, r.text, idempotent):
+                return r
+        
+        return None
+            
+    # The steps of _call shared with AsyncServiceWrapper
+    
+    def _check_deadline(self, method, url):
+        left = deadline.remaining()
+        
+        if left is not None and left <= 0:
+            self.errors.inc(backend=self.name, reason='deadline')
+            logger.info("%s %s not attempted, the request is past its deadline", method, url)
+            raise DeadlineExceeded("Request deadline passed before calling {}".format(self.name))
+        
+    def _timeout(self, timeout, budget_end):
+        return deadline.cap(min(timeout, budget_end - time.monotonic()))
+        
+    def _admit(self, method, url, result):
+        if result != self.admission.ADMITTED:
+            # waiting may have run into the request's deadline
+            self._check_deadline(method, url)
             
-            if r.status_code == 404:
-                raise NotFound()
-            if r.status_code == 400:
-                raise BadRequest(r.text)
-            if r.status_code == 401:
-                raise Unauthorized(r.text)
+            self.shed.inc(backend=self.name, reason=result)
+            logger.info("%s %s shed, %s", method, url, result)
+            raise Overloaded("Too many calls to {} ({})".format(self.name, result))
+        
+    def _allow(self, method, url, attempt):
+        if not self.breaker.allow():
+            self.errors.inc(backend=self.name, reason='circuit_open')
+            raise CircuitOpen("Circuit breaker for {} is open".format(self.name))
+        
+        logger.debug("%s %s attempt %d", method, url, attempt + 1)
+        
+    def _failed(self, method, url, started, error=None):
+        self._observe(method, started, 'error')
+        self.breaker.record_failure()
+        
+        if error is not None:
+            logger.info("%s %s failed: %s", method, url, error)
             
-            return r
-        except requests.exceptions.RequestException:
-            time.sleep(self.wait())
-            self.retries += 1
-            return self._call(func, *args, **kwargs)
+    def _completed(self, method, url, started, status_code, text, idempotent=None):
+        """
+        True if the response is final, raising the matching exception for
+        error statuses, False if it should be retried.
+        """
+        self._observe(method, started, status_code)
+        
+        if failed_status(status_code):
+            self.breaker.record_failure()
+            logger.info("%s %s returned %d", method, url, status_code)
+            self._check_replay(method, url, idempotent)
+            
+            return False
+        
+        self.breaker.record_success()
+        check_status(status_code, text)
+        
+        return True
+        
+    def _check_replay(self, method, url, idempotent=None, error=None):
+        """
+        Raise NotRetried if the failed attempt mustn't be repeated: the 
+        method isn't idempotent (unless the caller said the call is) and the
+        request may have been sent.
+        """
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+        
+        if idempotent or (error is not None and unsent(error)):
+            return
+        
+        self.errors.inc(backend=self.name, reason='not_retried')
+        logger.warning("%s %s failed and isn't safe to repeat", method, url)
+        raise NotRetried("{} to {} failed, not retried as it may have been applied".format(method, self.name))
+        
+    def _pause(self, method, url, attempt, budget_end):
+        """
+        Seconds to wait before the next attempt, raises TooManyRetries when 
+        there shouldn't be one.
+        """
+        if attempt >= self.policy.retries:
+            self.errors.inc(backend=self.name, reason='too_many_retries')
+            logger.warning("%s %s gave up after %d attempts", method, url, attempt)
+            raise TooManyRetries("Maximum retries of {} exceeded".format(attempt))
+        
+        pause = self.policy.backoff(attempt)
+        left = deadline.remaining()
+        
+        if left is not None and pause >= left:
+            self.errors.inc(backend=self.name, reason='deadline')
+            logger.warning("%s %s ran out of request deadline after %d attempts", method, url, attempt)
+            raise DeadlineExceeded("Request deadline passed after {} attempts".format(attempt))
+        
+        if time.monotonic() + pause >= budget_end:
+            self.errors.inc(backend=self.name, reason='retry_budget')
+            logger.warning("%s %s ran out of retry budget after %d attempts", method, url, attempt)
+            raise TooManyRetries("Retry budget of {}s exceeded after {} attempts".format(self.policy.budget, attempt))
+        
+        self.retries.inc(backend=self.name)
+        
+        return pause
+            
+    def _observe(self, method, started, status):
+        elapsed = time.monotonic() - started
+        
+        timing.add(self.name, elapsed)
+        self.latency.observe(elapsed, backend=self.name, method=method)
+        self.requests.inc(backend=self.name, method=method, status=status)
         
     def put(self, path, data=None):
-        r = self._call(requests.put,
+        r = self._call("PUT",
                        "{}{}".format(self.base_url, path),
                        json=data,
                        headers={"content-type": "application/json"},
@@ -84,23 +519,305 @@ class ServiceWrapper:
         
         return r.json()
         
-    def post(self, path, data=None):
-        r = self._call(requests.post,
+    def post(self, path, data=None, idempotent=False):
+        """
+        POST data as JSON. A POST is only retried if it never reached the
+        service, unless idempotent says repeating it is harmless.
+        """
+        r = self._call("POST",
                        "{}{}".format(self.base_url, path),
                        json=data,
                        headers={"content-type": "application/json"},
-                       timeout=self.timeout)
+                       timeout=self.timeout,
+                       idempotent=idempotent)
             
         return r.json()
         
     def get(self, path="/"):
-        r = self._call(requests.get,
-                       "{}{}".format(self.base_url, path),
-                       headers={"content-type": "application/json"},
-                       timeout=self.timeout)
+        r = self._get("{}{}".format(self.base_url, path))
+        
+        return r.json()
+        
+    def _get(self, url):
+        """
+        GET url, sharing the response with the identical GETs in flight. 
+        Callers each parse their own copy of the body.
+        """
+        if self.flights is None:
+            return self._call("GET", url, headers={"content-type": "application/json"}, timeout=self.timeout)
+        
+        r, shared = self.flights.do(url, self._call, "GET", url, 
+                                    headers={"content-type": "application/json"}, 
+                                    timeout=self.timeout,
+                                    rejoin=self._rejoin)
+        
+        if shared:
+            self.coalesced.inc(backend=self.name)
+            
+        return r
+        
+    def _rejoin(self, error):
+        """
+        Whether a GET that shared a call gone past its caller's deadline 
+        should make its own: the shared call ran under the first caller's 
+        deadline, this one's may be later.
+        """
+        if not isinstance(error, DeadlineExceeded):
+            return False
+        
+        left = deadline.remaining()
+        
+        return left is None or left > 0
+        
+    def get_many_calls(self, ids, path="/{}"):
+        """
+        The (func, args) calls looking up ids, each returning a dict of the 
+        records it found keyed by id: one per batch_size ids if the backend 
+        has a bulk endpoint, a GET of path.format(id) per id otherwise.
+        """
+        ids = list(ids)
+        
+        if self.bulk_enabled() and len(ids) > 1:
+            return [(self.get_batch, (chunk, path)) for chunk in chunked(ids, self.batch_size)]
+        
+        return [(self.get_one, (item_id, path)) for item_id in ids]
+        
+    def bulk_enabled(self):
+        """
+        True if lookups should go to the bulk endpoint: there is one and it
+        wasn't found missing in the last bulk_retry seconds.
+        """
+        if self.bulk_path is None:
+            return False
+        
+        return self.bulk_off_until is None or time.monotonic() >= self.bulk_off_until
+        
+    def get_many(self, ids, path="/{}", mapper=None):
+        """
+        The records of ids that exist, keyed by id.
+        
+        mapper runs a list of (func, args) calls and returns their results in 
+        order, eg. Hydrator.map to make them concurrently. By default they're 
+        made one after the other.
+        """
+        calls = self.get_many_calls(ids, path)
+        
+        if mapper is None:
+            results = [func(*args) for func, args in calls]
+        else:
+            results = mapper(calls)
+            
+        return merge(results)
+        
+    def get_one(self, item_id, path="/{}"):
+        try:
+            return {item_id: self.get(path.format(item_id))}
+        except NotFound:
+            return {}
+        
+    def get_batch(self, ids, path="/{}"):
+        """
+        Look ids up with a single request to the bulk endpoint, falling back
+        to concurrent GETs of each id if the backend doesn't have one after 
+        all.
+        """
+        if self.bulk_enabled():
+            try:
+                r = self._get(self._batch_url(ids))
+            except NotFound:
+                r = None
+            except ServerError as e:
+                if e.status_code not in FINAL_SERVER_STATUSES:
+                    raise
+                
+                r = None
+            
+            found = self._batch_result(ids, r)
+            
+            if found is not None:
+                return found
+        
+        # on a pool of its own, this is usually running on the hydration 
+        # pool already, bounded by the connections there are to the backend
+        with ThreadPoolExecutor(max_workers=max(1, min(len(ids), self.pool_size))) as executor:
+            futures = [executor.submit(contextvars.copy_context().run, self.get_one, item_id, path) for item_id in ids]
+            
+            return merge(future.result() for future in futures)
+        
+    def _batch_url(self, ids):
+        return "{}{}?{}".format(self.base_url, self.bulk_path, parse.urlencode({'ids': ",".join(ids)}))
+        
+    def _batch_result(self, ids, r):
+        """
+        The records of ids found in a bulk response, None if the endpoint 
+        turned out not to exist.
+        """
+        if r is None or r.status_code == 405:
+            if self.bulk_enabled():
+                logger.warning("%s has no bulk endpoint at %s, looking ids up one by one for %ss", 
+                               self.name, self.bulk_path, self.bulk_retry)
+                
+            self.bulk_off_until = time.monotonic() + self.bulk_retry
+            
+            return None
+        
+        records = r.json()
         
-        print(r.text)
+        if not isinstance(records, dict):
+            # whatever answered wasn't a bulk endpoint
+            return self._batch_result(ids, None)
+        
+        if self.bulk_off_until is not None:
+            logger.info("%s bulk endpoint at %s is back", self.name, self.bulk_path)
+            self.bulk_off_until = None
+        
+        return {item_id: records[item_id] for item_id in ids if item_id in records}
+        
+class AsyncServiceWrapper(ServiceWrapper):
+    """
+    ServiceWrapper for asyncio, same retries, circuit breaker, error mapping
+    and metrics, backed by an httpx.AsyncClient (the asgi extra).
+    """
+    
+    flight_class = coalesce.AsyncSingleFlight
+    limiter_class = retry.AsyncAdmissionLimiter
+    
+    def _make_session(self, pool_size, pool_max_idle, pool_idle_timeout):
+        if httpx is None:
+            raise ImportError("AsyncServiceWrapper needs httpx, install linkapp.gateway[asgi]")
+        
+        limits = httpx.Limits(max_connections=pool_size, 
+                              max_keepalive_connections=pool_max_idle, 
+                              keepalive_expiry=pool_idle_timeout)
+        
+        if self.credentials:
+            auth = httpx.BasicAuth(self.credentials.username, self.credentials.password)
+        else:
+            auth = None
+        
+        return httpx.AsyncClient(limits=limits, auth=auth)
+        
+    def pool_stats(self):
+        # httpx doesn't count its connections
+        return {}
+        
+    async def close(self):
+        await self.session.aclose()
+        
+    async def _call(self, method, url, **kwargs):
+        timeout = kwargs.pop('timeout', self.timeout)
+        budget_end = time.monotonic() + self.policy.budget
+        attempt = 0
+        
+        while True:
+            self._admit(method, url, await self.admission.acquire(deadline.cap(self.admission.wait)))
+            
+            try:
+                self._check_deadline(method, url)
+                r = await self._attempt(method, url, attempt, self._timeout(timeout, budget_end), **kwargs)
+            finally:
+                self.admission.release()
+            
+            if r is not None:
+                return r
+            
+            attempt += 1
+            
+            await asyncio.sleep(self._pause(method, url, attempt, budget_end))
+            
+    async def _attempt(self, method, url, attempt, timeout, idempotent=None, **kwargs):
+        self._allow(method, url, attempt)
+        
+        kwargs['headers'] = deadline.headers(kwargs.get('headers'))
+        started = time.monotonic()
+        
+        try:
+            r = await self.session.request(method, url, timeout=timeout, **kwargs)
+        except httpx.TransportError as e:
+            self._failed(method, url, started, e)
+            self._check_replay(method, url, idempotent, e)
+        except Exception:
+            self._failed(method, url, started)
+            raise
+        except BaseException:
+            # cancelled, which says nothing about the backend
+            self.breaker.release_probe()
+            raise
+        else:
+            if self._completed(method, url, started, r.status_code, r.text, idempotent):
+                return r
+        
+        return None
+            
+    async def put(self, path, data=None):
+        r = await self._call("PUT",
+                             "{}{}".format(self.base_url, path),
+                             json=data,
+                             headers={"content-type": "application/json"},
+                             timeout=self.timeout)
         
         return r.json()
-
-        
\ No newline at end of file
+        
+    async def post(self, path, data=None, idempotent=False):
+        r = await self._call("POST",
+                             "{}{}".format(self.base_url, path),
+                             json=data,
+                             headers={"content-type": "application/json"},
+                             timeout=self.timeout,
+                             idempotent=idempotent)
+            
+        return r.json()
+        
+    async def get(self, path="/"):
+        r = await self._get("{}{}".format(self.base_url, path))
+        
+        return r.json()
+        
+    async def _get(self, url):
+        if self.flights is None:
+            return await self._call("GET", url, headers={"content-type": "application/json"}, timeout=self.timeout)
+        
+        r, shared = await self.flights.do(url, self._call, "GET", url, 
+                                          headers={"content-type": "application/json"}, 
+                                          timeout=self.timeout,
+                                          rejoin=self._rejoin)
+        
+        if shared:
+            self.coalesced.inc(backend=self.name)
+            
+        return r
+        
+    async def get_many(self, ids, path="/{}", mapper=None):
+        calls = self.get_many_calls(ids, path)
+        
+        if mapper is None:
+            results = await asyncio.gather(*[func(*args) for func, args in calls])
+        else:
+            results = await mapper(calls)
+            
+        return merge(results)
+        
+    async def get_one(self, item_id, path="/{}"):
+        try:
+            return {item_id: await self.get(path.format(item_id))}
+        except NotFound:
+            return {}
+        
+    async def get_batch(self, ids, path="/{}"):
+        if self.bulk_enabled():
+            try:
+                r = await self._get(self._batch_url(ids))
+            except NotFound:
+                r = None
+            except ServerError as e:
+                if e.status_code not in FINAL_SERVER_STATUSES:
+                    raise
+                
+                r = None
+            
+            found = self._batch_result(ids, r)
+            
+            if found is not None:
+                return found
+            
+        return merge(await asyncio.gather(*[self.get_one(item_id, path) for item_id in ids]))
\ No newline at end of file
@@ -10,22 +10,57 @@
 /reading-list                   GET              Get the reading list of the current user
 /reading-list/add/[link_id]     GET              Add [link_id] to the current user's reading list
 /reading-list/read/[link_id]    GET              Mark [link_id] as read for the current user's reading list
+/import                         POST             Import links from JSON Lines or CSV, reporting progress as JSON Lines
+/metrics                        GET              Request and backend metrics in the Prometheus text format
 """
 
 from webob import Response, Request
-import pystache
 from urllib import parse
-import re
+import io
 import os
+import codecs
+import time
+import json
 import base64
+import hashlib
 
 from pkg_resources import resource_filename
-import mimetypes
 
 from . import wrapper
 from . import schema
-from jsonschema import Draft3Validator
+from . import hydrate
+from . import cache
+from . import rendering
+from . import router
+from . import assets
+from . import session
+from . import deadline
+from . import timing
+from . import queue
+from . import prefetch
+from . import importer
+from . import metrics
+from . import log
+import redis
+import pika
 
+SESSION_COOKIE = 'linkapp.session'
+
+# where the entries go in a streamed listing page, see _stream_listing
+ENTRIES_MARKER = '<!-- linkapp:entries -->'
+
+STREAM_TROUBLE = ('<div class="stale">We\'re having trouble reaching the back-end, '
+                  'some links are missing. Please try again later.</div>\n')
+
+logger = log.get_logger(__name__)
+
+def streamed(headers):
+    """
+    True for the responses sent while they're made (streamed listings, 
+    imports), they ask proxies not to buffer them. Their Server-Timing would
+    be worked out before most of the work is done, so they go without.
+    """
+    return any(name.lower() == 'x-accel-buffering' and value == 'no' for name, value in headers)
 
 class BadRequest(Exception):
     """
@@ -72,6 +107,21 @@ class BackEndTrouble(BadRequest):
 class TooManyRetries(BackEndTrouble):
     pass
         
+class Overloaded(BadRequest):
+    """
+    Raised when a backend has all the calls it's allowed, so the client is 
+    told to come back in retry_after seconds instead of waiting.
+    """
+    def __init__(self, msg="The service is busy. Please try your request again shortly", code=503, retry_after=1):
+        BadRequest.__init__(self, msg, code)
+        self.retry_after = retry_after
+        
+    def __call__(self, environ, start_response):
+        res = Response(self.msg, status=self.code)
+        res.headers['retry-after'] = str(self.retry_after)
+        
+        return res(environ, start_response)
+        
 class Unauthorized(BadRequest):
     """
     Raised when a bad content type is specified by the client.
@@ -89,82 +139,317 @@ class Unauthorized(BadRequest):
 
 class GatewayService:
     
-    def __init__(self, config):
+    # AsyncGatewayService swaps this (and make_hydrator) for asyncio flavours
+    wrapper_class = wrapper.ServiceWrapper
+    
+    def __init__(self, config, redis_client=None, write_transport=None):
         self.config = config
-        self.link_service = wrapper.ServiceWrapper(config.link_service_url)
-        self.tag_service = wrapper.ServiceWrapper(config.tag_service_url)
-        self.authentication_service = wrapper.ServiceWrapper(config.authorization_service_url)
-        self.readinglist_service = wrapper.ServiceWrapper(config.readinglist_service_url)
-        
-        self.renderer = pystache.Renderer(search_dirs=resource_filename("linkapp.gateway", "templates"), file_extension='html')
-        
-        self.static_path = resource_filename("linkapp.gateway", "static")
-        
-        self.path_map = {
-            re.compile("^/(page/(?P<page>\d+))?$"): self.listing,
-            re.compile("^/tag/(?P<tag>[^/]+)(/page/(?P<page>\d+))?$"): self.listing_by_tag,
-            re.compile("^/static/(?P<path>.*)$"): self.static,
-            re.compile("^/new$"): self.new,
-            re.compile("^/reading-list$"): self.reading_list,
-            re.compile("^/reading-list/add/?(?P<link_id>[^/]{32})?$$"): self.reading_list_add,
-            re.compile("^/reading-list/read/?(?P<link_id>[^/]{32})?$$"): self.reading_list_read,
-            re.compile("^/edit/?(?P<link_id>[^/]{32})?$"): self.edit,
-            re.compile("^/save/?(?P<link_id>[^/]{32})?$"): self.save,
-            re.compile("^/view/?(?P<link_id>[^/]{32})?$"): self.view,
+        
+        log.configure(config.log_level, config.log_sample_rate)
+        
+        self.registry = metrics.Registry()
+        self.route_requests = self.registry.counter('gateway_requests_total', 
+                                                    'Requests handled by route and response status',
+                                                    ('route', 'status'))
+        self.route_latency = self.registry.histogram('gateway_request_duration_seconds',
+                                                     'Time to handle a request, up to the response headers',
+                                                     ('route',))
+        
+        self.link_service = self.wrapper_class(config.link_service_url, registry=self.registry, **config.service_options('link'))
+        self.tag_service = self.wrapper_class(config.tag_service_url, registry=self.registry, **config.service_options('tag'))
+        self.authentication_service = self.wrapper_class(config.authorization_service_url, registry=self.registry, **config.service_options('authorization'))
+        self.readinglist_service = self.wrapper_class(config.readinglist_service_url, registry=self.registry, **config.service_options('readinglist'))
+        
+        self.backends = {
+            'link': self.link_service,
+            'tag': self.tag_service,
+            'authorization': self.authentication_service,
+            'readinglist': self.readinglist_service
         }
         
-    def authorize(self, req):
-        if req.authorization:
-            auth_type, hashed_pass = req.authorization
-            
-            decoded = base64.b64decode(hashed_pass)
-            
-            username, password = decoded.decode('utf-8').split(':')
+        self.registry.add_collector(self.collect_backends)
+        
+        self.hydrator = self.make_hydrator()
+        
+        if redis_client is None:
+            redis_client = redis.Redis.from_url(config.redis_url, 
+                                                socket_timeout=0.25, 
+                                                socket_connect_timeout=0.25)
+        
+        self.link_cache = cache.LinkCache(redis_client,
+                                          ttl=config.link_cache_ttl,
+                                          local_size=config.link_cache_local_size,
+                                          local_ttl=config.link_cache_local_ttl,
+                                          tombstone_ttl=config.link_cache_tombstone_ttl)
+        
+        self.missing_links = cache.MissingLinks(ttl=config.missing_link_ttl,
+                                                size=config.missing_link_cache_size,
+                                                registry=self.registry)
+        self.skipped_links = self.registry.counter('gateway_links_skipped_total',
+                                                   'Links left out of a page, missing (dead references) or failed (lookup errors)',
+                                                   ('reason',))
+        
+        self.page_cache = self.make_page_cache()
+        
+        if config.prefetch and self.page_cache.enabled:
+            self.prefetcher = self.make_prefetcher()
+        else:
+            self.prefetcher = None
+        
+        self.renderer = rendering.TemplateCache(resource_filename("linkapp.gateway", "templates"), 
+                                                file_extension='html',
+                                                reload=config.template_reload)
+        
+        self.fragments = rendering.FragmentCache(self.renderer, 
+                                                 size=config.fragment_cache_size,
+                                                 registry=self.registry)
+        
+        self.assets = assets.StaticAssets(resource_filename("linkapp.gateway", "static"),
+                                          max_age=config.static_max_age,
+                                          memory_limit=config.static_memory_limit)
+        
+        if write_transport is None and config.queued_writes:
+            write_transport = queue.PikaTransport(config.rabbit_url, 
+                                                  retries=config.rabbit_retries, 
+                                                  retry_sleep=config.rabbit_retry_sleep)
+        
+        if write_transport is None:
+            self.writes = None
+        else:
+            self.writes = queue.WritePipeline(write_transport)
+        
+        self.importer = self.make_importer()
+        
+        self.sessions = session.SessionSigner(config.session_secret, ttl=config.session_ttl)
+        self.credential_cache = session.CredentialCache(ttl=config.credential_cache_ttl)
+        
+        self.profiler = timing.RequestProfiler(config.profile_dir,
+                                               secret=config.profile_secret,
+                                               sample_rate=config.profile_sample_rate,
+                                               registry=self.registry)
+        
+        self.router = router.Router()
+        self.router.add(("", "page"), r"^/(page/(?P<page>\d+))?$", self.listing)
+        self.router.add("tag", r"^/tag/(?P<tag>[^/]+)(/page/(?P<page>\d+))?$", self.listing_by_tag)
+        self.router.add("static", r"^/static/(?P<path>.*)$", self.static)
+        self.router.add("new", r"^/new$", self.new)
+        self.router.add("reading-list", r"^/reading-list$", self.reading_list)
+        self.router.add("reading-list", r"^/reading-list/add/?(?P<link_id>[^/]{32})?$", self.reading_list_add)
+        self.router.add("reading-list", r"^/reading-list/read/?(?P<link_id>[^/]{32})?$", self.reading_list_read)
+        self.router.add("edit", r"^/edit/?(?P<link_id>[^/]{32})?$", self.edit)
+        self.router.add("save", r"^/save/?(?P<link_id>[^/]{32})?$", self.save, methods=("POST",))
+        self.router.add("view", r"^/view/?(?P<link_id>[^/]{32})?$", self.view)
+        self.router.add("import", r"^/import$", self.import_links, methods=("POST",))
+        self.router.add("metrics", r"^/metrics$", self.metrics)
+        
+    def make_hydrator(self):
+        return hydrate.Hydrator(self.link_service, 
+                                self.tag_service, 
+                                workers=self.config.hydration_workers,
+                                concurrency=self.config.hydration_concurrency)
+        
+    def make_page_cache(self):
+        return cache.PageCache(soft_ttl=self.config.page_cache_soft_ttl,
+                               hard_ttl=self.config.page_cache_hard_ttl,
+                               size=self.config.page_cache_size,
+                               errors=(wrapper.TooManyRetries, wrapper.BadRequest, wrapper.Overloaded),
+                               registry=self.registry)
+        
+    def make_prefetcher(self):
+        return prefetch.Prefetcher(self.page_cache,
+                                   rate=self.config.prefetch_rate,
+                                   queue_size=self.config.prefetch_queue_size,
+                                   registry=self.registry)
+        
+    def make_importer(self):
+        return importer.LinkImporter(self.link_service,
+                                     self.tag_service,
+                                     workers=self.config.import_workers,
+                                     concurrency=self.config.import_concurrency,
+                                     batch_size=self.config.import_batch_size,
+                                     registry=self.registry)
+        
+    def breaker_states(self):
+        """
+        State of the circuit breaker in front of each backend.
+        """
+        return {name: backend.breaker.snapshot() for name, backend in self.backends.items()}
+        
+    def session_user(self, req):
+        """
+        The user named by a valid session token, None if there isn't one.
+        """
+        username, expires = self.sessions.verify(req.cookies.get(SESSION_COOKIE))
+        
+        return username
+        
+    def basic_credentials(self, req):
+        if req.authorization is None:
+            return None
+        
+        auth_type, hashed_pass = req.authorization
+        
+        try:
+            decoded = base64.b64decode(hashed_pass).decode('utf-8')
+            username, password = decoded.split(':', 1)
+        except (TypeError, ValueError):
+            raise Unauthorized()
             
-            print(decoded)
+        return username, password
+        
+    def authorize(self, req):
+        """
+        Make sure the request comes from a known user and put their name in
+        req.remote_user.
+        
+        A valid session token is trusted as is, otherwise the basic auth 
+        credentials are checked, against the authorization service unless 
+        they were verified moments ago, and a new token is handed out.
+        """
+        with timing.phase('auth'):
+            username, expires, credentials = self._session_or_credentials(req)
             
-            try:
-                if not self.authentication_service.post("/{}".format(username), password):
-                    raise Unauthorized()
-                else:
-                    res = Response()
-                    res.set_cookie('linkapp.username', username, path='/')
+            if username is None:
+                if credentials not in self.credential_cache:
+                    try:
+                        if not self.authentication_service.post("/{}".format(credentials[0]), credentials[1], idempotent=True):
+                            raise Unauthorized()
+                    except wrapper.Unauthorized:
+                        raise Unauthorized()
+                    except wrapper.TooManyRetries:
+                        raise TooManyRetries()
                     
-                    return res
-            except wrapper.Unauthorized:
-                raise Unauthorized()
-        else:
+                    self.credential_cache.add(*credentials)
+                    
+                username = credentials[0]
+                
+            return self._authorized(req, username, expires)
+        
+    def _session_or_credentials(self, req):
+        """
+        (username, expires, credentials), username is None unless there's a
+        session token for the user the credentials, if any, are for.
+        """
+        username, expires = self.sessions.verify(req.cookies.get(SESSION_COOKIE))
+        credentials = self.basic_credentials(req)
+        
+        if credentials is not None and credentials[0] != username:
+            username = None
+        
+        if username is None and credentials is None:
             raise Unauthorized()
+            
+        return username, expires, credentials
+        
+    def _authorized(self, req, username, expires):
+        req.remote_user = username
+        
+        res = Response()
+        
+        # hand out a fresh token once the current one is half spent
+        if expires - time.time() < self.sessions.ttl / 2:
+            res.set_cookie(SESSION_COOKIE, 
+                           self.sessions.issue(username), 
+                           path='/', 
+                           max_age=self.sessions.ttl,
+                           httponly=True,
+                           samesite='Lax')
+        
+        return res
         
     def __call__(self, environ, start_response):
-        req = Request(environ)
+        started = time.monotonic()
         
         req = Request(environ, charset="utf8")
         
         new_path = parse.unquote(req.path)
         
-        res = None
+        route_name = 'not_found'
+        timings = timing.Timings()
         
-        try:
-            for regexp, method in self.path_map.items():
-                match = re.match(regexp, new_path)
-                if match:
-                    print(match.groupdict())
-                    res = method(req, **match.groupdict())
-                    break
+        def observe(status):
+            self.route_requests.inc(route=route_name, status=status)
+            self.route_latency.observe(time.monotonic() - started, route=route_name)
+        
+        def record_status(status, headers, exc_info=None):
+            observe(status.split(" ", 1)[0])
             
-            if res is None:
-                raise NotFound()
+            if self.config.server_timing and not streamed(headers):
+                headers = headers + [('Server-Timing', timings.header())]
+            
+            if exc_info:
+                return start_response(status, headers, exc_info)
+            
+            return start_response(status, headers)
+        
+        try:
+            with timing.recording(timings):
+                with timing.phase('route'):
+                    route, kwargs = self.router.match(new_path)
+                
+                if route is None:
+                    raise NotFound()
+                
+                route_name = route.name
+                
+                if req.method not in route.methods:
+                    raise BadRequest("Bad Request, Method not supported")
+                
+                with deadline.within(self.config.route_deadline(route_name)), self.profiler.request(req, route_name):
+                    res = route.handler(req, **kwargs)
             
         except BadRequest as e:
-            return e(environ, start_response)
+            return e(environ, record_status)
+        except wrapper.Overloaded:
+            return Overloaded(retry_after=self.config.overload_retry_after)(environ, record_status)
+        except Exception:
+            observe('500')
+            logger.exception("%s %s failed", req.method, req.path)
+            raise
+        
+        return res(environ, record_status)
+    
+    def metrics(self, req):
+        res = Response(content_type='text/plain', charset='utf-8')
+        res.headers['content-type'] = 'text/plain; version=0.0.4; charset=utf-8'
+        res.text = self.registry.render()
         
-        return res(environ, start_response)
+        return res
+    
+    def collect_backends(self):
+        """
+        Connection pool and circuit breaker numbers of each backend, for 
+        /metrics.
+        """
+        breaker_states = {'closed': 0, 'half_open': 1, 'open': 2}
+        
+        connections = []
+        states = []
+        trips = []
+        in_flight = []
+        waiting = []
+        
+        for name, backend in self.backends.items():
+            for event, count in backend.pool_stats().items():
+                connections.append(({'backend': name, 'event': event}, count))
+            
+            breaker = backend.breaker.snapshot()
+            states.append(({'backend': name}, breaker_states[breaker['state']]))
+            trips.append(({'backend': name}, breaker['trips']))
+            
+            admission = backend.admission.snapshot()
+            in_flight.append(({'backend': name}, admission['in_flight']))
+            waiting.append(({'backend': name}, admission['waiting']))
+        
+        return [
+            ('gateway_backend_connections_total', 'counter', 'Backend connections opened, reused and expired for idling', connections),
+            ('gateway_backend_breaker_state', 'gauge', 'Circuit breaker state, 0 closed, 1 half open, 2 open', states),
+            ('gateway_backend_breaker_trips_total', 'counter', 'Times the circuit breaker opened', trips),
+            ('gateway_backend_in_flight', 'gauge', 'Backend calls admitted and not done yet', in_flight),
+            ('gateway_backend_waiting', 'gauge', 'Backend calls waiting to be admitted', waiting),
+        ]
      
     def view(self, req, link_id):
-        if req.method != "GET":
-            raise BadRequest("Bad Request, Method not supported")
-        
         try:
             link = self._getlink(link_id)
         except wrapper.TooManyRetries:
@@ -174,6 +459,14 @@ class GatewayService:
         except wrapper.BadRequest:
             raise BackEndTrouble()
         
+        return self._view_page(req, link, link_id)
+        
+    def _view_page(self, req, link, link_id):
+        etag = self.page_etag('view', [link])
+        
+        if self.not_modified(req, etag):
+            return self.cacheable(Response(status=304), etag, vary=False)
+        
         context = {
             'one_post': link,
             'prefix': self.config.path_prefix,
@@ -183,14 +476,52 @@ class GatewayService:
         res = Response()
         res.text = self.renderer.render_name('one_post', context)
         
+        return self.cacheable(res, etag, vary=False)
+        
+    def page_etag(self, kind, *parts):
+        """
+        Weak ETag of a page made from parts, the data that went into it with
+        links standing for their versions, and the templates' version. 
+        Computed before rendering, so a client with a fresh copy is answered 
+        without rendering it.
+        """
+        parts = [[link.get('version') or hydrate.version(link) for link in part] 
+                 if isinstance(part, list) else part 
+                 for part in parts]
+        
+        content = json.dumps([kind, self.renderer.version()] + parts, sort_keys=True)
+        
+        return 'W/"{}"'.format(hashlib.sha1(content.encode('utf-8')).hexdigest()[:20])
+        
+    def not_modified(self, req, etag):
+        return etag[2:].strip('"') in req.if_none_match
+        
+    def cacheable(self, res, etag, user=None, vary=True):
+        """
+        Add the validator and caching headers of a page, logged in users 
+        get config.user_cache_control, everyone else 
+        config.anonymous_cache_control.
+        """
+        if etag is not None:
+            res.headers['etag'] = etag
+        
+        if user is None:
+            res.headers['cache-control'] = self.config.anonymous_cache_control
+        else:
+            res.headers['cache-control'] = self.config.user_cache_control
+        
+        if vary:
+            # pages look different once logged in, and the session is a cookie
+            res.vary = tuple(res.vary or ()) + ('Cookie',)
+            
         return res
      
     def new(self, req):
         res = self.authorize(req)
         
-        if req.method != "GET":
-            raise BadRequest("Bad Request, Method not supported")
+        return self._new_page(res)
         
+    def _new_page(self, res):
         context = {
            'prefix': self.config.path_prefix, 
            'link':True
@@ -203,9 +534,6 @@ class GatewayService:
     def edit(self, req, link_id):
         res = self.authorize(req)
         
-        if req.method != "GET":
-            raise BadRequest("Bad Request, Method not supported")
-        
         try:
             link = self._getlink(link_id)
         except wrapper.TooManyRetries:
@@ -215,6 +543,9 @@ class GatewayService:
         except wrapper.BadRequest:
             raise BackEndTrouble()
         
+        return self._edit_page(res, link, link_id)
+        
+    def _edit_page(self, res, link, link_id):
         link['tags'] = "|".join([t['name'] for t in link['tags']])
         
         context = {
@@ -230,14 +561,95 @@ class GatewayService:
     def save(self, req, link_id=None):
         res = self.authorize(req)
         
-        if req.method != "POST":
-            raise BadRequest("Bad Request, Method not supported")
+        data, process_tags, errors = self._read_form(req)
+            
+        if not errors:
+            try:
+                try:
+                    if self.writes is not None:
+                        self.writes.submit(data, process_tags, link_id)
+                    elif link_id:
+                        self.link_service.put("/{}".format(link_id), data)
+                        self.tag_service.put("/link/{}".format(link_id), {'tags':process_tags})
+                    else:
+                        link_id = self.link_service.post("/", data)
+                        self.tag_service.post("/link/{}".format(link_id), {'tags':process_tags})
+                finally:
+                    # the link may have been written even if its tags weren't
+                    if link_id:
+                        self._forget_link(link_id)
+                
+            except wrapper.BadRequest as e:
+                errors.append({"message":str(e)})
+            except (wrapper.TooManyRetries, wrapper.Overloaded, pika.exceptions.AMQPError) as e:
+                errors.append({"message":"Trouble with the back-end. Please try again later"})
+                
+        return self._saved_page(res, errors, data, link_id)
+        
+    def _forget_link(self, link_id):
+        """
+        Drop what's cached of link_id after a write to it.
+        """
+        self.link_cache.invalidate(link_id)
+        self.missing_links.discard(link_id)
+        self.fragments.invalidate(link_id)
+        self.page_cache.clear()
+        
+    def import_links(self, req):
+        """
+        Import the links uploaded as JSON Lines or CSV (see importer), the 
+        upload is read and the report sent while the links are written.
+        """
+        res = self.authorize(req)
+        format, encoding = self._import_format(req)
         
+        res.content_type = 'application/x-ndjson'
+        res.charset = None
+        res.app_iter = self._import_stream(req.body_file, format, encoding, req.remote_user)
+        res.headers['x-accel-buffering'] = 'no'
+        
+        return res
+        
+    def _import_format(self, req):
+        """
+        The format and the encoding of an upload, UTF-8 unless its content
+        type says otherwise, with or without a BOM (as Excel writes CSV).
+        """
+        format = importer.FORMATS.get(req.content_type)
+        
+        if format is None:
+            raise BadRequest("Unsupported Media Type, import JSON Lines or CSV", 415)
+        
+        try:
+            encoding = codecs.lookup(req.charset).name
+        except LookupError:
+            raise BadRequest("Unsupported Media Type, unknown charset", 415)
+        
+        if encoding == 'utf-8':
+            encoding = 'utf-8-sig'
+        
+        return format, encoding
+        
+    def _import_stream(self, body, format, encoding, author):
+        stream = io.TextIOWrapper(io.BufferedReader(body), encoding=encoding, errors='replace', newline='')
+        
+        try:
+            for line in self.importer.run(stream, format, author):
+                yield (json.dumps(line) + "\n").encode('utf-8')
+        finally:
+            self.page_cache.clear()
+        
+    def _read_form(self, req):
+        """
+        The link posted by the edit or new form, its tags and what's wrong 
+        with it.
+        """
         data = req.POST.mixed()
         
-        data['author'] = req.cookies['linkapp.username']
+        data['author'] = req.remote_user
         
         errors = []
+        process_tags = None
         
         page_title = data.get('page_title', None)
         if page_title is None or page_title == '':
@@ -258,21 +670,9 @@ class GatewayService:
         else:
             process_tags = list(set([x.strip() for x in tags.split('|')]))
             
-        if not errors:
-            try:
-                if link_id:
-                    self.link_service.put("/{}".format(link_id), data)
-                    self.tag_service.put("/link/{}".format(link_id), {'tags':process_tags})
-                else:
-                    link_id = self.link_service.post("/", data)
-                    self.tag_service.post("/link/{}".format(link_id), {'tags':process_tags})
-                
-            except wrapper.BadRequest as e:
-                errors.append({"message":str(e)})
-            except wrapper.TooManyRetries as e:
-                errors.append({"message":"Trouble with the back-end. Please try again later"})
-                
-                
+        return data, process_tags, errors
+        
+    def _saved_page(self, res, errors, data, link_id):
         if errors:
             context = {
                 'errors': errors,
@@ -288,47 +688,232 @@ class GatewayService:
             raise Redirect(path=self.config.path_prefix)
     
     def _getlink(self, link_id, process_tags=True):
-        link = self.link_service.get("/{}".format(link_id))
-                
-        tags = self.tag_service.get("/link/{}".format(link_id))
-                
-        link['tags'] = [{"name": x} for x in tags]
-        link['key'] = link_id
+        link_id, link, error = self._lookup_links([link_id])[0]
+        
+        if error is not None:
+            raise error
         
         return link
     
-    def listing(self, req, page=None):
-        if req.method != "GET":
-            raise BadRequest("Bad Request, Method not supported")
+    def _getlinks(self, link_ids):
+        """
+        The links of link_ids, in order, leaving out the ones that don't 
+        exist (anymore) or couldn't be fetched, and the first error of the 
+        latter, see _present.
+        """
+        return self._present(self._lookup_links(link_ids))
+        
+    def _lookup_links(self, link_ids):
+        """
+        A (link_id, link, error) for each of link_ids, as in 
+        hydrate.assemble_partial: from the link cache, the ids known to be 
+        dead or hydrated.
+        """
+        dead = self.missing_links.known(link_ids)
+        cached = self.link_cache.get_many([link_id for link_id in link_ids if link_id not in dead])
+        missing = [link_id for link_id in link_ids if link_id not in cached and link_id not in dead]
+        hydrated = {}
+        
+        if missing:
+            hydrated = {entry[0]: entry for entry in self.hydrator.hydrate_partial(missing)}
+            
+            self.link_cache.set_many(self._hydrated(hydrated.values()))
         
-        if not page:
-            page = 1
-        else:
-            page = int(page)
+        entries = []
         
-        links = []
+        for link_id in link_ids:
+            if link_id in dead:
+                entries.append((link_id, None, wrapper.NotFound()))
+            elif link_id in cached:
+                entries.append((link_id, cached[link_id], None))
+            else:
+                entries.append(hydrated[link_id])
+                
+        return entries
         
-        try:
-            data = self.link_service.get("/?page={}".format(page))
+    def _hydrated(self, entries):
+        """
+        Remember the dead ids among entries fresh from hydration, count the
+        links left out and return the ones found, for the link cache.
+        """
+        fetched = {link_id: link for link_id, link, error in entries if link is not None}
+        dead = [link_id for link_id, link, error in entries if isinstance(error, wrapper.NotFound)]
+        failed = len(entries) - len(fetched) - len(dead)
+        
+        self.missing_links.add(dead)
+        
+        if dead:
+            self.skipped_links.inc(len(dead), reason='missing')
+            
+        if failed:
+            self.skipped_links.inc(failed, reason='failed')
             
-            for link_id in data['links']:
-                link = self._getlink(link_id)
+        return fetched
+        
+    def _present(self, entries):
+        """
+        (links, error) of entries, error is the first lookup that failed, 
+        None if they all went through, dead links aside. It's raised if no
+        link could be fetched.
+        """
+        links = [link for link_id, link, error in entries if link is not None]
+        errors = [error for link_id, link, error in entries if error is not None and not isinstance(error, wrapper.NotFound)]
+        
+        if errors and not links:
+            raise errors[0]
+        
+        return links, errors[0] if errors else None
+        
+    def _page_links(self, data, links, error):
+        """
+        (data, links) of a listing page, for the page cache, raising 
+        Incomplete if some links couldn't be fetched.
+        """
+        if error is not None:
+            raise cache.Incomplete((data, links), error)
+        
+        return data, links
+        
+    def _iter_links(self, link_ids):
+        """
+        The links of _getlinks one by one, the cached ones straight away, the
+        others as they're hydrated. Raises Incomplete after the last one if
+        some couldn't be fetched.
+        """
+        dead = self.missing_links.known(link_ids)
+        cached = self.link_cache.get_many([link_id for link_id in link_ids if link_id not in dead])
+        missing = [link_id for link_id in link_ids if link_id not in cached and link_id not in dead]
+        
+        hydrated = self.hydrator.iter_hydrate_partial(missing)
+        entries = []
+        
+        try:
+            for link_id in link_ids:
+                if link_id in dead:
+                    continue
                 
-                links.append(link)
+                if link_id in cached:
+                    entries.append((link_id, cached[link_id], None))
+                else:
+                    entries.append(next(hydrated))
+                
+                if entries[-1][1] is not None:
+                    yield entries[-1][1]
+            
+            links, error = self._present(entries)
             
+            if error is not None:
+                raise cache.Incomplete(None, error)
+        finally:
+            hydrated.close()
+            self.link_cache.set_many(self._hydrated([entry for entry in entries if entry[0] not in cached]))
+    
+    def _page_number(self, page):
+        if not page:
+            return 1
+        else:
+            return int(page)
+    
+    def _page_data(self, key, fetch, *args):
+        """
+        (data, links) of a listing page through the page cache, and whether
+        it's a stale copy served because the backends are in trouble.
+        """
+        try:
+            return self.page_cache.get(key, fetch, *args)
+        except wrapper.TooManyRetries:
+            raise TooManyRetries()
+        except wrapper.BadRequest:
+            raise BackEndTrouble()
+            
+    def _stale_page(self, key, entry, error):
+        try:
+            return self.page_cache.stale(key, entry, error)
         except wrapper.TooManyRetries:
             raise TooManyRetries()
         except wrapper.BadRequest:
             raise BackEndTrouble()
+    
+    def listing(self, req, page=None):
+        page = self._page_number(page)
+        
+        if self.config.stream_listings:
+            return self._stream_listing(req, page, ('listing', page), self._fetch_listing, self._listing_data, page)
+        
+        (data, links), stale = self._page_data(('listing', page), self._fetch_listing, page)
+        
+        if not stale:
+            self._prefetch_next(('listing', page), self._fetch_listing, (page,), data)
+        
+        return self._listing_page(req, page, data, links, stale=stale)
+        
+    def _prefetch_next(self, key, fetch, args, data):
+        """
+        Have the prefetcher fetch the page after the one of key, args, and 
+        data, whose page number is the last item of both.
+        """
+        pagination = data['pagination']
+        
+        # no next link on the last page, see _listing_context
+        if self.prefetcher is None or not pagination.get('next') or args[-1] == pagination.get('last'):
+            return
+        
+        try:
+            next_page = int(pagination['next'])
+        except (TypeError, ValueError):
+            return
+        
+        self.prefetcher.submit(key[:-1] + (next_page,), fetch, *(args[:-1] + (next_page,)))
+        
+    def _listing_data(self, page):
+        return self.link_service.get("/?page={}".format(page))
+        
+    def _fetch_listing(self, page):
+        data = self._listing_data(page)
+        
+        return self._page_links(data, *self._getlinks(data['links']))
+        
+    def _listing_page(self, req, page, data, links, tag=None, stale=False):
+        user = self.session_user(req)
+        
+        etag = self.page_etag('list', tag, page, data['pagination'], links, stale, user is not None)
+        
+        if self.not_modified(req, etag):
+            return self.cacheable(Response(status=304), etag, user)
+        
+        context, entry_context = self._listing_context(page, data, tag, stale, user)
+        context['entries'] = self.fragments.join('entry', links, entry_context, variant=user is not None)
+        
+        res = Response()
+        res.text = self.renderer.render_name('list', context)
+        
+        if stale:
+            res.headers['warning'] = '110 - "Response is Stale"'
+        
+        return self.cacheable(res, etag, user)
+        
+    def _listing_context(self, page, data, tag, stale, user):
+        """
+        The context of list.html but the entries, and the context of the 
+        entries.
+        """
+        # the entries only care whether there's a user
+        entry_context = {
+            'prefix': self.config.path_prefix,
+            'user': user is not None
+        }
         
         context = { 
-            'links': links,
             'count': data['pagination']['count'],
             'last': data['pagination']['last'],
             'prefix': self.config.path_prefix,
-            'user': req.cookies.get('linkapp.username')
+            'user': user,
+            'stale': stale
         }
         
+        if tag is not None:
+            context['tag'] = tag
+        
         if page > 1:
             # making previous a string so mustache won't think its false.
             context['previous'] = data['pagination']['previous']
@@ -336,124 +921,136 @@ class GatewayService:
         if page != data['pagination']['last']:
             context['next'] = data['pagination']['next']
         
-        res = Response()
-        res.text = self.renderer.render_name('list', context)
+        return context, entry_context
         
-        return res
+    def _stream_listing(self, req, page, key, fetch, fetch_data, *args, tag=None):
+        """
+        A listing page sent while it's fetched: once the page of link ids is
+        in, the page up to the entries goes out at once, then each entry as 
+        its link is hydrated, in order. Pages in the page cache are served 
+        whole, like the other pages streamed ones have no ETag.
+        """
+        entry, state = self.page_cache.lookup(key)
         
-    def static(self, req, path):
-        if req.method != "GET":
-            raise BadRequest("Bad Request, Method not supported")
+        if state != 'miss':
+            (data, links), stale = self._page_data(key, fetch, *args)
+            
+            return self._listing_page(req, page, data, links, tag=tag, stale=stale)
         
-        to_get = os.path.join(self.static_path, path)
+        self.page_cache.lookups.inc(result='miss')
         
-        if os.path.isfile(to_get):
-            def serve_file(environ, start_response):
-                content_type, encoding = mimetypes.guess_type(to_get)
-                
-                start_response('200 OK', [('Content-Type', content_type)])
-                
-                block_size = 4096
-                
-                asset = open(to_get, 'rb')
-                
-                # lifted from pep 333: https://www.python.org/dev/peps/pep-0333/#optional-platform-specific-file-handling
-                if 'wsgi.file_wrapper' in environ:
-                    return environ['wsgi.file_wrapper'](asset, block_size)
-                else:
-                    return iter(lambda: asset.read(block_size), '')
-                    
-            return serve_file
-        else:
-            raise NotFound()
+        try:
+            data = fetch_data(*args)
+        except (wrapper.TooManyRetries, wrapper.BadRequest, wrapper.Overloaded) as e:
+            (data, links), stale = self._stale_page(key, entry, e)
+            
+            return self._listing_page(req, page, data, links, tag=tag, stale=stale)
         
-    def listing_by_tag(self, req, tag, page=None):
-        if req.method != "GET":
-            raise BadRequest("Bad Request, Method not supported")
+        self._prefetch_next(key, fetch, args, data)
+        
+        user = self.session_user(req)
+        context, entry_context = self._listing_context(page, data, tag, False, user)
         
         res = Response()
+        res.app_iter = self._listing_stream(key, data, context, entry_context, user, deadline.at())
+        # ask nginx and the like to pass the chunks on as they come
+        res.headers['x-accel-buffering'] = 'no'
         
-        if not page:
-            page = 1
-        else:
-            page = int(page)
+        return self.cacheable(res, None, user)
+        
+    def _listing_stream(self, key, data, context, entry_context, user, until=None):
+        head, foot = self.renderer.render_name('list', context, entries=ENTRIES_MARKER).split(ENTRIES_MARKER)
+        
+        yield head.encode('utf-8')
         
         links = []
         
         try:
-            data = self.tag_service.get("/tag/{}?page={}".format(tag, page))
-            
-            for link_id in data['links']:
-                link = self._getlink(link_id)
-                
+            # the server iterates after __call__ returned, outside its deadline
+            for link in deadline.iterate(self._iter_links(data['links']), until):
                 links.append(link)
+                
+                yield self.fragments.render('entry', link, entry_context, variant=user is not None).encode('utf-8')
+        except (wrapper.TooManyRetries, wrapper.BadRequest, wrapper.NotFound, wrapper.Overloaded, cache.Incomplete) as e:
+            # the page is already on its way, the notice stands for the 
+            # stale treatment, and it isn't cached
+            logger.warning("Streaming %s stopped short: %s", key, e)
             
-        except wrapper.TooManyRetries:
-            raise TooManyRetries()
-        except wrapper.BadRequest:
-            raise BackEndTrouble()
+            yield STREAM_TROUBLE.encode('utf-8')
+        else:
+            self.page_cache.store(key, (data, links))
         
-        context = { 
-            'links': links,
-            'count': data['pagination']['count'],
-            'last': data['pagination']['last'],
-            'prefix': self.config.path_prefix,
-            'user': req.cookies.get('linkapp.username'),
-            'tag': tag
-        }
+        yield foot.encode('utf-8')
         
-        if page > 1:
-            # making previous a string so mustache won't think its false.
-            context['previous'] = data['pagination']['previous']
-            
-        if page != data['pagination']['last']:
-            context['next'] = data['pagination']['next']
+    def static(self, req, path):
+        res = self.assets.response(req, path)
         
-        res = Response()
-        res.text = self.renderer.render_name('list', context)
+        if res is None:
+            raise NotFound()
         
         return res
+        
+    def listing_by_tag(self, req, tag, page=None):
+        page = self._page_number(page)
+        
+        if self.config.stream_listings:
+            return self._stream_listing(req, page, ('tag', tag, page), self._fetch_listing_by_tag, 
+                                        self._listing_by_tag_data, tag, page, tag=tag)
+        
+        (data, links), stale = self._page_data(('tag', tag, page), self._fetch_listing_by_tag, tag, page)
+        
+        if not stale:
+            self._prefetch_next(('tag', tag, page), self._fetch_listing_by_tag, (tag, page), data)
+        
+        return self._listing_page(req, page, data, links, tag=tag, stale=stale)
+        
+    def _listing_by_tag_data(self, tag, page):
+        return self.tag_service.get("/tag/{}?page={}".format(tag, page))
+        
+    def _fetch_listing_by_tag(self, tag, page):
+        data = self._listing_by_tag_data(tag, page)
+        
+        return self._page_links(data, *self._getlinks(data['links']))
                     
     def reading_list(self, req):
-        if req.method != "GET":
-            raise BadRequest("Bad Request, Method not supported")
-        
         res = self.authorize(req)
         
-        user = req.cookies.get('linkapp.username')
-        
-        links = []
+        user = req.remote_user
         
         try:
             data = self.readinglist_service.get("/{}".format(user))
             
-            for link_id in data:
-                link = self._getlink(link_id)
-                
-                links.append(link)
+            links, error = self._getlinks(data)
             
         except wrapper.TooManyRetries:
             raise TooManyRetries()
         except wrapper.BadRequest:
             raise BackEndTrouble()
             
+        return self._reading_list_page(res, user, links, incomplete=error is not None)
+        
+    def _reading_list_page(self, res, user, links, incomplete=False):
+        entry_context = {
+            'prefix': self.config.path_prefix
+        }
+        
         context = {
             "user":user,
             'prefix': self.config.path_prefix,
-            "links": links
+            "entries": self.fragments.join('reading-list-entry', links, entry_context)
         }
             
         res.text = self.renderer.render_name('reading-list', context)
+        
+        if incomplete:
+            res.headers['warning'] = '199 - "Some links could not be fetched"'
             
         return res
         
     def reading_list_add(self, req, link_id):
-        if req.method != "GET":
-            raise BadRequest("Bad Request, Method not supported")
-        
         res = self.authorize(req)
         
-        user = req.cookies.get('linkapp.username')
+        user = req.remote_user
         
         try:
             data = self.readinglist_service.post("/{}".format(user), link_id)
@@ -465,12 +1062,9 @@ class GatewayService:
         return Redirect(path=self.config.path_prefix+"reading-list")
         
     def reading_list_read(self, req, link_id):
-        if req.method != "GET":
-            raise BadRequest("Bad Request, Method not supported")
-        
         res = self.authorize(req)
         
-        user = req.cookies.get('linkapp.username')
+        user = req.remote_user
         
         try:
             data = self.readinglist_service.put("/{}/{}/read".format(user, link_id))
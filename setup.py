@@ -4,5 +4,13 @@ setup(
     version="0.1",
     packages=["linkapp.gateway"],
     install_requires=['redis', 'pika', 'strict_rfc3339', 'jsonschema', 'webob', 'requests', 'pystache'],
+    extras_require={
+        'brotli': ['brotli'],
+        'asgi': ['httpx'],
+        'test': ['pytest', 'fakeredis'],
+    },
+    entry_points={
+        'console_scripts': ['linkapp-gateway-writer=linkapp.gateway.queue:main'],
+    },
     include_package_data=True
 )
\ No newline at end of file
@@ -0,0 +1,25 @@
+import pytest
+
+from linkapp.gateway.config import GatewayConfig
+
+
+@pytest.fixture
+def make_config():
+    """
+    GatewayConfig for a gateway whose backends aren't there, tests swap
+    in fakes for the ones they use.
+    """
+    def make(**kwargs):
+        options = dict(redis_url="redis://localhost:6379/0",
+                       rabbit_url="amqp://localhost/",
+                       link_service_url="http://links",
+                       tag_service_url="http://tags",
+                       authorization_service_url="http://authorization",
+                       readinglist_service_url="http://readinglist",
+                       session_secret="secret",
+                       prefetch=False)
+        options.update(kwargs)
+
+        return GatewayConfig(**options)
+
+    return make
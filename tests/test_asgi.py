@@ -0,0 +1,233 @@
+import asyncio
+import base64
+import json
+from urllib import parse
+
+import fakeredis
+import httpx
+
+from benchmarks import stubs
+from linkapp.gateway.asgi import AsyncGatewayService
+
+AUTH = "Basic " + base64.b64encode(b"someone:password").decode('ascii')
+
+
+def answer(stub):
+    """
+    An httpx.MockTransport handler answering like stub.
+    """
+    def handle(request):
+        body = json.loads(request.content) if request.content else None
+        query = parse.parse_qs(request.url.query.decode('ascii'))
+        status, payload = stub.respond(request.method, request.url.path, query, body)
+
+        return httpx.Response(status, json=payload)
+
+    return handle
+
+
+def run(make_config, test, links=30, error_rate=0.0, **options):
+    """
+    Run test(client, gateway, backends) against an AsyncGatewayService
+    whose backends are stubs, through httpx's ASGI transport.
+    """
+    async def main():
+        backends = stubs.StubBackends(links, latency=0, error_rate=error_rate)
+        options.setdefault('service_retries', 2)
+        options.setdefault('service_retry_sleep', 0)
+        gateway = AsyncGatewayService(make_config(**options), redis_client=fakeredis.FakeRedis())
+
+        for name, service in gateway.backends.items():
+            await service.session.aclose()
+            service.session = httpx.AsyncClient(transport=httpx.MockTransport(answer(backends.stubs[name])))
+
+        transport = httpx.ASGITransport(app=gateway)
+
+        async with httpx.AsyncClient(transport=transport, base_url="http://gateway") as client:
+            await test(client, gateway, backends)
+
+        await gateway.close()
+
+    asyncio.run(main())
+
+
+def test_listing(make_config):
+    async def test(client, gateway, backends):
+        res = await client.get("/")
+
+        assert res.status_code == 200
+        assert res.text.count("Link number") == 10
+        assert "Link number 0" in res.text
+        assert 'etag' in res.headers
+        assert 'server-timing' in res.headers
+
+        again = await client.get("/", headers={'if-none-match': res.headers['etag']})
+
+        assert again.status_code == 304
+
+    run(make_config, test)
+
+
+def test_listing_page_and_tag(make_config):
+    async def test(client, gateway, backends):
+        page = await client.get("/page/2")
+        tagged = await client.get("/tag/python")
+
+        assert "Link number 10" in page.text
+        assert page.status_code == tagged.status_code == 200
+        assert tagged.text.count("Link number") == min(10, len(backends.data.tagged("python")))
+
+    run(make_config, test)
+
+
+def test_streamed_listing(make_config):
+    async def test(client, gateway, backends):
+        res = await client.get("/")
+
+        assert res.status_code == 200
+        assert res.text.count("Link number") == 10
+        assert res.text.rstrip().endswith("</html>")
+        assert 'server-timing' not in res.headers
+
+    run(make_config, test, stream_listings=True)
+
+
+def test_backend_down(make_config):
+    async def test(client, gateway, backends):
+        res = await client.get("/")
+
+        assert "trouble with the back-end" in res.text
+        assert gateway.route_requests.value(route="listing", status=str(res.status_code)) == 1
+
+    run(make_config, test, error_rate=1.0)
+
+
+def test_not_found(make_config):
+    async def test(client, gateway, backends):
+        res = await client.get("/nothing/here")
+
+        assert res.status_code == 404
+        assert gateway.route_requests.value(route="not_found", status="404") == 1
+
+    run(make_config, test)
+
+
+def test_method_not_allowed(make_config):
+    async def test(client, gateway, backends):
+        assert (await client.post("/", content=b"x")).status_code == 400
+
+    run(make_config, test)
+
+
+def test_unauthorized(make_config):
+    async def test(client, gateway, backends):
+        res = await client.get("/new")
+
+        assert res.status_code == 401
+        assert res.headers['www-authenticate'].startswith("Basic")
+
+    run(make_config, test)
+
+
+def test_session(make_config):
+    async def test(client, gateway, backends):
+        res = await client.get("/new", headers={'authorization': AUTH})
+
+        assert res.status_code == 200
+        assert backends.reset()['authorization'] == 1
+
+        # the client keeps the session cookie
+        res = await client.get("/new")
+
+        assert res.status_code == 200
+        assert backends.reset()['authorization'] == 0
+
+    run(make_config, test, credential_cache_ttl=0)
+
+
+def test_save(make_config):
+    async def test(client, gateway, backends):
+        form = {'page_title': "New one", 'desc_text': "About it", 'url_address': "http://example.com/new",
+                'tags': "python | new"}
+        res = await client.post("/save", data=form, headers={'authorization': AUTH})
+
+        assert res.status_code == 302
+
+        key, = [key for key, link in backends.data.links.items() if link['page_title'] == "New one"]
+
+        assert backends.data.links[key]['author'] == "someone"
+        assert sorted(backends.data.tags[key]) == ["new", "python"]
+
+    run(make_config, test)
+
+
+def test_save_invalid(make_config):
+    async def test(client, gateway, backends):
+        res = await client.post("/save", data={'page_title': "No URL"}, headers={'authorization': AUTH})
+
+        assert res.status_code == 200
+        assert "URL is a required field" in res.text
+        assert backends.reset()['link'] == 0
+
+    run(make_config, test)
+
+
+def test_import(make_config):
+    records = [{'page_title': "Imported {}".format(n), 'desc_text': "About it",
+                'url_address': "http://example.com/{}".format(n), 'tags': ["imported"]} for n in range(5)]
+    lines = [json.dumps(record) for record in records]
+    lines.insert(2, '{"page_title": "No URL"}')
+    upload = ("\n".join(lines) + "\n").encode('utf-8')
+
+    async def test(client, gateway, backends):
+        res = await client.post("/import", content=upload,
+                                headers={'authorization': AUTH, 'content-type': "application/x-ndjson"})
+
+        assert res.status_code == 200
+        assert 'server-timing' not in res.headers
+
+        report = [json.loads(line) for line in res.text.splitlines()]
+
+        assert report[0]['line'] == 3
+        assert report[-1] == {'done': {'read': 6, 'imported': 5, 'failed': 1}}
+        assert len([link for link in backends.data.links.values() if link['author'] == "someone"]) == 5
+
+    run(make_config, test)
+
+
+def test_import_unauthorized(make_config):
+    async def test(client, gateway, backends):
+        res = await client.post("/import", content=b'{}\n', headers={'content-type': "application/x-ndjson"})
+
+        assert res.status_code == 401
+
+    run(make_config, test)
+
+
+def test_reading_list(make_config):
+    async def test(client, gateway, backends):
+        res = await client.get("/reading-list", headers={'authorization': AUTH})
+
+        assert res.status_code == 200
+        assert res.text.count("Link number") == 5
+
+    run(make_config, test)
+
+
+def test_lifespan(make_config):
+    async def main():
+        gateway = AsyncGatewayService(make_config(), redis_client=fakeredis.FakeRedis())
+        messages = asyncio.Queue()
+        sent = []
+
+        for message in ({'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}):
+            messages.put_nowait(message)
+
+        async def send(message):
+            sent.append(message['type'])
+
+        await gateway({'type': 'lifespan'}, messages.get, send)
+
+        assert sent == ['lifespan.startup.complete', 'lifespan.shutdown.complete']
+
+    asyncio.run(main())
@@ -0,0 +1,356 @@
+import asyncio
+import time
+
+import fakeredis
+import pytest
+
+from linkapp.gateway import cache
+
+LINK = {'page_title': "A link", 'key': "a" * 32, 'tags': [{'name': "python"}]}
+
+
+@pytest.fixture
+def server():
+    return fakeredis.FakeServer()
+
+
+@pytest.fixture
+def link_cache(server):
+    return cache.LinkCache(fakeredis.FakeRedis(server=server), ttl=60, local_size=16, local_ttl=5)
+
+
+def test_link_cache_miss(link_cache):
+    assert link_cache.get_many(["a" * 32]) == {}
+
+
+def test_link_cache_hit(link_cache):
+    link_cache.set("a" * 32, LINK)
+
+    assert link_cache.get_many(["a" * 32, "b" * 32]) == {"a" * 32: LINK}
+
+
+def test_link_cache_hit_from_redis(server, link_cache):
+    link_cache.set("a" * 32, LINK)
+
+    # another worker, nothing in its local tier
+    other = cache.LinkCache(fakeredis.FakeRedis(server=server), ttl=60)
+
+    assert other.get_many(["a" * 32]) == {"a" * 32: LINK}
+
+
+def test_link_cache_copies(link_cache):
+    link_cache.set("a" * 32, LINK)
+    link_cache.get_many(["a" * 32])["a" * 32]['page_title'] = "Changed"
+
+    assert link_cache.get_many(["a" * 32])["a" * 32] == LINK
+
+
+def test_link_cache_invalidate(server, link_cache):
+    link_cache.set("a" * 32, LINK)
+    link_cache.invalidate("a" * 32)
+
+    assert link_cache.get_many(["a" * 32]) == {}
+    assert fakeredis.FakeRedis(server=server).get(link_cache.key("a" * 32)) == b"-"
+
+
+def test_link_cache_no_write_back_after_invalidate(server, link_cache):
+    # a reader fetched the link, it's saved and invalidated, then the
+    # reader caches what it fetched
+    link_cache.invalidate("a" * 32)
+    link_cache.set("a" * 32, LINK)
+
+    other = cache.LinkCache(fakeredis.FakeRedis(server=server), ttl=60)
+    other.set("a" * 32, LINK)
+
+    assert link_cache.get_many(["a" * 32]) == {}
+    assert other.get_many(["a" * 32]) == {}
+
+
+def test_link_cache_after_tombstone(server):
+    link_cache = cache.LinkCache(fakeredis.FakeRedis(server=server), ttl=60, local_size=0, tombstone_ttl=1)
+    link_cache.invalidate("a" * 32)
+
+    # the tombstone expiring
+    fakeredis.FakeRedis(server=server).delete(link_cache.key("a" * 32))
+    link_cache.set("a" * 32, LINK)
+
+    assert link_cache.get_many(["a" * 32]) == {"a" * 32: LINK}
+
+
+def test_link_cache_set_keeps_existing(link_cache):
+    link_cache.set("a" * 32, LINK)
+    link_cache.local.clear()
+    link_cache.set("a" * 32, dict(LINK, page_title="Other"))
+
+    assert link_cache.get_many(["a" * 32]) == {"a" * 32: LINK}
+
+
+def test_link_cache_disabled(server):
+    link_cache = cache.LinkCache(fakeredis.FakeRedis(server=server), ttl=0)
+    link_cache.set("a" * 32, LINK)
+
+    assert link_cache.get_many(["a" * 32]) == {}
+
+
+def test_link_cache_redis_down(server, link_cache):
+    server.connected = False
+
+    link_cache.set("a" * 32, LINK)
+    link_cache.invalidate("b" * 32)
+
+    # the local tier still answers, Redis is left alone for a while
+    assert link_cache.get_many(["a" * 32, "b" * 32]) == {"a" * 32: LINK}
+    assert link_cache.down_until > time.monotonic()
+
+
+def test_link_cache_redis_down_miss(server, link_cache):
+    server.connected = False
+
+    assert link_cache.get_many(["a" * 32]) == {}
+
+
+def test_link_cache_redis_back(server, link_cache):
+    server.connected = False
+    link_cache.get_many(["a" * 32])
+
+    server.connected = True
+    link_cache.down_until = 0
+    link_cache.set("a" * 32, LINK)
+    link_cache.local.clear()
+
+    assert link_cache.get_many(["a" * 32]) == {"a" * 32: LINK}
+
+
+def test_local_lru_expires():
+    lru = cache.LocalLRU(4)
+    lru.set("a", 1, 0.01)
+
+    time.sleep(0.02)
+
+    assert lru.get("a") is None
+
+
+def test_local_lru_evicts_least_recent():
+    lru = cache.LocalLRU(2)
+    lru.set("a", 1, 60)
+    lru.set("b", 2, 60)
+    lru.get("a")
+    lru.set("c", 3, 60)
+
+    assert (lru.get("a"), lru.get("b"), lru.get("c")) == (1, None, 3)
+
+
+def test_missing_links_known():
+    missing = cache.MissingLinks(ttl=60)
+    missing.add(["a" * 32])
+
+    assert missing.known(["a" * 32, "b" * 32]) == {"a" * 32}
+
+
+def test_missing_links_expire():
+    missing = cache.MissingLinks(ttl=0.01)
+    missing.add(["a" * 32])
+
+    time.sleep(0.02)
+
+    assert missing.known(["a" * 32]) == set()
+
+
+def test_missing_links_discard():
+    missing = cache.MissingLinks(ttl=60)
+    missing.add(["a" * 32])
+    missing.discard("a" * 32)
+
+    assert missing.known(["a" * 32]) == set()
+
+
+def test_missing_links_disabled():
+    missing = cache.MissingLinks(ttl=0)
+    missing.add(["a" * 32])
+
+    assert missing.known(["a" * 32]) == set()
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, 'monotonic', lambda: now[0])
+
+    return now
+
+
+class Fetch:
+    """
+    A page fetch returning the values it's given in turn, raising the
+    exceptions among them.
+    """
+
+    def __init__(self, *values):
+        self.values = list(values)
+        self.calls = 0
+
+    def __call__(self, page):
+        self.calls += 1
+        value = self.values.pop(0)
+
+        if isinstance(value, Exception):
+            raise value
+
+        return value
+
+
+def settled(page_cache):
+    # wait for background refreshes
+    if page_cache.executor is not None:
+        page_cache.executor.shutdown(wait=True)
+        page_cache.executor = None
+
+
+def test_page_cache_miss_then_hit(clock):
+    page_cache = cache.PageCache(soft_ttl=5, hard_ttl=60)
+    fetch = Fetch("one")
+
+    assert page_cache.get("/", fetch, 1) == ("one", False)
+    assert page_cache.get("/", fetch, 1) == ("one", False)
+    assert fetch.calls == 1
+
+
+def test_page_cache_revalidate(clock):
+    page_cache = cache.PageCache(soft_ttl=5, hard_ttl=60)
+    fetch = Fetch("one", "two")
+    page_cache.get("/", fetch, 1)
+
+    clock[0] += 10
+
+    # the old copy now, the new one once the refresh is done
+    assert page_cache.get("/", fetch, 1) == ("one", False)
+    settled(page_cache)
+    assert page_cache.get("/", fetch, 1) == ("two", False)
+    assert fetch.calls == 2
+
+
+def test_page_cache_revalidate_once(clock):
+    page_cache = cache.PageCache(soft_ttl=5, hard_ttl=60)
+    page_cache.store("/", "one")
+    clock[0] += 10
+    page_cache._claim("/")
+    fetch = Fetch()
+
+    assert page_cache.get("/", fetch, 1) == ("one", False)
+    settled(page_cache)
+    assert fetch.calls == 0
+
+
+def test_page_cache_refresh_failure_keeps_copy(clock):
+    page_cache = cache.PageCache(soft_ttl=5, hard_ttl=60)
+    fetch = Fetch("one", ValueError("down"))
+    page_cache.get("/", fetch, 1)
+
+    clock[0] += 10
+    page_cache.get("/", fetch, 1)
+    settled(page_cache)
+
+    assert page_cache.get("/", fetch, 1) == ("one", False)
+    assert page_cache.refreshing == set()
+
+
+def test_page_cache_expired(clock):
+    page_cache = cache.PageCache(soft_ttl=5, hard_ttl=60)
+    fetch = Fetch("one", "two")
+    page_cache.get("/", fetch, 1)
+
+    clock[0] += 60
+
+    assert page_cache.get("/", fetch, 1) == ("two", False)
+
+
+def test_page_cache_stale_on_error(clock):
+    page_cache = cache.PageCache(soft_ttl=5, hard_ttl=60, errors=(ValueError,))
+    fetch = Fetch("one", ValueError("down"))
+    page_cache.get("/", fetch, 1)
+
+    clock[0] += 60
+
+    assert page_cache.get("/", fetch, 1) == ("one", True)
+
+
+def test_page_cache_error_no_copy(clock):
+    page_cache = cache.PageCache(errors=(ValueError,))
+
+    with pytest.raises(ValueError):
+        page_cache.get("/", Fetch(ValueError("down")), 1)
+
+
+def test_page_cache_other_errors_raised(clock):
+    page_cache = cache.PageCache(soft_ttl=5, hard_ttl=60, errors=(ValueError,))
+    fetch = Fetch("one", KeyError("bug"))
+    page_cache.get("/", fetch, 1)
+
+    clock[0] += 60
+
+    with pytest.raises(KeyError):
+        page_cache.get("/", fetch, 1)
+
+
+def test_page_cache_incomplete_not_stored(clock):
+    page_cache = cache.PageCache()
+    fetch = Fetch(cache.Incomplete("partial", ValueError("link 3")), "whole")
+
+    assert page_cache.get("/", fetch, 1) == ("partial", True)
+    assert page_cache.get("/", fetch, 1) == ("whole", False)
+
+
+def test_page_cache_incomplete_serves_copy(clock):
+    page_cache = cache.PageCache(soft_ttl=5, hard_ttl=60)
+    fetch = Fetch("one", cache.Incomplete("partial", ValueError("link 3")))
+    page_cache.get("/", fetch, 1)
+
+    clock[0] += 60
+
+    assert page_cache.get("/", fetch, 1) == ("one", True)
+
+
+def test_page_cache_disabled(clock):
+    page_cache = cache.PageCache(size=0)
+    fetch = Fetch("one", "two")
+
+    assert page_cache.get("/", fetch, 1) == ("one", False)
+    assert page_cache.get("/", fetch, 1) == ("two", False)
+
+
+def test_page_cache_size(clock):
+    page_cache = cache.PageCache(size=2)
+    page_cache.store("/1", 1)
+    page_cache.store("/2", 2)
+    page_cache.lookup("/1")
+    page_cache.store("/3", 3)
+
+    assert list(page_cache.entries) == ["/1", "/3"]
+
+
+def test_async_page_cache_revalidate(clock):
+    async def main():
+        page_cache = cache.AsyncPageCache(soft_ttl=5, hard_ttl=60, errors=(ValueError,))
+        values = ["one", "two", ValueError("down")]
+
+        async def fetch(page):
+            value = values.pop(0)
+
+            if isinstance(value, Exception):
+                raise value
+
+            return value
+
+        assert await page_cache.get("/", fetch, 1) == ("one", False)
+
+        clock[0] += 10
+
+        assert await page_cache.get("/", fetch, 1) == ("one", False)
+        await asyncio.gather(*page_cache.tasks)
+        assert await page_cache.get("/", fetch, 1) == ("two", False)
+
+        clock[0] += 60
+
+        assert await page_cache.get("/", fetch, 1) == ("two", True)
+
+    asyncio.run(main())
@@ -0,0 +1,221 @@
+import threading
+import asyncio
+import time
+
+import pytest
+
+from linkapp.gateway import coalesce
+
+
+class Gate:
+    """
+    A call that blocks until released, counting how often it's made.
+    """
+
+    def __init__(self, result="result", error=None):
+        self.result = result
+        self.error = error
+        self.calls = 0
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self):
+        self.calls += 1
+        self.started.set()
+        self.release.wait(5)
+
+        if self.error is not None:
+            raise self.error
+
+        return self.result
+
+
+def followers(flights, key, func, count, **kwargs):
+    """
+    Start count threads calling flights.do once func is in flight, returns
+    the threads and the list their (result, shared) or exception go to.
+    """
+    results = []
+
+    def follow():
+        try:
+            results.append(flights.do(key, func, **kwargs))
+        except Exception as e:
+            results.append(e)
+
+    threads = [threading.Thread(target=follow) for i in range(count)]
+
+    for thread in threads:
+        thread.start()
+
+    return threads, results
+
+
+def lead(flights, key, func):
+    threads, results = followers(flights, key, func, 1)
+    func.started.wait(5)
+
+    return threads, results
+
+
+def settle():
+    # time for the followers to find the flight in progress
+    time.sleep(0.1)
+
+
+def test_shared():
+    flights = coalesce.SingleFlight()
+    gate = Gate()
+
+    leader, led = lead(flights, "a", gate)
+    threads, results = followers(flights, "a", gate, 5)
+    settle()
+    gate.release.set()
+
+    for thread in leader + threads:
+        thread.join(5)
+
+    assert gate.calls == 1
+    assert led == [("result", False)]
+    assert results == [("result", True)] * 5
+    assert flights.flights == {}
+
+
+def test_keys_separate():
+    flights = coalesce.SingleFlight()
+
+    assert flights.do("a", lambda: 1) == (1, False)
+    assert flights.do("b", lambda: 2) == (2, False)
+
+
+def test_not_cached():
+    flights = coalesce.SingleFlight()
+    calls = []
+
+    flights.do("a", calls.append, 1)
+    flights.do("a", calls.append, 2)
+
+    assert calls == [1, 2]
+
+
+def test_error_shared():
+    flights = coalesce.SingleFlight()
+    error = ValueError("down")
+    gate = Gate(error=error)
+
+    leader, led = lead(flights, "a", gate)
+    threads, results = followers(flights, "a", gate, 3)
+    settle()
+    gate.release.set()
+
+    for thread in leader + threads:
+        thread.join(5)
+
+    assert gate.calls == 1
+    assert led == [error]
+    assert results == [error] * 3
+
+
+def test_rejoin():
+    flights = coalesce.SingleFlight()
+    gate = Gate(error=TimeoutError())
+
+    leader, led = lead(flights, "a", gate)
+
+    def rejoin(error):
+        # the follower's own call succeeds
+        gate.error = None
+        return isinstance(error, TimeoutError)
+
+    threads, results = followers(flights, "a", gate, 1, rejoin=rejoin)
+    settle()
+    gate.release.set()
+
+    for thread in leader + threads:
+        thread.join(5)
+
+    assert gate.calls == 2
+    assert isinstance(led[0], TimeoutError)
+    assert results == [("result", False)]
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_async_shared():
+    async def main():
+        flights = coalesce.AsyncSingleFlight()
+        calls = []
+
+        async def fetch():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return "result"
+
+        results = await asyncio.gather(*[flights.do("a", fetch) for i in range(5)])
+
+        assert calls == [1]
+        assert results == [("result", False)] + [("result", True)] * 4
+        assert flights.flights == {}
+
+    run(main())
+
+
+def test_async_error_shared():
+    async def main():
+        flights = coalesce.AsyncSingleFlight()
+
+        async def fetch():
+            await asyncio.sleep(0.01)
+            raise ValueError("down")
+
+        results = await asyncio.gather(*[flights.do("a", fetch) for i in range(3)], return_exceptions=True)
+
+        assert all(isinstance(result, ValueError) for result in results)
+
+        with pytest.raises(ValueError):
+            await flights.do("a", fetch)
+
+    run(main())
+
+
+def test_async_cancelled_caller():
+    async def main():
+        flights = coalesce.AsyncSingleFlight()
+
+        async def fetch():
+            await asyncio.sleep(0.02)
+            return "result"
+
+        first = asyncio.ensure_future(flights.do("a", fetch))
+        second = asyncio.ensure_future(flights.do("a", fetch))
+        await asyncio.sleep(0)
+        first.cancel()
+
+        assert await second == ("result", True)
+
+    run(main())
+
+
+def test_async_rejoin():
+    async def main():
+        flights = coalesce.AsyncSingleFlight()
+        errors = [TimeoutError()]
+
+        async def fetch():
+            await asyncio.sleep(0.01)
+
+            if errors:
+                raise errors.pop()
+
+            return "result"
+
+        results = await asyncio.gather(flights.do("a", fetch),
+                                       flights.do("a", fetch, rejoin=lambda e: isinstance(e, TimeoutError)),
+                                       return_exceptions=True)
+
+        assert isinstance(results[0], TimeoutError)
+        assert results[1] == ("result", False)
+
+    run(main())
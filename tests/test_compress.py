@@ -0,0 +1,202 @@
+import gzip
+import zlib
+
+import pytest
+from webob import Request, Response
+
+from linkapp.gateway import compress
+
+BODY = b"<p>A link</p>\n" * 200
+
+
+def page(body=BODY, content_type='text/html', **headers):
+    """
+    An app answering with body, with a Content-Length.
+    """
+    def app(environ, start_response):
+        res = Response(body=body, content_type=content_type)
+
+        for name, value in headers.items():
+            res.headers[name.replace('_', '-')] = value
+
+        return res(environ, start_response)
+
+    return app
+
+
+def streamed(*chunks):
+    """
+    An app streaming chunks, without a Content-Length, that only starts
+    its response with the first one.
+    """
+    def app(environ, start_response):
+        def body():
+            start_response('200 OK', [('Content-Type', 'text/html; charset=UTF-8')])
+
+            yield from chunks
+
+        return body()
+
+    return app
+
+
+def get(app, accept_encoding="gzip, deflate", method='GET', **kwargs):
+    req = Request.blank('/', method=method)
+
+    if accept_encoding is not None:
+        req.headers['Accept-Encoding'] = accept_encoding
+
+    return req.get_response(compress.CompressionMiddleware(app, **kwargs))
+
+
+def test_gzip():
+    res = get(page())
+
+    assert res.headers['Content-Encoding'] == "gzip"
+    assert res.headers['Vary'] == "Accept-Encoding"
+    assert int(res.headers['Content-Length']) == len(res.body) < len(BODY)
+    assert gzip.decompress(res.body) == BODY
+
+
+@pytest.mark.parametrize("accept_encoding, encoding", [
+    ("deflate", "deflate"),
+    ("gzip;q=0.5, deflate", "deflate"),
+    ("br, gzip", "gzip"),
+    ("*", "gzip"),
+    ("gzip;q=0, deflate;q=0", None),
+    ("identity", None),
+    ("br", None),
+    ("", None),
+    (None, None),
+])
+def test_negotiation(accept_encoding, encoding):
+    res = get(page(), accept_encoding)
+
+    assert res.headers.get('Content-Encoding') == encoding
+    assert res.headers['Vary'] == "Accept-Encoding"
+
+    if encoding == "deflate":
+        assert zlib.decompress(res.body) == BODY
+    elif encoding is None:
+        assert res.body == BODY
+
+
+def test_small_skipped():
+    res = get(page(b"<p>short</p>"), min_size=1024)
+
+    assert 'Content-Encoding' not in res.headers
+    assert res.headers['Vary'] == "Accept-Encoding"
+    assert res.body == b"<p>short</p>"
+
+
+def test_strong_etag_skipped():
+    res = get(page(ETag='"abc"'))
+
+    assert 'Content-Encoding' not in res.headers
+    assert res.body == BODY
+
+
+def test_weak_etag_compressed():
+    res = get(page(ETag='W/"abc"'))
+
+    assert res.headers['Content-Encoding'] == "gzip"
+    assert res.headers['ETag'] == 'W/"abc"'
+
+
+def test_already_encoded_skipped():
+    res = get(page(gzip.compress(BODY), Content_Encoding="gzip"))
+
+    assert gzip.decompress(res.body) == BODY
+
+
+def test_no_transform_skipped():
+    assert 'Content-Encoding' not in get(page(Cache_Control="no-transform")).headers
+
+
+def test_head_skipped():
+    assert 'Content-Encoding' not in get(page(), method='HEAD').headers
+
+
+def test_not_compressible():
+    res = get(page(b"\x89PNG" * 1000, content_type='image/png'))
+
+    assert 'Content-Encoding' not in res.headers
+    assert 'Vary' not in res.headers
+
+
+def test_vary_extended():
+    assert get(page(Vary="Cookie")).headers['Vary'] == "Cookie, Accept-Encoding"
+    assert get(page(Vary="accept-encoding")).headers['Vary'] == "accept-encoding"
+
+
+def test_streamed():
+    chunks = [b"<html>", b"<p>one</p>" * 50, b"", b"<p>two</p>" * 50, b"</html>"]
+    middleware = compress.CompressionMiddleware(streamed(*chunks))
+    environ = Request.blank('/', headers={'Accept-Encoding': "gzip"}).environ
+    started = []
+
+    app_iter = iter(middleware(environ, lambda status, headers, exc_info=None: started.append((status, headers))))
+    decompressor = zlib.decompressobj(compress.WBITS['gzip'])
+    out = []
+
+    for expected, chunk in zip([c for c in chunks if c], app_iter):
+        # each chunk comes out whole as it goes in
+        assert decompressor.decompress(chunk) == expected
+        out.append(chunk)
+
+    status, headers = started[0]
+
+    assert status == '200 OK'
+    assert compress.header(headers, 'content-encoding') == "gzip"
+    assert compress.header(headers, 'content-length') is None
+    assert gzip.decompress(b"".join(out) + b"".join(app_iter)) == b"".join(chunks)
+
+
+def test_streamed_small_compressed():
+    res = get(streamed(b"<p>short</p>"), min_size=1024)
+
+    # there's no telling how long it is up front
+    assert res.headers['Content-Encoding'] == "gzip"
+    assert gzip.decompress(res.body) == b"<p>short</p>"
+
+
+def test_cached_bytes():
+    bodies = [BODY, b"<p>not looked at</p>" * 200]
+
+    def app(environ, start_response):
+        res = Response(body=bodies.pop(0), content_type='text/html')
+        res.headers['ETag'] = 'W/"abc"'
+
+        return res(environ, start_response)
+
+    middleware = compress.CompressionMiddleware(app)
+    req = Request.blank('/', headers={'Accept-Encoding': "gzip"})
+
+    first = req.get_response(middleware)
+    second = req.get_response(middleware)
+
+    assert gzip.decompress(second.body) == BODY
+    assert second.body == first.body
+    assert middleware.responses.value(result='compressed') == 1
+    assert middleware.responses.value(result='cached') == 1
+
+
+def test_cached_per_encoding():
+    middleware = compress.CompressionMiddleware(page(ETag='W/"abc"'))
+
+    gzipped = Request.blank('/', headers={'Accept-Encoding': "gzip"}).get_response(middleware)
+    deflated = Request.blank('/', headers={'Accept-Encoding': "deflate"}).get_response(middleware)
+
+    assert gzip.decompress(gzipped.body) == zlib.decompress(deflated.body) == BODY
+
+
+def test_write_callable():
+    def app(environ, start_response):
+        write = start_response('200 OK', [('Content-Type', 'text/plain'), ('Content-Length', str(len(BODY)))])
+        write(BODY[:100])
+
+        return [BODY[100:]]
+
+    res = get(app)
+
+    assert gzip.decompress(res.body) == BODY
@@ -0,0 +1,78 @@
+import json
+
+import pytest
+
+from linkapp.gateway import hydrate
+from linkapp.gateway import wrapper
+
+
+class FakeService:
+    """
+    Answers lookups from records, raising the exceptions among them.
+    """
+
+    bulk_path = None
+    batch_size = 50
+
+    def __init__(self, records):
+        self.records = records
+
+    def bulk_enabled(self):
+        return False
+
+    def get_many_calls(self, ids, path):
+        return [(self.get_one, (item_id,)) for item_id in ids]
+
+    def get_one(self, item_id):
+        record = self.records.get(item_id)
+
+        if isinstance(record, Exception):
+            raise record
+
+        return {item_id: record} if item_id in self.records else {}
+
+
+@pytest.fixture
+def hydrator():
+    links = FakeService({
+        "a": {'page_title': "A"},
+        "b": None,
+        "c": json.JSONDecodeError("Expecting value", "<html>", 0),
+        "d": wrapper.TooManyRetries(),
+        "f": {'page_title': "F"},
+    })
+    tags = FakeService({"a": ["python"], "f": "not a list"})
+    hydrator = hydrate.Hydrator(links, tags, workers=2)
+
+    yield hydrator
+
+    hydrator.shutdown()
+
+
+def test_hydrate_partial(hydrator):
+    entries = hydrator.hydrate_partial(["a", "b", "c", "d", "e", "f"])
+
+    assert [link_id for link_id, link, error in entries] == ["a", "b", "c", "d", "e", "f"]
+
+    link_id, link, error = entries[0]
+
+    assert error is None
+    assert link['tags'] == [{'name': "python"}] and link['key'] == "a"
+
+    errors = [type(error) for link_id, link, error in entries[1:]]
+
+    assert errors == [wrapper.ServerError, wrapper.ServerError, wrapper.TooManyRetries,
+                      wrapper.NotFound, wrapper.ServerError]
+    assert all(link is None for link_id, link, error in entries[1:])
+
+
+def test_iter_hydrate_partial(hydrator):
+    ids = ["a", "b", "c", "d", "e", "f"]
+
+    assert ([(link_id, error is None) for link_id, link, error in hydrator.iter_hydrate_partial(ids)] ==
+            [(link_id, error is None) for link_id, link, error in hydrator.hydrate_partial(ids)])
+
+
+def test_hydrate_malformed(hydrator):
+    with pytest.raises(wrapper.ServerError):
+        hydrator.hydrate(["a", "b"])
@@ -0,0 +1,160 @@
+import asyncio
+import io
+import json
+
+import pytest
+
+from linkapp.gateway import importer
+from linkapp.gateway import wrapper
+
+RECORD = {'page_title': "Example", 'desc_text': "An example", 'url_address': "http://example.com/", 'tags': ["python"]}
+
+
+def test_tag_list():
+    assert importer.tag_list(" web | python|| web") == ["python", "web"]
+    assert importer.tag_list(["b", " a ", "", 3]) == ["a", "b"]
+    assert importer.tag_list(None) is None
+
+
+def test_prepare():
+    link, tags, error = importer.prepare(dict(RECORD, author="someone else", extra="x"), "me")
+
+    assert error is None
+    assert link == {'page_title': "Example", 'desc_text': "An example",
+                    'url_address': "http://example.com/", 'author': "me"}
+    assert tags == ["python"]
+
+
+@pytest.mark.parametrize("record, message", [
+    (None, "Not a JSON object"),
+    (dict(RECORD, url_address=""), "'url_address' is a required property"),
+    (dict(RECORD, tags=" | "), "[] should be non-empty"),
+    (dict(RECORD, page_title=3), "3 is not of type 'string'"),
+])
+def test_prepare_invalid(record, message):
+    link, tags, error = importer.prepare(record, "me")
+
+    assert (link, tags) == (None, None)
+    assert message in error
+
+
+def test_read_jsonl():
+    stream = io.StringIO('{"a": 1}\n\n[1]\nnot json\n{"b": 2}\n')
+
+    assert list(importer.read_jsonl(stream)) == [(1, {'a': 1}), (3, None), (4, None), (5, {'b': 2})]
+
+
+def test_read_csv():
+    stream = io.StringIO('page_title,tags\r\n"Multi\nline",a|b\r\nOther,c\r\n')
+
+    assert list(importer.read_csv(stream)) == [(3, {'page_title': "Multi\nline", 'tags': "a|b"}),
+                                                (4, {'page_title': "Other", 'tags': "c"})]
+
+
+class FakeService:
+    """
+    Records posts, failing those whose data has a page_title (or the link
+    of a tag post) in fail.
+    """
+
+    def __init__(self, fail=()):
+        self.fail = fail
+        self.posts = []
+
+    def post(self, path, data=None, idempotent=False):
+        self.posts.append((path, data, idempotent))
+        title = data.get('page_title', path)
+
+        if title in self.fail:
+            raise self.fail[title]
+
+        return "id-" + title
+
+
+class AsyncFakeService(FakeService):
+
+    async def post(self, path, data=None, idempotent=False):
+        await asyncio.sleep(0)
+
+        return FakeService.post(self, path, data, idempotent)
+
+
+def upload(*records):
+    return io.StringIO("".join(json.dumps(record) + "\n" for record in records))
+
+
+RECORDS = [dict(RECORD, page_title=str(n)) for n in range(1, 6)]
+
+
+def test_run():
+    links = FakeService({'2': wrapper.BadRequest("duplicate")})
+    tags = FakeService({'/link/id-4': wrapper.NotRetried("503")})
+    links_importer = importer.LinkImporter(links, tags, workers=4, concurrency=2, batch_size=2)
+    records = RECORDS[:2] + [dict(RECORD, page_title=3)] + RECORDS[3:]
+
+    report = list(links_importer.run(upload(*records), 'jsonl', "me"))
+
+    assert report == [
+        {'line': 2, 'error': "duplicate"},
+        {'progress': {'read': 2, 'imported': 1, 'failed': 1}},
+        {'line': 3, 'error': "3 is not of type 'string'"},
+        {'line': 4, 'error': "503", 'link_id': "id-4"},
+        {'progress': {'read': 4, 'imported': 1, 'failed': 3}},
+        {'progress': {'read': 5, 'imported': 2, 'failed': 3}},
+        {'done': {'read': 5, 'imported': 2, 'failed': 3}},
+    ]
+    assert sorted(data['page_title'] for path, data, idempotent in links.posts) == ["1", "2", "4", "5"]
+    assert all(data['author'] == "me" and not idempotent for path, data, idempotent in links.posts)
+    assert all(idempotent for path, data, idempotent in tags.posts)
+
+
+def test_run_unexpected_errors():
+    links = FakeService({'1': ValueError("Expecting value"), '3': wrapper.Unauthorized("no")})
+    links_importer = importer.LinkImporter(links, FakeService(), workers=2, batch_size=10)
+
+    report = list(links_importer.run(upload(*RECORDS), 'jsonl', "me"))
+
+    assert report == [
+        {'line': 1, 'error': "Expecting value"},
+        {'line': 3, 'error': "no"},
+        {'progress': {'read': 5, 'imported': 3, 'failed': 2}},
+        {'done': {'read': 5, 'imported': 3, 'failed': 2}},
+    ]
+
+
+def test_run_csv():
+    links = FakeService()
+    tags = FakeService()
+    stream = io.StringIO("page_title,desc_text,url_address,tags\r\nA,a,http://a/,x|y\r\n")
+
+    report = list(importer.LinkImporter(links, tags, workers=1).run(stream, 'csv', "me"))
+
+    assert report[-1] == {'done': {'read': 1, 'imported': 1, 'failed': 0}}
+    assert tags.posts == [("/link/id-A", {'tags': ["x", "y"]}, True)]
+
+
+def test_run_empty():
+    links_importer = importer.LinkImporter(FakeService(), FakeService(), workers=1)
+
+    assert list(links_importer.run(io.StringIO(""), 'jsonl', "me")) == [
+        {'done': {'read': 0, 'imported': 0, 'failed': 0}}
+    ]
+
+
+def test_run_async():
+    links = AsyncFakeService({'2': wrapper.Overloaded("busy"), '4': KeyError("key")})
+    links_importer = importer.AsyncLinkImporter(links, AsyncFakeService(), concurrency=2, batch_size=2)
+
+    async def main():
+        return [line async for line in links_importer.run(upload(*RECORDS), 'jsonl', "me")]
+
+    report = asyncio.run(main())
+
+    assert report == [
+        {'line': 2, 'error': "busy"},
+        {'progress': {'read': 2, 'imported': 1, 'failed': 1}},
+        {'line': 4, 'error': "'key'"},
+        {'progress': {'read': 4, 'imported': 2, 'failed': 2}},
+        {'progress': {'read': 5, 'imported': 3, 'failed': 2}},
+        {'done': {'read': 5, 'imported': 3, 'failed': 2}},
+    ]
@@ -0,0 +1,150 @@
+from linkapp.gateway import queue
+from linkapp.gateway import wrapper
+
+
+class FakeService:
+    """
+    Records the writes made to it, failing with the errors in fail first.
+    """
+
+    def __init__(self, *fail):
+        self.fail = list(fail)
+        self.calls = []
+
+    def call(self, method, path, data):
+        self.calls.append((method, path, data))
+
+        if self.fail:
+            raise self.fail.pop(0)
+
+        return "c" * 32
+
+    def post(self, path, data=None, idempotent=False):
+        return self.call('POST', path, data)
+
+    def put(self, path, data=None):
+        return self.call('PUT', path, data)
+
+
+LINK = {'url_address': "http://example.com/", 'page_title': "Example", 'author': "someone"}
+
+
+def pipeline(link_service=None, tag_service=None, **kwargs):
+    kwargs.setdefault('retry_sleep', 0)
+
+    return queue.WritePipeline(queue.MemoryTransport(),
+                               link_service or FakeService(),
+                               tag_service or FakeService(),
+                               **kwargs)
+
+
+def test_submit():
+    writes = pipeline()
+    writes.submit(LINK, ["python"])
+
+    assert writes.transport.messages(queue.WRITE_QUEUE) == [{
+        'link_id': None, 'new': True, 'link': LINK, 'tags': ["python"],
+        'link_written': False, 'attempts': 0
+    }]
+
+
+def test_apply_new():
+    applied = []
+    writes = pipeline(on_applied=applied.append)
+    writes.submit(LINK, ["python"])
+    writes.run(timeout=0)
+
+    assert writes.link_service.calls == [('POST', "/", LINK)]
+    assert writes.tag_service.calls == [('POST', "/link/" + "c" * 32, {'tags': ["python"]})]
+    assert applied == ["c" * 32]
+    assert writes.transport.messages(queue.WRITE_QUEUE) == []
+
+
+def test_apply_existing():
+    writes = pipeline()
+    writes.submit(LINK, [], link_id="a" * 32)
+    writes.run(timeout=0)
+
+    assert writes.link_service.calls == [('PUT', "/" + "a" * 32, LINK)]
+    assert writes.tag_service.calls == [('PUT', "/link/" + "a" * 32, {'tags': []})]
+
+
+def test_retry_redoes_only_tags():
+    applied = []
+    writes = pipeline(tag_service=FakeService(wrapper.TooManyRetries()), on_applied=applied.append)
+    writes.submit(LINK, ["python"])
+    writes.run(timeout=0)
+
+    assert len(writes.link_service.calls) == 1
+    assert len(writes.tag_service.calls) == 2
+    assert applied == ["c" * 32]
+    assert writes.transport.messages(queue.DEAD_LETTER_QUEUE) == []
+
+
+def test_retry_sleeps(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(queue.time, 'sleep', sleeps.append)
+
+    writes = pipeline(FakeService(wrapper.Overloaded(), wrapper.Overloaded()), retry_sleep=0.5)
+    writes.submit(LINK, [])
+    writes.run(timeout=0)
+
+    assert sleeps == [0.5, 1.0]
+
+
+def test_dead_letter_after_retries():
+    errors = [wrapper.TooManyRetries("down")] * 3
+    writes = pipeline(FakeService(*errors), retries=3)
+    writes.submit(LINK, [])
+    writes.run(timeout=0)
+
+    dead, = writes.transport.messages(queue.DEAD_LETTER_QUEUE)
+
+    assert dead['attempts'] == 3
+    assert dead['error'] == "TooManyRetries: down"
+    assert len(writes.link_service.calls) == 3
+
+
+def test_dead_letter_rejected():
+    applied = []
+    writes = pipeline(FakeService(wrapper.BadRequest("no title")), on_applied=applied.append)
+    writes.submit(LINK, [])
+    writes.run(timeout=0)
+
+    dead, = writes.transport.messages(queue.DEAD_LETTER_QUEUE)
+
+    assert dead['error'] == "BadRequest: no title"
+    assert dead['attempts'] == 0
+    assert applied == []
+    assert writes.transport.messages(queue.WRITE_QUEUE) == []
+
+
+def test_dead_letter_not_retried():
+    writes = pipeline(FakeService(wrapper.NotRetried("503")))
+    writes.submit(LINK, [])
+    writes.run(timeout=0)
+
+    dead, = writes.transport.messages(queue.DEAD_LETTER_QUEUE)
+
+    assert dead['error'] == "NotRetried: 503"
+    assert len(writes.link_service.calls) == 1
+
+
+def test_dead_letter_unexpected():
+    writes = pipeline(FakeService(ValueError("Expecting value")))
+    writes.submit(LINK, [])
+    writes.submit(LINK, ["python"])
+    writes.run(timeout=0)
+
+    dead, = writes.transport.messages(queue.DEAD_LETTER_QUEUE)
+
+    assert dead['error'] == "ValueError: Expecting value"
+    # the writer carried on with the next one
+    assert len(writes.tag_service.calls) == 1
+
+
+def test_run_timeout_empty():
+    writes = pipeline()
+    writes.run(timeout=0.01)
+
+    assert writes.link_service.calls == []
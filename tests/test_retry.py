@@ -0,0 +1,348 @@
+import threading
+import asyncio
+import json
+import time
+
+import pytest
+import requests
+
+from linkapp.gateway import retry
+from linkapp.gateway import wrapper
+
+
+def test_backoff_bounds():
+    policy = retry.RetryPolicy(sleep=0.1, max_sleep=1.0)
+
+    for attempt in range(1, 10):
+        assert 0 <= policy.backoff(attempt) <= min(1.0, 0.1 * 2 ** attempt)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(retry.time, 'monotonic', lambda: now[0])
+
+    return now
+
+
+def test_breaker_opens_at_threshold(clock):
+    breaker = retry.CircuitBreaker(threshold=3, reset_timeout=10)
+
+    for i in range(2):
+        breaker.record_failure()
+
+    assert breaker.allow()
+
+    breaker.record_failure()
+
+    assert breaker.state == breaker.OPEN
+    assert not breaker.allow()
+    assert breaker.snapshot() == {'state': 'open', 'failures': 3, 'trips': 1}
+
+
+def test_breaker_success_resets_count(clock):
+    breaker = retry.CircuitBreaker(threshold=2)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+
+    assert breaker.state == breaker.CLOSED
+
+
+def test_breaker_half_open_single_probe(clock):
+    breaker = retry.CircuitBreaker(threshold=1, reset_timeout=10)
+    breaker.record_failure()
+
+    clock[0] += 10
+
+    assert breaker.allow()
+    assert breaker.state == breaker.HALF_OPEN
+    assert not breaker.allow()
+
+
+def test_breaker_probe_success_closes(clock):
+    breaker = retry.CircuitBreaker(threshold=1, reset_timeout=10)
+    breaker.record_failure()
+    clock[0] += 10
+    breaker.allow()
+    breaker.record_success()
+
+    assert breaker.state == breaker.CLOSED
+    assert breaker.allow() and breaker.allow()
+
+
+def test_breaker_probe_failure_reopens(clock):
+    breaker = retry.CircuitBreaker(threshold=5, reset_timeout=10)
+
+    for i in range(5):
+        breaker.record_failure()
+
+    clock[0] += 10
+    breaker.allow()
+    breaker.record_failure()
+
+    assert breaker.state == breaker.OPEN
+    assert breaker.trips == 2
+    assert not breaker.allow()
+
+    clock[0] += 10
+
+    assert breaker.allow()
+
+
+def test_breaker_cancelled_probe(clock):
+    breaker = retry.CircuitBreaker(threshold=1, reset_timeout=10)
+    breaker.record_failure()
+    clock[0] += 10
+    breaker.allow()
+    breaker.release_probe()
+
+    assert breaker.state == breaker.HALF_OPEN
+    assert breaker.allow()
+
+
+class Response:
+
+    def __init__(self, status_code, body=None):
+        self.status_code = status_code
+        self.text = json.dumps(body)
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class FakeSession:
+    """
+    Answers with the responses, or raises the exceptions, it's given in
+    turn, the last one over and over.
+    """
+
+    def __init__(self, *answers):
+        self.answers = list(answers)
+        self.calls = []
+
+    def request(self, method, url, timeout=None, **kwargs):
+        self.calls.append((method, url))
+        answer = self.answers.pop(0) if len(self.answers) > 1 else self.answers[0]
+
+        if isinstance(answer, Exception):
+            raise answer
+
+        return answer
+
+
+def service(*answers, **kwargs):
+    kwargs.setdefault('sleep', 0)
+    kwargs.setdefault('coalesce', False)
+    service = wrapper.ServiceWrapper("http://links", **kwargs)
+    service.session = FakeSession(*answers)
+
+    return service
+
+
+def test_get_retried():
+    links = service(Response(503), Response(502), Response(200, {'key': "a"}))
+
+    assert links.get("/a") == {'key': "a"}
+    assert len(links.session.calls) == 3
+
+
+def test_server_error_retried():
+    links = service(Response(500, {'error': "oops"}), Response(200, {'key': "a"}))
+
+    assert links.get("/a") == {'key': "a"}
+    assert len(links.session.calls) == 2
+
+
+def test_server_error_not_returned():
+    links = service(Response(500), retries=3, breaker_threshold=10)
+
+    with pytest.raises(wrapper.TooManyRetries):
+        links.get("/a")
+
+    assert links.breaker.failures == 3
+
+
+def test_server_error_trips_breaker():
+    links = service(Response(500), retries=10, breaker_threshold=2, breaker_reset=60)
+
+    with pytest.raises(wrapper.CircuitOpen):
+        links.get("/a")
+
+    assert links.breaker.state == links.breaker.OPEN
+
+
+def test_post_server_error_not_replayed():
+    links = service(Response(500), Response(200, "a"))
+
+    with pytest.raises(wrapper.NotRetried):
+        links.post("/", {'page_title': "A"})
+
+    assert len(links.session.calls) == 1
+
+
+def test_not_implemented_final():
+    links = service(Response(501, "no"))
+
+    with pytest.raises(wrapper.ServerError) as raised:
+        links.get("/a")
+
+    assert raised.value.status_code == 501
+    assert len(links.session.calls) == 1
+    assert links.breaker.failures == 0
+
+
+def test_bulk_not_implemented_falls_back():
+    links = service(Response(501), Response(200, {'key': "a"}), bulk_path="/bulk")
+
+    assert links.get_batch(["a"]) == {"a": {'key': "a"}}
+    assert not links.bulk_enabled()
+
+
+def test_too_many_retries():
+    links = service(Response(503), retries=3)
+
+    with pytest.raises(wrapper.TooManyRetries):
+        links.get("/a")
+
+    assert len(links.session.calls) == 3
+
+
+def test_post_not_replayed():
+    links = service(Response(503), Response(200, "a"))
+
+    with pytest.raises(wrapper.NotRetried):
+        links.post("/", {'page_title': "A"})
+
+    assert len(links.session.calls) == 1
+
+
+def test_post_unsent_retried():
+    links = service(requests.exceptions.ConnectTimeout(), Response(200, "a"))
+
+    assert links.post("/", {'page_title': "A"}) == "a"
+    assert len(links.session.calls) == 2
+
+
+def test_post_idempotent_retried():
+    tags = service(Response(504), Response(200, "ok"))
+
+    assert tags.post("/link/a", {'tags': []}, idempotent=True) == "ok"
+
+
+def test_breaker_fails_fast():
+    links = service(Response(503), retries=10, breaker_threshold=2, breaker_reset=60)
+
+    with pytest.raises(wrapper.CircuitOpen):
+        links.get("/a")
+
+    assert len(links.session.calls) == 2
+
+    with pytest.raises(wrapper.CircuitOpen):
+        links.get("/a")
+
+    assert len(links.session.calls) == 2
+
+
+def test_limiter_disabled():
+    limiter = retry.AdmissionLimiter(limit=0)
+
+    assert [limiter.acquire() for i in range(100)] == [limiter.ADMITTED] * 100
+
+
+def test_limiter_queue_full():
+    limiter = retry.AdmissionLimiter(limit=2, queue_size=0)
+
+    assert limiter.acquire() == limiter.ADMITTED
+    assert limiter.acquire() == limiter.ADMITTED
+    assert limiter.acquire() == limiter.QUEUE_FULL
+
+    limiter.release()
+
+    assert limiter.acquire() == limiter.ADMITTED
+
+
+def test_limiter_timed_out():
+    limiter = retry.AdmissionLimiter(limit=1, queue_size=1, wait=0.01)
+    limiter.acquire()
+
+    assert limiter.acquire() == limiter.TIMED_OUT
+    assert limiter.snapshot() == {'in_flight': 1, 'waiting': 0}
+
+
+def test_limiter_waiter_admitted():
+    limiter = retry.AdmissionLimiter(limit=1, queue_size=1, wait=5)
+    limiter.acquire()
+    results = []
+
+    waiter = threading.Thread(target=lambda: results.append(limiter.acquire()))
+    waiter.start()
+
+    for i in range(100):
+        if limiter.snapshot()['waiting']:
+            break
+
+        time.sleep(0.01)
+
+    # the queue's full while it waits
+    assert limiter.acquire(wait=0) == limiter.QUEUE_FULL
+
+    limiter.release()
+    waiter.join(5)
+
+    assert results == [limiter.ADMITTED]
+    assert limiter.snapshot() == {'in_flight': 1, 'waiting': 0}
+
+
+def test_async_limiter():
+    async def main():
+        limiter = retry.AsyncAdmissionLimiter(limit=1, queue_size=1, wait=5)
+
+        assert await limiter.acquire() == limiter.ADMITTED
+
+        waiter = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0)
+
+        assert await limiter.acquire() == limiter.QUEUE_FULL
+
+        limiter.release()
+
+        assert await waiter == limiter.ADMITTED
+        assert limiter.snapshot() == {'in_flight': 1, 'waiting': 0}
+
+        assert await limiter.acquire(wait=0.01) == limiter.TIMED_OUT
+
+    asyncio.run(main())
+
+
+def test_async_cancelled_probe():
+    class Hanging:
+
+        async def request(self, method, url, timeout=None, **kwargs):
+            await asyncio.sleep(60)
+
+    async def main():
+        links = wrapper.AsyncServiceWrapper("http://links", breaker_threshold=1, breaker_reset=0, coalesce=False)
+        links.session = Hanging()
+        links.breaker.record_failure()
+
+        probe = asyncio.ensure_future(links.post("/", {'page_title': "A"}))
+        await asyncio.sleep(0.01)
+        probe.cancel()
+
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+
+        assert links.breaker.allow()
+
+    asyncio.run(main())
+
+
+def test_shed_overloaded():
+    links = service(Response(200, "a"), admission_limit=1, admission_queue=0)
+    links.admission.acquire()
+
+    with pytest.raises(wrapper.Overloaded):
+        links.get("/a")
+
+    assert links.session.calls == []
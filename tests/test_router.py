@@ -0,0 +1,66 @@
+from linkapp.gateway import router
+
+
+def listing():
+    pass
+
+
+def tag():
+    pass
+
+
+def save():
+    pass
+
+
+def make_router():
+    routes = router.Router()
+    routes.add(("", "page"), r"^/(page/(?P<page>\d+))?$", listing)
+    routes.add("tag", r"^/tag/(?P<tag>[^/]+)(/page/(?P<page>\d+))?$", tag)
+    routes.add("save", r"^/save/?(?P<link_id>[^/]{32})?$", save, methods=("POST",))
+
+    return routes
+
+
+def test_match_root():
+    route, kwargs = make_router().match("/")
+
+    assert route.handler is listing
+    assert kwargs == {'page': None}
+
+
+def test_match_other_segment_same_route():
+    route, kwargs = make_router().match("/page/3")
+
+    assert route.handler is listing
+    assert kwargs == {'page': "3"}
+
+
+def test_match_groups():
+    route, kwargs = make_router().match("/tag/python/page/2")
+
+    assert route.name == "tag"
+    assert kwargs == {'tag': "python", 'page': "2"}
+
+
+def test_match_methods():
+    route, kwargs = make_router().match("/save/" + "a" * 32)
+
+    assert route.methods == frozenset(["POST"])
+    assert kwargs == {'link_id': "a" * 32}
+
+
+def test_no_match_in_bucket():
+    assert make_router().match("/page/two") == (None, None)
+
+
+def test_no_bucket():
+    assert make_router().match("/nothing/here") == (None, None)
+
+
+def test_name():
+    routes = router.Router()
+    route = routes.add("x", r"^/x$", listing, name="other")
+
+    assert route.name == "other"
+    assert routes.match("/x")[0] is route
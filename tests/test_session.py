@@ -0,0 +1,195 @@
+import base64
+import time
+
+import fakeredis
+import pytest
+from webob import Request
+
+from linkapp.gateway import session
+from linkapp.gateway import wrapper
+from linkapp.gateway.wsgi import GatewayService, SESSION_COOKIE
+
+
+@pytest.fixture
+def signer():
+    return session.SessionSigner("secret", ttl=60)
+
+
+def test_round_trip(signer):
+    username, expires = signer.verify(signer.issue("someone"))
+
+    assert username == "someone"
+    assert time.time() < expires <= time.time() + 60
+
+
+def test_tampered_signature(signer):
+    token = signer.issue("someone")
+    payload, signature = token.rsplit(".", 1)
+    tampered = "{}.{}".format(payload, ("0" if signature[0] != "0" else "1") + signature[1:])
+
+    assert signer.verify(tampered) == (None, 0)
+
+
+def test_changed_username(signer):
+    encoded, expires, signature = signer.issue("someone").split(".")
+    other = base64.urlsafe_b64encode(b"admin").decode('ascii').rstrip("=")
+
+    assert signer.verify("{}.{}.{}".format(other, expires, signature)) == (None, 0)
+
+
+def test_extended_expiry(signer):
+    encoded, expires, signature = signer.issue("someone").split(".")
+
+    assert signer.verify("{}.{}.{}".format(encoded, int(expires) + 3600, signature)) == (None, 0)
+
+
+def test_other_secret(signer):
+    token = session.SessionSigner("other").issue("someone")
+
+    assert signer.verify(token) == (None, 0)
+
+
+def test_expired():
+    signer = session.SessionSigner("secret", ttl=-1)
+
+    assert signer.verify(signer.issue("someone")) == (None, 0)
+
+
+@pytest.mark.parametrize("token", [
+    None, "", "garbage", "a.b", "a.b.c.d", "a.notanumber.c", "!!!.{}.abc".format(int(time.time()) + 60), "a.1.é",
+])
+def test_malformed(signer, token):
+    assert signer.verify(token) == (None, 0)
+
+
+def test_bad_username_encoding(signer):
+    payload = "{}.{}".format(base64.urlsafe_b64encode(b"\xff\xfe").decode('ascii'), int(time.time()) + 60)
+
+    assert signer.verify("{}.{}".format(payload, signer.sign(payload))) == (None, 0)
+
+
+def test_credential_cache():
+    credentials = session.CredentialCache(ttl=60)
+    credentials.add("someone", "password")
+
+    assert ("someone", "password") in credentials
+    assert ("someone", "other") not in credentials
+
+
+class FakeAuthorization:
+    """
+    The authorization service, every user's password is "password".
+    """
+
+    def __init__(self):
+        self.calls = []
+
+    def post(self, path, data=None, idempotent=False):
+        self.calls.append((path, data))
+
+        return data == "password"
+
+
+@pytest.fixture
+def gateway(make_config):
+    gateway = GatewayService(make_config(credential_cache_ttl=0), redis_client=fakeredis.FakeRedis())
+    gateway.authentication_service = FakeAuthorization()
+
+    return gateway
+
+
+def basic(username, password):
+    credentials = "{}:{}".format(username, password).encode('utf-8')
+
+    return "Basic " + base64.b64encode(credentials).decode('ascii')
+
+
+def get(gateway, cookie=None, authorization=None):
+    req = Request.blank('/new')
+
+    if cookie is not None:
+        req.cookies[SESSION_COOKIE] = cookie
+
+    if authorization is not None:
+        req.authorization = authorization
+
+    return req.get_response(gateway)
+
+
+def test_basic_auth_gets_token(gateway):
+    res = get(gateway, authorization=basic("someone", "password"))
+
+    assert res.status_int == 200
+    assert gateway.authentication_service.calls == [("/someone", "password")]
+
+    token = res.headers['Set-Cookie'].split(";")[0].split("=", 1)[1]
+
+    assert gateway.sessions.verify(token)[0] == "someone"
+    assert "HttpOnly" in res.headers['Set-Cookie']
+
+
+def test_wrong_password(gateway):
+    res = get(gateway, authorization=basic("someone", "wrong"))
+
+    assert res.status_int == 401
+    assert 'Set-Cookie' not in res.headers
+
+
+def test_token_skips_authorization(gateway):
+    res = get(gateway, cookie=gateway.sessions.issue("someone"))
+
+    assert res.status_int == 200
+    assert gateway.authentication_service.calls == []
+    # not half spent, not replaced
+    assert 'Set-Cookie' not in res.headers
+
+
+def test_token_with_matching_credentials(gateway):
+    res = get(gateway, cookie=gateway.sessions.issue("someone"), authorization=basic("someone", "wrong"))
+
+    assert res.status_int == 200
+    assert gateway.authentication_service.calls == []
+
+
+def test_token_for_another_user(gateway):
+    res = get(gateway, cookie=gateway.sessions.issue("someone"), authorization=basic("other", "wrong"))
+
+    assert res.status_int == 401
+    assert gateway.authentication_service.calls == [("/other", "wrong")]
+
+
+@pytest.mark.parametrize("cookie", ["garbage", "c29tZW9uZQ.99999999999.0000"])
+def test_bad_token_rejected(gateway, cookie):
+    assert get(gateway, cookie=cookie).status_int == 401
+
+
+def test_expired_token_rejected(gateway, monkeypatch):
+    token = gateway.sessions.issue("someone")
+    later = time.time() + gateway.sessions.ttl + 1
+    monkeypatch.setattr(session.time, 'time', lambda: later)
+
+    assert get(gateway, cookie=token).status_int == 401
+
+
+def test_token_renewed_when_half_spent(gateway, monkeypatch):
+    token = gateway.sessions.issue("someone")
+    later = time.time() + gateway.sessions.ttl * 0.75
+    monkeypatch.setattr(session.time, 'time', lambda: later)
+
+    res = get(gateway, cookie=token)
+
+    assert res.status_int == 200
+    assert SESSION_COOKIE in res.headers['Set-Cookie']
+
+
+def test_authorization_down(gateway):
+    class Down:
+        def post(self, path, data=None, idempotent=False):
+            raise wrapper.TooManyRetries()
+
+    gateway.authentication_service = Down()
+
+    res = get(gateway, authorization=basic("someone", "password"))
+
+    assert b"trouble with the back-end" in res.body
+    assert "Set-Cookie" not in res.headers
@@ -1,6 +1,13 @@
 from linkapp.gateway.wsgi import GatewayService
+from linkapp.gateway.compress import CompressionMiddleware
 from linkapp.gateway.config import GatewayConfig
 
 config = GatewayConfig()
 
-app = GatewayService(config)
\ No newline at end of file
+service = GatewayService(config)
+
+app = CompressionMiddleware(service, 
+                            min_size=config.compress_min_size, 
+                            level=config.compress_level,
+                            cache_size=config.compress_cache_size,
+                            registry=service.registry)
\ No newline at end of file